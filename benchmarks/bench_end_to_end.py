@@ -0,0 +1,156 @@
+"""End-to-end POST throughput, POST-to-frame latency, TX jitter and CPU per channel.
+
+The HTTP ingest server and the ANT+ channel manager run in process on the
+simulated ANT backend (``sim_module``), so neither openant nor an ANT+ stick
+is needed. Client threads POST speed samples over keep-alive connections,
+spread over all sensors; every broadcast frame is timestamped by the
+simulated channel.
+
+- POST throughput: acknowledged POSTs per second of the load phase.
+- POST-to-frame latency: from sending a POST to the first frame of its
+  sensor broadcast after the acknowledge (bounded by the channel period).
+- TX jitter: deviation of frame intervals from the channel period.
+- CPU per channel: process CPU time of an idle phase (TX only) divided by
+  channel count, and total CPU time of the load phase.
+
+Usage::
+
+    PYTHONPATH=src python benchmarks/bench_end_to_end.py [--server-mode asyncio|threaded] [--channels N] [--clients N] [--duration S]
+"""
+import argparse
+import bisect
+import http.client
+import logging
+import threading
+import time
+
+from tpvirtserver import SharedData
+from tpvirtserver.ant_module import AntBikeSpeed, AntChannelManager, Channel_Period
+from tpvirtserver.http_module import TPVHttpServer
+from tpvirtserver.aio_http_module import TPVAsyncHttpServer
+from tpvirtserver.ingest_module import PostOptions, ACK_MODES, POST_PARSERS
+
+FIRST_DEVICE_NUMBER = 20000
+
+
+def percentile(values, fraction):
+    """Return ``fraction`` percentile of sorted ``values`` (nearest rank)."""
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def client(address, devices, offset, deadline, results, errors):
+    """POST speed samples round robin to ``devices`` until ``deadline``."""
+    connection = http.client.HTTPConnection(*address)
+    index = offset
+    while time.monotonic() < deadline:
+        device = devices[index % len(devices)]
+        index += 1
+        body = b'{"speed": %d}' % (5000 + index % 3000)
+        sent = time.monotonic_ns()
+        try:
+            connection.request("POST", f"/sensor/{device}", body, {"Content-Type": "application/json"})
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            errors.append(device)
+            connection.close()
+            continue
+        if response.status >= 300:
+            errors.append(device)
+            continue
+        results.append((device, sent, time.monotonic_ns()))
+    connection.close()
+
+
+def frame_times(channel, start_ns, end_ns):
+    return [t for t, _ in channel.frames if start_ns <= t <= end_ns]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--server-mode", choices=("asyncio", "threaded"), default="asyncio")
+    parser.add_argument("--ack-mode", choices=ACK_MODES, default="minimal")
+    parser.add_argument("--post-parser", choices=POST_PARSERS, default="json")
+    parser.add_argument("--channels", type=int, default=4, help="simulated sensors (ANT+ channels)")
+    parser.add_argument("--clients", type=int, default=4, help="concurrent POST client threads")
+    parser.add_argument("--duration", type=float, default=5.0, help="load phase [s]")
+    parser.add_argument("--idle", type=float, default=2.0, help="idle phase (TX only) [s]")
+    parser.add_argument("--channel-period", type=int, default=Channel_Period, help="channel period [1/32768 s]")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logger = logging.getLogger()
+
+    shared_data = SharedData()
+    devices = [FIRST_DEVICE_NUMBER + i for i in range(args.channels)]
+    manager = AntChannelManager(logger, args.channels, backend="sim")
+    for device in devices:
+        state = shared_data.add_sensor(device)
+        manager.add_sensor(AntBikeSpeed(state, logger, device, channel_period=args.channel_period, backend="sim"))
+
+    server_class = TPVHttpServer if args.server_mode == "threaded" else TPVAsyncHttpServer
+    options = PostOptions(args.ack_mode, args.post_parser)
+    server = server_class("127.0.0.1", 0, False, None, None, shared_data, logger, options)
+    server.start()
+    address = server.server_address if args.server_mode == "asyncio" else server.httpd.server_address
+    manager.start()
+    channels = {sensor.device_number: sensor.channel for sensor in manager.sensors}
+    period_ns = args.channel_period * 1000000000 // 32768
+
+    try:
+        # idle phase: TX cost only
+        idle_start, cpu_start = time.monotonic_ns(), time.process_time()
+        time.sleep(args.idle)
+        idle_cpu = time.process_time() - cpu_start
+        idle_end = time.monotonic_ns()
+
+        # load phase
+        results, errors = [], []
+        deadline = time.monotonic() + args.duration
+        threads = [
+            threading.Thread(target=client, args=(address, devices, i, deadline, results, errors))
+            for i in range(args.clients)
+        ]
+        load_start, cpu_start = time.monotonic_ns(), time.process_time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        load_cpu = time.process_time() - cpu_start
+        load_end = time.monotonic_ns()
+        # let the last POSTs reach a frame
+        time.sleep(2 * period_ns / 1e9)
+    finally:
+        manager.stop()
+        server.stop()
+
+    latencies = []
+    for device, sent, acked in results:
+        times = [t for t, _ in channels[device].frames]
+        i = bisect.bisect_left(times, acked)
+        if i < len(times):
+            latencies.append((times[i] - sent) / 1e6)
+    latencies.sort()
+
+    jitter = []
+    idle_frames = 0
+    for channel in channels.values():
+        times = frame_times(channel, load_start, load_end)
+        jitter.extend(abs(b - a - period_ns) / 1e6 for a, b in zip(times, times[1:]))
+        idle_frames += len(frame_times(channel, idle_start, idle_end))
+    jitter.sort()
+
+    load_seconds = (load_end - load_start) / 1e9
+    print(f"server {args.server_mode}, ack {args.ack_mode}, parser {args.post_parser}, "
+          f"{args.channels} channel(s), {args.clients} client(s), period {period_ns / 1e6:.1f} ms")
+    print(f"POST throughput   {len(results) / load_seconds:10.0f} req/s ({len(results)} ok, {len(errors)} failed)")
+    print(f"POST-to-frame     p50 {percentile(latencies, 0.5):7.1f} ms  p99 {percentile(latencies, 0.99):7.1f} ms  max {percentile(latencies, 1.0):7.1f} ms")
+    print(f"TX jitter (load)  p50 {percentile(jitter, 0.5):7.2f} ms  p99 {percentile(jitter, 0.99):7.2f} ms  max {percentile(jitter, 1.0):7.2f} ms")
+    print(f"CPU idle          {idle_cpu / args.idle / args.channels * 100:7.3f} % per channel ({idle_frames} frames)")
+    print(f"CPU load          {load_cpu / load_seconds * 100:7.1f} % total")
+
+
+if __name__ == "__main__":
+    main()
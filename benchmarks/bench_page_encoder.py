@@ -0,0 +1,113 @@
+"""Per-frame cost of the ANT+ speed page generator.
+
+Compares ``SpeedPageEncoder.encode`` with the float/branching generator it
+replaced in ``AntBikeSpeed.Create_Next_DataPage_Speed`` and reports the
+encoder of every profile in ``ANT_PROFILES``.
+
+Usage::
+
+    PYTHONPATH=src python benchmarks/bench_page_encoder.py [--frames N]
+"""
+import argparse
+import threading
+import timeit
+
+from tpvirtserver.page_module import SpeedPageEncoder, KMH_TO_MM_S, ANT_PROFILES
+
+CHANNEL_PERIOD = 8118
+
+
+class LegacySpeedPage:
+    """Frame generator as implemented before ``SpeedPageEncoder``."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.BikeSpeed = 30.0
+        self.ANTMessageCount_Speed = 0
+        self.ANTMessagePayload_Speed = [0, 0, 0, 0, 0, 0, 0, 0]
+        self.event_interval = 1.0 * CHANNEL_PERIOD / 32768
+        self.LastBikeSpeed = 0.0
+        self.TotalWheelRotations = 0.0
+        self.TotalIntervals = 0
+        self.wheel_circumference = 2.105
+
+    def next_page(self):
+        self.ANTMessageCount_Speed += 1
+        self.TotalIntervals += 1
+        BikeSpeedEventTimeFull = 1024.0 * self.TotalIntervals / self.event_interval
+        with self.lock:
+            avg_speed = 0.5 * (self.BikeSpeed + self.LastBikeSpeed) / 3.6
+            self.LastBikeSpeed = self.BikeSpeed
+        distance_traveled = avg_speed / self.event_interval
+        rotations = distance_traveled / self.wheel_circumference
+        self.TotalWheelRotations += rotations
+        event_time = int(BikeSpeedEventTimeFull)
+        full_rotations = int(self.TotalWheelRotations)
+        payload = self.ANTMessagePayload_Speed
+        if self.ANTMessageCount_Speed <= 2:
+            payload[0] = 0x02
+            payload[1] = 1
+            payload[2] = 0xFF
+            payload[3] = 0xFF
+        elif self.ANTMessageCount_Speed <= 4:
+            payload[0] = 0x03
+            payload[3] = 1
+            payload[7] = 1
+        else:
+            payload[0] = 0x00
+            payload[1] = 0xFF
+            payload[2] = 0xFF
+            payload[3] = 0xFF
+        payload[4] = event_time & 0xFF
+        payload[5] = (event_time >> 8) & 0xFF
+        payload[6] = full_rotations & 0xFF
+        payload[7] = (full_rotations >> 8) & 0xFF
+        if (self.ANTMessageCount_Speed >> 2) & 0x01:
+            payload[0] ^= 0x80
+        if self.ANTMessageCount_Speed > 68:
+            self.ANTMessageCount_Speed = 0
+        return payload
+
+
+class EncoderSpeedPage:
+    """Frame generator as used by ``AntBikeSpeed`` now."""
+
+    def __init__(self):
+        self.BikeSpeed = 30.0
+        self.encoder = SpeedPageEncoder(CHANNEL_PERIOD)
+
+    def next_page(self):
+        return self.encoder.encode(int(self.BikeSpeed * KMH_TO_MM_S))
+
+
+class ProfilePage:
+    """Frames of one profile encoder with all values set."""
+
+    def __init__(self, profile):
+        self.encoder = profile.encoder(profile.channel_period)
+
+    def next_page(self):
+        return self.encoder.encode(8333, None, 90, 250, 140)
+
+
+def bench(generator, frames, repeat):
+    best = min(timeit.repeat(generator.next_page, number=frames, repeat=repeat))
+    return best / frames * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    legacy = bench(LegacySpeedPage(), args.frames, args.repeat)
+    encoder = bench(EncoderSpeedPage(), args.frames, args.repeat)
+    print(f"legacy generator : {legacy:8.1f} ns/frame")
+    print(f"SpeedPageEncoder : {encoder:8.1f} ns/frame ({legacy / encoder:.2f}x faster)")
+    for name, profile in ANT_PROFILES.items():
+        print(f"{name:17s}: {bench(ProfilePage(profile), args.frames, args.repeat):8.1f} ns/frame")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Cost of ``handle_post`` for a large TPV payload per ``PostOptions`` mode.
+
+Usage::
+
+    PYTHONPATH=src python benchmarks/bench_post_parser.py [--riders N]
+"""
+import argparse
+import json
+import timeit
+
+from tpvirtserver import SharedData
+from tpvirtserver.ingest_module import handle_post, PostOptions, load_orjson
+
+
+def tpv_payload(riders):
+    """Build a list payload similar to TPV broadcast data."""
+    return json.dumps([
+        {
+            "name": f"Rider {i}", "speed": 8000 + i, "power": 250, "cadence": 90,
+            "heartrate": 140, "distance": 12345.6, "altitude": 123.4, "slope": 1.5,
+            "position": {"x": 1.0 * i, "y": 2.0, "z": 3.0}, "team": "club", "lap": 2,
+        }
+        for i in range(riders)
+    ]).encode("utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--riders", type=int, default=20, help="objects in the payload list")
+    parser.add_argument("--number", type=int, default=5000)
+    args = parser.parse_args()
+
+    shared_data = SharedData()
+    body = tpv_payload(args.riders)
+    modes = [("full/json", PostOptions("full", "json")), ("minimal/json", PostOptions("minimal", "json"))]
+    if load_orjson() is not None:
+        modes.append(("minimal/orjson", PostOptions("minimal", "orjson")))
+    modes.append(("none/fast", PostOptions("none", "fast")))
+
+    print(f"payload {len(body)} bytes")
+    for name, options in modes:
+        def run():
+            status, response = handle_post(shared_data, body, None, "/", options)
+            # response serialization is part of the cost
+            if isinstance(response, dict):
+                json.dumps(response)
+        cost = min(timeit.repeat(run, number=args.number, repeat=3)) / args.number * 1e6
+        print(f"{name:16s} {cost:8.2f} us/POST")
+
+
+if __name__ == "__main__":
+    main()
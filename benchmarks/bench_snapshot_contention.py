@@ -0,0 +1,88 @@
+"""Cost of the ANT+ TX speed read under heavy POST load.
+
+A TX thread repeatedly reads the sensor speed while writer threads publish
+new speeds as fast as possible (simulating a POST flood). The read is done
+either under a shared ``threading.Lock`` (as ``Create_Next_DataPage_Speed``
+did before) or from the lock-free ``SpeedState.snapshot``.
+
+Usage::
+
+    PYTHONPATH=src python benchmarks/bench_snapshot_contention.py [--writers N]
+"""
+import argparse
+import threading
+import time
+
+from tpvirtserver import SpeedState
+
+
+class LockedState:
+    """Speed guarded by one plain lock, as before ``SpeedSnapshot``."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.BikeSpeed = 0.0
+        self.last_post_time = None
+
+    def update(self, speed, last_post_time):
+        with self.lock:
+            self.BikeSpeed = speed
+            self.last_post_time = last_post_time
+
+
+def locked_read(state):
+    with state.lock:
+        return state.BikeSpeed
+
+
+def snapshot_read(state):
+    return state.snapshot.speed
+
+
+def run(state, read, writers, reads):
+    stop = threading.Event()
+
+    def writer():
+        speed = 0.0
+        while not stop.is_set():
+            speed += 1.0
+            state.update(speed, time.time())
+
+    threads = [threading.Thread(target=writer) for _ in range(writers)]
+    for t in threads:
+        t.start()
+
+    samples = []
+    perf_counter_ns = time.perf_counter_ns
+    for _ in range(reads):
+        start = perf_counter_ns()
+        read(state)
+        samples.append(perf_counter_ns() - start)
+
+    stop.set()
+    for t in threads:
+        t.join()
+    samples.sort()
+    return samples
+
+
+def report(name, samples):
+    def pct(p):
+        return samples[min(len(samples) - 1, int(len(samples) * p))] / 1000.0
+    print(f"{name:18s} p50 {pct(0.5):8.2f} us  p99 {pct(0.99):8.2f} us  p99.9 {pct(0.999):8.2f} us  max {samples[-1] / 1000.0:8.2f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=4, help="number of POST writer threads")
+    parser.add_argument("--reads", type=int, default=200000, help="number of TX reads measured")
+    args = parser.parse_args()
+
+    for writers in (0, args.writers):
+        print(f"--- {writers} writer thread(s)")
+        report("locked read", run(LockedState(), locked_read, writers, args.reads))
+        report("snapshot read", run(SpeedState(), snapshot_read, writers, args.reads))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Import time and time until the HTTP port accepts connections.
+
+Each measurement starts a fresh interpreter, like a container restart:
+
+- ``import tpvirtserver.main`` (and whether openant got imported),
+- ``python -m tpvirtserver.main --help``,
+- process start until the HTTP port accepts a TCP connection, and SIGTERM
+  until exit, with the ``sim`` ANT backend (optionally https).
+
+Usage::
+
+    PYTHONPATH=src python benchmarks/bench_startup.py [--repeat N] [--cert-file cert.pem --key-file key.pem]
+"""
+import argparse
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+PORT_TIMEOUT = 10.0
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_python(*args):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, *args], capture_output=True, text=True, check=True)
+    return time.perf_counter() - start, result.stdout
+
+
+def time_to_port(extra_args):
+    """Return (seconds until the port accepts, seconds from SIGTERM to exit)."""
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "tpvirtserver.main", "--ip", "127.0.0.1", "--port", str(port),
+         "--ant-backend", "sim", "--log-level", "WARNING", *extra_args],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if process.poll() is not None or time.perf_counter() - start > PORT_TIMEOUT:
+                    raise RuntimeError("server did not start")
+                time.sleep(0.001)
+        bound = time.perf_counter() - start
+        stop = time.perf_counter()
+        process.send_signal(signal.SIGTERM)
+        process.wait(PORT_TIMEOUT)
+        return bound, time.perf_counter() - stop
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def report(name, values):
+    values = [v * 1000 for v in values]
+    print(f"{name:28s} median {statistics.median(values):7.1f} ms  min {min(values):7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--cert-file", help="also measure https startup with this certificate chain")
+    parser.add_argument("--key-file")
+    args = parser.parse_args()
+
+    src = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src")
+    os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [src, os.environ.get("PYTHONPATH")]))
+
+    report("interpreter", [run_python("-c", "pass")[0] for _ in range(args.repeat)])
+    report("import tpvirtserver.main", [run_python("-c", "import tpvirtserver.main")[0] for _ in range(args.repeat)])
+    _, loaded = run_python("-c", "import sys, tpvirtserver.main; print('openant' in sys.modules)")
+    print(f"{'openant imported':28s} {loaded.strip()}")
+    report("--help", [run_python("-m", "tpvirtserver.main", "--help")[0] for _ in range(args.repeat)])
+
+    modes = [("asyncio", ["--server-mode", "asyncio"]), ("threaded", ["--server-mode", "threaded"])]
+    if args.cert_file:
+        tls = ["--use-ssl", "--cert-file", args.cert_file, "--key-file", args.key_file]
+        modes += [(f"{name} https", extra + tls) for name, extra in modes]
+    for name, extra in modes:
+        results = [time_to_port(extra) for _ in range(args.repeat)]
+        report(f"port bound ({name})", [bound for bound, _ in results])
+        report(f"shutdown ({name})", [stopped for _, stopped in results])
+
+
+if __name__ == "__main__":
+    main()
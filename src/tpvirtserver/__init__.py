@@ -1,11 +1,316 @@
 import threading
 import queue
+import time
+from collections import namedtuple, OrderedDict
 
-class SharedData:
-    def __init__(self):
+from .metrics_module import STATE_LOCK_WAIT, COMMANDS_COALESCED, COMMANDS_REJECTED
+from .estimator_module import SampleBuffer, create_estimator, speed_at, MAX_RATE, SPEED_ZERO_AFTER
+from .recorder_module import RECORDER
+
+# Batch clients keep their clock offset while its estimate grows less than this [s]
+BATCH_OFFSET_TOLERANCE = 1.0
+# distinct commands waiting for the main loop, more are rejected
+COMMAND_QUEUE_SIZE = 64
+
+# Immutable, versioned record of estimated sensor speed (km/h) and its rate of
+# change ((km/h)/s) at the last POST time.
+SpeedSnapshot = namedtuple("SpeedSnapshot", ["speed", "last_post_time", "sequence", "rate"])
+# Cadence [rpm], power [W] and heart rate [bpm] of the last POST carrying any
+# of them (None: not sent) and its receive time, sent as received by the
+# ANT+ profiles using them.
+SensorMetrics = namedtuple("SensorMetrics", ["cadence", "power", "heart_rate", "time"])
+NO_METRICS = SensorMetrics(None, None, None, None)
+
+class SpeedState:
+    """Speed of one virtual sensor.
+
+    Writers (POST handlers, main loop) serialize on ``lock`` and publish a new
+    ``SpeedSnapshot`` with an incremented sequence number. Publishing is a
+    single reference assignment, so readers such as the ANT+ TX callback take
+    ``snapshot`` without any lock and always see a consistent record.
+
+    Received samples go to ``samples`` and ``estimator`` turns them into the
+    published speed and rate; ``speed_at()`` evaluates the snapshot at any
+    time (extrapolation and decay, see ``estimator_module``).
+
+    ``BikeSpeed`` and ``last_post_time`` are kept as properties over the
+    snapshot; their setters take ``lock`` (reentrant, so read-modify-write
+    under ``with state.lock`` is fine).
+    """
+
+    def __init__(self, device_number=None, estimator="linear"):
+        self.lock = threading.RLock()
+        self.snapshot = SpeedSnapshot(0, None, 0, 0.0)
+        self.device_number = device_number
+        self.samples = SampleBuffer()
+        self.estimator = create_estimator(estimator)
+        # shm_module.SpeedTable every snapshot is also written to (multiprocess mode)
+        self.table = None
+        self.table_slot = None
+        # receive time minus client time of batch samples, see update_batch()
+        self.batch_offset = None
+        # published like snapshot, see update_metrics()
+        self.metrics = NO_METRICS
+        # ANT+ profile of this sensor (page_module.ANT_PROFILES), selects the POST fields used
+        self.profile = "speed"
+
+    def attach_table(self, table, slot):
+        """Also publish every snapshot into ``slot`` of shared ``table``."""
+        with self.lock:
+            self.table = table
+            self.table_slot = slot
+            self._publish(self.snapshot)
+
+    def _publish(self, snapshot):
+        self.snapshot = snapshot
+        if self.table is not None:
+            self.table.write(self.table_slot, snapshot.speed, snapshot.rate, snapshot.last_post_time)
+
+    def _set(self, snapshot):
+        # publish a snapshot not derived from a sample
+        self._publish(snapshot)
+        if RECORDER.enabled:
+            RECORDER.state(self.device_number, snapshot)
+
+    def set_estimator(self, name):
+        """Replace the speed estimator by a new one named ``name``."""
+        estimator = create_estimator(name)
+        with self.lock:
+            self.estimator = estimator
+            self.samples.clear()
+
+    def _acquire(self):
+        lock = self.lock
+        if not lock.acquire(False):
+            # only contended acquisitions are timed
+            start = time.perf_counter()
+            lock.acquire()
+            STATE_LOCK_WAIT.observe(time.perf_counter() - start)
+
+    def _estimate(self, speed, last_post_time, previous):
+        # add one sample, return estimated (speed, rate); caller holds lock
+        if previous is None or last_post_time - previous > SPEED_ZERO_AFTER:
+            # new session, older samples say nothing about it
+            self.samples.clear()
+            self.estimator.reset()
+        self.samples.append(last_post_time, speed)
+        speed, rate = self.estimator.update(self.samples)
+        return speed, max(-MAX_RATE, min(MAX_RATE, rate))
+
+    def update(self, speed, last_post_time):
+        """Add sample of speed (km/h) received at ``last_post_time``, publish the new estimate."""
+        self._acquire()
+        try:
+            snapshot = self.snapshot
+            estimate, rate = self._estimate(speed, last_post_time, snapshot.last_post_time)
+            sequence = snapshot.sequence + 1
+            self._publish(SpeedSnapshot(estimate, last_post_time, sequence, rate))
+            if RECORDER.enabled:
+                RECORDER.sample(self.device_number, sequence, speed, last_post_time)
+        finally:
+            self.lock.release()
+
+    def update_batch(self, samples, received):
+        """Add ``(speed, client time)`` samples (km/h, oldest first) in one lock acquisition.
+
+        Client times are mapped to server time with ``batch_offset``, the
+        smallest ``received`` minus newest client time seen so far (least
+        delayed batch). It is kept while new batches give an offset at most
+        ``BATCH_OFFSET_TOLERANCE`` larger, so a sample resent after a failed
+        upload maps to the same time again; a larger offset (client clock
+        step, new session) replaces it.
+
+        Every sample goes through the estimator as with ``update()``, one
+        estimate is published after the last. Samples not newer than the
+        last stored one are skipped.
+
+        Returns
+        -------
+        int
+            Number of samples applied.
+        """
+        self._acquire()
+        try:
+            offset = received - samples[-1][1]
+            if self.batch_offset is not None and 0.0 <= offset - self.batch_offset < BATCH_OFFSET_TOLERANCE:
+                offset = self.batch_offset
+            self.batch_offset = offset
+            snapshot = self.snapshot
+            previous = snapshot.last_post_time
+            applied = []
+            for speed, client_time in samples:
+                last_post_time = client_time + offset
+                if previous is not None and last_post_time <= previous:
+                    continue
+                estimate, rate = self._estimate(speed, last_post_time, previous)
+                previous = last_post_time
+                applied.append((speed, last_post_time))
+            if applied:
+                sequence = snapshot.sequence + 1
+                self._publish(SpeedSnapshot(estimate, previous, sequence, rate))
+                if RECORDER.enabled:
+                    for speed, last_post_time in applied:
+                        RECORDER.sample(self.device_number, sequence, speed, last_post_time)
+            return len(applied)
+        finally:
+            self.lock.release()
+
+    def update_metrics(self, cadence, power, heart_rate, received):
+        """Publish cadence, power and heart rate (None: not sent) received at ``received``.
+
+        A single reference assignment like ``snapshot``; no estimation, the
+        values are held until the next update.
+        """
+        metrics = SensorMetrics(cadence, power, heart_rate, received)
+        self.metrics = metrics
+        if self.table is not None:
+            self.table.write_metrics(self.table_slot, metrics)
+
+    def speed_at(self, now):
+        """Estimated speed (km/h) at ``now`` (``time.time()``), lock free."""
+        return speed_at(self.snapshot, now)
+
+    @property
+    def BikeSpeed(self):
+        return self.snapshot.speed
+
+    @BikeSpeed.setter
+    def BikeSpeed(self, speed):
+        with self.lock:
+            snapshot = self.snapshot
+            self._set(SpeedSnapshot(speed, snapshot.last_post_time, snapshot.sequence + 1, 0.0))
+
+    @property
+    def last_post_time(self):
+        return self.snapshot.last_post_time
+
+    @last_post_time.setter
+    def last_post_time(self, last_post_time):
+        with self.lock:
+            snapshot = self.snapshot
+            self._set(SpeedSnapshot(snapshot.speed, last_post_time, snapshot.sequence + 1, snapshot.rate))
+
+class CommandQueue:
+    """Bounded main loop command queue coalescing repeated commands.
+
+    A command equal to one still waiting is merged into it and moved to the
+    end, so the main loop runs it once, in the order of the last request:
+    ``ANT_START``/``ANT_STOP`` are kept once, the ``PendingCommand`` of a
+    waiting request is chained to the queued one, ``CHANNEL_CONFIG`` of one
+    device merges the settings. Same ``put()``, ``get_nowait()`` and
+    ``qsize()`` as ``queue.Queue``; ``put()`` raises ``queue.Full`` when
+    ``maxsize`` distinct commands wait.
+    """
+
+    def __init__(self, maxsize=COMMAND_QUEUE_SIZE):
+        self.maxsize = maxsize
         self.lock = threading.Lock()
-        self.BikeSpeed = 0
-        self.last_post_time = None
-        self.command_queue = queue.Queue()
-        
-shared_data = SharedData()
\ No newline at end of file
+        # coalescing key -> command, in run order
+        self.commands = OrderedDict()
+
+    @staticmethod
+    def _key(command):
+        if not isinstance(command, tuple):
+            return command
+        if command[0] == "CHANNEL_CONFIG":
+            return command[:2]
+        return command[0]
+
+    @staticmethod
+    def _merge(queued, command):
+        if not isinstance(command, tuple):
+            return queued
+        if command[0] == "CHANNEL_CONFIG":
+            return (command[0], command[1], dict(queued[2], **command[2]))
+        # (command, PendingCommand)
+        if not isinstance(queued, tuple):
+            return command
+        queued[1].chain(command[1])
+        return queued
+
+    def put(self, command):
+        key = self._key(command)
+        with self.lock:
+            queued = self.commands.get(key)
+            if queued is None:
+                if len(self.commands) >= self.maxsize:
+                    COMMANDS_REJECTED.inc()
+                    raise queue.Full
+                self.commands[key] = command
+                return
+            self.commands[key] = self._merge(queued, command)
+            self.commands.move_to_end(key)
+        COMMANDS_COALESCED.inc()
+
+    def get_nowait(self):
+        with self.lock:
+            if not self.commands:
+                raise queue.Empty
+            return self.commands.popitem(last=False)[1]
+
+    def qsize(self):
+        return len(self.commands)
+
+
+class SharedData(SpeedState):
+    def __init__(self):
+        super().__init__()
+        self.command_queue = CommandQueue()
+        # set on new commands and POSTs to wake up the main loop
+        self.wakeup = threading.Event()
+        # ANT+ running, kept by the main loop; POSTs skip the wakeup while it runs
+        self.runningAnt = False
+        # device number -> SpeedState; the first sensor is SharedData itself
+        self.sensors = {}
+        # SessionRegistry mapping clients to sensors, None routes by path only
+        self.sessions = None
+        # callable returning ANT+ Node and channel state, set by the process running ANT+
+        self.ant_status = None
+        # StoreReader answering GET /rides/, None without --store
+        self.store = None
+        self.estimator_name = self.estimator.name
+
+    def set_estimator(self, name):
+        """Use estimator ``name`` for the default sensor and every sensor added later."""
+        super().set_estimator(name)
+        self.estimator_name = name
+
+    def put_command(self, command):
+        """Queue ``command`` for the main loop and wake it up.
+
+        Raises
+        ------
+        queue.Full
+            If the command queue is full.
+        """
+        self.command_queue.put(command)
+        self.wakeup.set()
+
+    def add_sensor(self, device_number, state=None):
+        """Register sensor ``device_number`` and return its speed state.
+
+        The first registered sensor is the default one and shares the state
+        of ``SharedData`` itself, every other sensor gets its own
+        ``SpeedState``. A given ``state`` (e.g. a shared memory table slot)
+        is registered as is.
+        """
+        if device_number in self.sensors:
+            raise ValueError(f"Sensor {device_number} already registered")
+        if state is None:
+            if not self.sensors:
+                self.device_number = device_number
+                state = self
+            else:
+                state = SpeedState(device_number, self.estimator_name)
+        self.sensors[device_number] = state
+        return state
+
+    def get_sensor(self, device_number):
+        """Return speed state of sensor ``device_number`` or None."""
+        return self.sensors.get(device_number)
+
+    def all_sensors(self):
+        """Return speed states of all sensors (``SharedData`` alone if none registered)."""
+        return list(self.sensors.values()) if self.sensors else [self]
+
+shared_data = SharedData()
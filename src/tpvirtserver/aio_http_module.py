@@ -0,0 +1,496 @@
+import asyncio
+import base64
+import hashlib
+import json
+import threading
+import logging
+import socket
+import time
+from urllib.parse import urlparse
+
+from .metrics_module import POST_REQUESTS, POST_REJECTED, POST_DURATION
+from .ingest_module import handle_get, handle_post, is_stream_path, resolve_sensor, unresolved_response, StreamDecoder, DEFAULT_POST_OPTIONS
+from .ingest_module import PendingCommand, STATUS_STREAM_PATH, STATUS_STREAMS, status_event, status_stream_interval
+from .ingest_module import TOO_MANY_REQUESTS_BODY, STORE_PATH_PREFIX, rate_limit_headers
+from .session_module import request_token, SESSION_TOKEN_HEADER
+from .log_module import LogRateLimit
+
+# Definition of Variables
+MAX_HEADER_COUNT = 100
+KEEP_ALIVE_TIMEOUT = 75.0       # idle keep-alive connection timeout [s]
+SSL_HANDSHAKE_TIMEOUT = 10.0    # TLS handshake timeout [s]
+STREAM_IDLE_TIMEOUT = 300.0     # idle WebSocket stream timeout [s]
+STREAM_READ_SIZE = 64 * 1024
+MAX_WEBSOCKET_FRAME = 1024 * 1024
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+# per request debug messages
+REQUEST_LOG = LogRateLimit()
+
+REASONS = {
+    200: "OK",
+    202: "Accepted",
+    204: "No Content",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+    504: "Gateway Timeout",
+}
+
+
+def websocket_unmask(payload, mask):
+    """Unmask client WebSocket payload (XOR with repeated 4-byte ``mask``)."""
+    length = len(payload)
+    key = (mask * (length // 4 + 1))[:length]
+    return (int.from_bytes(payload, "little") ^ int.from_bytes(key, "little")).to_bytes(length, "little")
+
+
+def websocket_frame(opcode, payload=b""):
+    """Build unmasked single-frame server message."""
+    length = len(payload)
+    if length < 126:
+        header = bytes((0x80 | opcode, length))
+    elif length < 0x10000:
+        header = bytes((0x80 | opcode, 126)) + length.to_bytes(2, "big")
+    else:
+        header = bytes((0x80 | opcode, 127)) + length.to_bytes(8, "big")
+    return header + payload
+
+
+class HttpProtocolError(Exception):
+    """Malformed request; connection is answered with ``status`` and closed."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# ======================================================
+# Asyncio HTTPD
+# ======================================================
+class TPVAsyncHttpServer:
+    """Asyncio based ingest server with the same interface as ``TPVHttpServer``.
+
+    All connections are served by one event loop running in a background
+    thread. Connections are HTTP/1.1 keep-alive, pipelined requests are
+    answered in order and TLS handshakes are performed by the event loop
+    without blocking other clients.
+
+    Routes and JSON responses are shared with ``TPVHttpServer`` through
+    ``ingest_module``. Streaming ingest (``[/sensor/<n>]/stream``) accepts
+    NDJSON over a chunked POST or a WebSocket.
+    """
+
+    def __init__(self, ip: str, port: int, use_ssl: bool, certFilePath :str | None, keyFilePath :str | None, shared_data, logger, post_options=DEFAULT_POST_OPTIONS, reuse_port=False, tls_profile="compat"):
+        self.logger = logger.getChild("AsyncHttpServer")
+        self.request_logger = self.logger.getChild("TPVHttpPRequestHandler")
+
+        self.ip = ip
+        self.port = port
+        self.shared_data = shared_data
+        self.post_options = post_options
+        # SO_REUSEPORT, lets several ingest worker processes share the port
+        self.reuse_port = reuse_port
+        self.server_address = None
+
+        # loaded in start(), after the port is bound
+        self.use_ssl = use_ssl
+        self.certFilePath = certFilePath
+        self.keyFilePath = keyFilePath
+        self.tls_profile = tls_profile
+        self.tls = None
+        self.ssl_context = None
+
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self._started = threading.Event()
+        self._start_error = None
+        self._writers = set()
+
+    def start(self):
+        """Start event loop thread and wait until the listening socket is bound."""
+        self._started.clear()
+        self._start_error = None
+        self.thread = threading.Thread(target=self._serve, name="TPVAsyncHttpServer")
+        self.thread.start()
+        self._started.wait()
+        if self._start_error is not None:
+            self.thread.join()
+            raise self._start_error
+
+    def _serve(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            # bind first, clients connecting while certificates load wait in the backlog
+            family = socket.AF_INET6 if ":" in self.ip else socket.AF_INET
+            sock = socket.create_server((self.ip, self.port), family=family, backlog=128, reuse_port=self.reuse_port)
+            if self.use_ssl and self.ssl_context is None:
+                from .tls_module import CertificateReloader
+                try:
+                    self.tls = CertificateReloader(self.certFilePath, self.keyFilePath, self.tls_profile, self.logger)
+                    self.ssl_context = self.tls.context
+                except Exception:
+                    sock.close()
+                    raise
+            self.server = self.loop.run_until_complete(
+                asyncio.start_server(
+                    self._handle_connection,
+                    sock=sock,
+                    ssl=self.ssl_context,
+                    ssl_handshake_timeout=SSL_HANDSHAKE_TIMEOUT if self.ssl_context else None,
+                )
+            )
+        except Exception as e:
+            self._start_error = e
+            self._started.set()
+            self.loop.close()
+            return
+
+        self.server_address = self.server.sockets[0].getsockname()[:2]
+        self._started.set()
+        if self.logger.isEnabledFor(logging.INFO):
+            actual_ip, actual_port = self.server_address
+            scheme = "https" if self.ssl_context else "http"
+            self.logger.info(f"Async server running on {scheme}://{actual_ip}:{actual_port}/")
+
+        try:
+            self.loop.run_forever()
+        finally:
+            self.server.close()
+            self.loop.run_until_complete(self.server.wait_closed())
+            self._close_connections()
+            self.loop.close()
+
+    def _close_connections(self):
+        # aborting transports wakes handlers with EOF so they finish cleanly
+        for writer in list(self._writers):
+            writer.transport.abort()
+        tasks = [t for t in asyncio.all_tasks(self.loop) if not t.done()]
+        if tasks:
+            _, pending = self.loop.run_until_complete(asyncio.wait(tasks, timeout=2.0))
+            # e.g. connections still in the TLS handshake, they have no writer yet
+            for task in pending:
+                task.cancel()
+            if pending:
+                self.loop.run_until_complete(asyncio.wait(pending))
+
+    def reload_certificates(self, force=False):
+        """Serve new certificate files if they changed (always if ``force``), see ``CertificateReloader``.
+
+        Safe from any thread: handshakes pick up the new certificate context
+        by reference.
+        """
+        return self.tls is not None and self.tls.reload(force)
+
+    def stop(self):
+        self.logger.info("Stopping HTTP server...")
+        if self.loop is not None and self.thread is not None and self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+        self.logger.info("HTTP server stopped.")
+
+    async def _handle_connection(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        self._writers.add(writer)
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+                if request_line in (b"\r\n", b"\n"):
+                    # tolerate empty lines between pipelined requests
+                    continue
+
+                try:
+                    keep_alive = await self._handle_request(request_line, reader, writer, peer)
+                except HttpProtocolError as e:
+                    self._write_response(writer, e.status, {"error": str(e)}, False)
+                    keep_alive = False
+
+                # pipelined requests are read from the same stream buffer and
+                # answered in order
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.logger.exception(f"Error while serving connection {peer}")
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def _handle_request(self, request_line, reader, writer, peer):
+        start = time.perf_counter()
+        try:
+            method, target, version = request_line.decode("latin-1").split()
+        except ValueError:
+            raise HttpProtocolError(400, "Bad request line")
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            if len(headers) >= MAX_HEADER_COUNT:
+                raise HttpProtocolError(400, "Too many headers")
+            name, sep, value = line.decode("latin-1").partition(":")
+            if not sep:
+                raise HttpProtocolError(400, "Bad header line")
+            headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get("connection", "").lower()
+        if version == "HTTP/1.1":
+            keep_alive = connection != "close"
+        else:
+            keep_alive = connection == "keep-alive"
+
+        url = urlparse(target)
+        path = url.path
+        client = peer[0] if peer else None
+        token = request_token(headers.get(SESSION_TOKEN_HEADER.lower()), url.query)
+        response_headers = None
+        if method == "GET":
+            if headers.get("upgrade", "").lower() == "websocket" and is_stream_path(path):
+                await self._serve_websocket(path, headers, reader, writer, client, token)
+                return False
+            if path == STATUS_STREAM_PATH:
+                await self._serve_status_stream(reader, writer, status_stream_interval(url.query))
+                return False
+            if path.startswith(STORE_PATH_PREFIX):
+                # range scans of the ride store take milliseconds, keep them off the event loop
+                status, response = await self.loop.run_in_executor(
+                    None, handle_get, self.shared_data, path, self.request_logger, url.query)
+            else:
+                status, response = handle_get(self.shared_data, path, self.request_logger, url.query)
+            if isinstance(response, PendingCommand):
+                # the main loop runs the command, wait without blocking the event loop
+                status, response = await self.loop.run_in_executor(None, response.wait)
+        elif method == "POST":
+            POST_REQUESTS.inc()
+            retry_after = self.post_options.retry_after(client)
+            try:
+                if retry_after is not None:
+                    # the body is not read, the connection cannot be reused
+                    status, response = 429, TOO_MANY_REQUESTS_BODY
+                    response_headers = rate_limit_headers(retry_after)
+                    keep_alive = False
+                elif is_stream_path(path):
+                    status, response = await self._receive_stream(path, headers, reader, client, token)
+                else:
+                    post_data = await self._read_body(headers, reader)
+                    status, response = handle_post(self.shared_data, post_data, self.request_logger, path, self.post_options, client, token,
+                                                   headers.get("content-type"))
+            except HttpProtocolError:
+                POST_REJECTED.inc()
+                raise
+            if status >= 400:
+                POST_REJECTED.inc()
+        else:
+            status, response = 405, {"error": "Method not allowed"}
+
+        self._write_response(writer, status, response, keep_alive, response_headers)
+        if method == "POST":
+            POST_DURATION.observe(time.perf_counter() - start)
+        if self.request_logger.isEnabledFor(logging.DEBUG):
+            note = REQUEST_LOG.allow()
+            if note is not None:
+                self.request_logger.debug(f"{peer[0] if peer else '-'} - - \"{method} {target} {version}\" {status}{note}")
+        return keep_alive
+
+    def _content_length(self, headers):
+        if "content-length" not in headers:
+            raise HttpProtocolError(411, "Content-Length required")
+        try:
+            content_length = int(headers["content-length"])
+        except ValueError:
+            raise HttpProtocolError(400, "Invalid Content-Length")
+        if content_length < 0:
+            raise HttpProtocolError(400, "Invalid Content-Length")
+        return content_length
+
+    async def _iter_chunks(self, reader, limit=None):
+        """Yield chunks of a ``Transfer-Encoding: chunked`` body of at most ``limit`` bytes."""
+        total = 0
+        while True:
+            size_line = await reader.readline()
+            try:
+                size = int(size_line.split(b";", 1)[0].strip(), 16)
+            except ValueError:
+                raise HttpProtocolError(400, "Bad chunk size")
+            if size < 0:
+                # int() accepts a sign, readexactly() raises on it
+                raise HttpProtocolError(400, "Bad chunk size")
+            if size == 0:
+                # skip trailers
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return
+            total += size
+            if limit is not None and total > limit:
+                # not read, the connection is closed
+                raise HttpProtocolError(413, "Payload too large")
+            chunk = await reader.readexactly(size)
+            await reader.readexactly(2)
+            yield chunk
+
+    async def _read_body(self, headers, reader):
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            body = bytearray()
+            async for chunk in self._iter_chunks(reader, self.post_options.max_body_size):
+                body += chunk
+            return bytes(body)
+        content_length = self._content_length(headers)
+        if content_length > self.post_options.max_body_size:
+            raise HttpProtocolError(413, "Payload too large")
+        return await reader.readexactly(content_length)
+
+    async def _receive_stream(self, path, headers, reader, client=None, token=None):
+        """Apply NDJSON samples of a streaming POST while the body arrives."""
+        state = resolve_sensor(self.shared_data, path, client, token)
+        if state is None:
+            status, response = unresolved_response(self.shared_data, path, token)
+            raise HttpProtocolError(status, response["error"])
+        decoder = StreamDecoder(self.shared_data, state, self.request_logger)
+        try:
+            if "chunked" in headers.get("transfer-encoding", "").lower():
+                async for chunk in self._iter_chunks(reader):
+                    decoder.feed(chunk)
+            else:
+                remaining = self._content_length(headers)
+                while remaining > 0:
+                    chunk = await reader.read(min(remaining, STREAM_READ_SIZE))
+                    if not chunk:
+                        raise asyncio.IncompleteReadError(b"", remaining)
+                    remaining -= len(chunk)
+                    decoder.feed(chunk)
+        except ValueError as e:
+            raise HttpProtocolError(413, str(e))
+        decoder.close()
+        return 200, decoder.response()
+
+    async def _serve_websocket(self, path, headers, reader, writer, client=None, token=None):
+        """Upgrade connection to WebSocket and apply NDJSON samples from its messages.
+
+        Every data message is one or more NDJSON lines; a message end also
+        ends the line. Samples are never echoed, only ping/close are answered.
+        """
+        state = resolve_sensor(self.shared_data, path, client, token)
+        key = headers.get("sec-websocket-key")
+        if state is None:
+            status, response = unresolved_response(self.shared_data, path, token)
+            raise HttpProtocolError(status, response["error"])
+        if not key:
+            raise HttpProtocolError(400, "Missing Sec-WebSocket-Key")
+
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode("latin-1")).digest()).decode("latin-1")
+        writer.write((
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n"
+            "\r\n"
+        ).encode("latin-1"))
+        await writer.drain()
+
+        decoder = StreamDecoder(self.shared_data, state, self.request_logger)
+        close_code = 1000
+        try:
+            while True:
+                try:
+                    header = await asyncio.wait_for(reader.readexactly(2), STREAM_IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    close_code = 1001
+                    break
+                fin = header[0] & 0x80
+                opcode = header[0] & 0x0F
+                length = header[1] & 0x7F
+                if length == 126:
+                    length = int.from_bytes(await reader.readexactly(2), "big")
+                elif length == 127:
+                    length = int.from_bytes(await reader.readexactly(8), "big")
+                if length > MAX_WEBSOCKET_FRAME:
+                    close_code = 1009
+                    break
+                mask = await reader.readexactly(4) if header[1] & 0x80 else None
+                payload = await reader.readexactly(length)
+                if mask and length:
+                    payload = websocket_unmask(payload, mask)
+
+                if opcode in (0x0, 0x1, 0x2):
+                    decoder.feed(payload)
+                    if fin:
+                        decoder.feed(b"\n")
+                elif opcode == 0x8:
+                    break
+                elif opcode == 0x9:
+                    writer.write(websocket_frame(0xA, payload))
+                    await writer.drain()
+        except ValueError:
+            close_code = 1009
+        writer.write(websocket_frame(0x8, close_code.to_bytes(2, "big")))
+        await writer.drain()
+        if self.request_logger.isEnabledFor(logging.DEBUG):
+            self.request_logger.debug(f"WebSocket stream closed: {decoder.response()}")
+
+    async def _serve_status_stream(self, reader, writer, interval):
+        # server-sent events until the client closes the connection
+        if not STATUS_STREAMS.acquire(blocking=False):
+            self._write_response(writer, 503, {"error": "Too many status streams"}, False)
+            return
+        try:
+            writer.write((
+                "HTTP/1.1 200 OK\r\n"
+                "Content-Type: text/event-stream\r\n"
+                "Cache-Control: no-cache\r\n"
+                "Connection: close\r\n"
+                "\r\n"
+            ).encode("latin-1"))
+            while True:
+                writer.write(status_event(self.shared_data))
+                await writer.drain()
+                try:
+                    # EOF (client gone, server stopping) ends the stream early
+                    if not await asyncio.wait_for(reader.read(STREAM_READ_SIZE), interval):
+                        break
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            STATUS_STREAMS.release()
+
+    def _write_response(self, writer, status, response, keep_alive, headers=None):
+        extra = "".join(f"{name}: {value}\r\n" for name, value in headers.items()) if headers else ""
+        if response is None:
+            # 204, no body
+            writer.write((
+                f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                f"{extra}"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                "\r\n"
+            ).encode("latin-1"))
+            return
+        body = response if isinstance(response, bytes) else json.dumps(response).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"{extra}"
+            f"Content-Type: {getattr(response, 'content_type', 'application/json')}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            "\r\n"
+        ).encode("latin-1")
+        writer.write(head + body)
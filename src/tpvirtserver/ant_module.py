@@ -2,20 +2,48 @@ import threading
 import logging
 import time
 
-from openant.easy.node import Node
-from openant.easy.channel import Channel
-from openant.base.commons import format_list
-
 from .__init__ import shared_data
+from .page_module import KMH_TO_MM_S, ANT_CLOCK, ANT_PROFILES
+from .estimator_module import speed_at
+from .recorder_module import RECORDER
+from .log_module import LogRateLimit
+from .metrics_module import ANT_TX_FRAMES, ANT_TX_DURATION, ANT_TX_JITTER, ANT_TX_LATE, ANT_TX_MISSED
+from .metrics_module import ANT_FAILURES, ANT_FIRST_FRAME
 
 # Definition of Variables
 NETWORK_KEY = [0xB9, 0xA5, 0x21, 0xFB, 0xBD, 0x72, 0xC3, 0x45]
-Device_Type = 123  # 122 = BikeSpeed
+Device_Type = 123  # 123 = Bike Speed (122 is Bike Cadence), see ANT_PROFILES for the others
 Device_Number = 12775  # Change if you need.
 Channel_Period = 8118   # 8118 counts (~4.04Hz, 4 messages/second)
-#Channel_Period = 16236   # 16236 counts (~2.02Hz, 4 messages/second)
-#Channel_Period = 32472   # 8118 counts (~1.01Hz, 4 messages/second)
+# message rates usable instead of a count, multiples of the profile period
+# (bike speed: 4hz 8118, 2hz 16236, 1hz 32472)
+CHANNEL_RATES = {"4hz": 1, "2hz": 2, "1hz": 4}
+Transmission_Type = 5
 Channel_Frequency = 57
+ANT_MAX_CHANNELS = 8    # channel count of common ANT USB-m sticks
+ANT_BACKENDS = ("usb", "sim")   # usb: openant + ANT USB stick, sim: sim_module emulator
+TX_LATE_FRACTION = 0.25     # callback later than this part of a channel period counts as late
+TX_MAX_ELAPSED = ANT_CLOCK  # time step of one frame is capped at 1 s [1/32768 s]
+METRICS_HOLD = 5.0          # cadence, power and heart rate are sent as 0 this long after their POST [s]
+
+# Adaptive TX rate: after ADAPTIVE_IDLE_AFTER seconds of constant (or zero)
+# speed the channel drops to ADAPTIVE_IDLE_RATE, the next speed change
+# restores the configured period. Receivers searching at 4 Hz keep tracking,
+# the idle period is the 1 Hz multiple of the profile period. Speed based
+# profiles only (AntProfile.adaptive).
+ADAPTIVE_IDLE_RATE = "1hz"
+ADAPTIVE_IDLE_AFTER = 10.0      # [s]
+ADAPTIVE_SPEED_TOLERANCE = 28   # speed change treated as constant [mm/s] (0.1 km/h)
+CHANNEL_SETTINGS = ("period", "transmission_type", "adaptive")
+
+# Recovery of AntChannelManager: a failed Node (USB transfer error, Node
+# thread exit, no TX event for TX_STALL_AFTER) is replaced by a new one,
+# retried after ANT_RECONNECT_MIN doubling up to ANT_RECONNECT_MAX.
+# Sensors keep their rotation and event time counters across reconnects.
+ANT_RECONNECT_MIN = 1.0     # [s]
+ANT_RECONNECT_MAX = 60.0    # [s]
+TX_STALL_AFTER = 3.0        # [s], also at least 4 channel periods
+ANT_WATCHDOG_INTERVAL = 1.0     # TX stall check interval while running [s]
 
 #BikeSpeed = 27.0 / 3.6  # m/s => 10km/h
 # BikeSpeed = None
@@ -24,6 +52,91 @@ Channel_Frequency = 57
 # Fictive Config of Treadmill
 
 
+def load_backend(backend="usb"):
+    """Return ``(Node, Channel)`` classes of ANT backend ``backend``.
+
+    openant is imported on first use, so the ``sim`` backend runs without
+    it (and without a USB stick).
+    """
+    if backend == "sim":
+        from .sim_module import SimNode, SimChannel
+        return SimNode, SimChannel
+    if backend != "usb":
+        raise ValueError(f"backend must be one of {ANT_BACKENDS}, got {backend!r}")
+    from openant.easy.node import Node
+    from openant.easy.channel import Channel
+    return Node, Channel
+
+
+def parse_channel_period(value, base=Channel_Period):
+    """Return channel period [1/32768 s] given as a count or a rate name of ``CHANNEL_RATES``.
+
+    Rate names are multiples of ``base``, the period of the sensor profile.
+    """
+    if isinstance(value, str):
+        name = value.strip().lower()
+        if name in CHANNEL_RATES:
+            return base * CHANNEL_RATES[name]
+        try:
+            value = int(name)
+        except ValueError:
+            raise ValueError(f"Channel period must be a count or one of {tuple(CHANNEL_RATES)}, got {value!r}") from None
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 < value <= 0xFFFF:
+        raise ValueError(f"Channel period {value!r} out of range 1..65535")
+    return value
+
+
+def parse_profile(value):
+    """Return ANT+ profile name ``value`` (a key of ``ANT_PROFILES``)."""
+    name = value.strip().lower()
+    if name not in ANT_PROFILES:
+        raise ValueError(f"Profile must be one of {tuple(ANT_PROFILES)}, got {value!r}")
+    return name
+
+
+def parse_transmission_type(value):
+    """Return ANT+ transmission type ``value`` as int, 1..255."""
+    if isinstance(value, str):
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 < value <= 0xFF:
+        raise ValueError(f"Transmission type {value!r} out of range 1..255")
+    return value
+
+
+def parse_channel_settings(data, base_period=Channel_Period):
+    """Validate channel settings ``data`` (dict with keys of ``CHANNEL_SETTINGS``).
+
+    Rate names of ``period`` are resolved against ``base_period``, the
+    period of the sensor profile.
+
+    Returns
+    -------
+    dict
+        Settings with normalized values, keyword arguments of
+        ``AntBikeSpeed.configure()``.
+    """
+    if not isinstance(data, dict) or not data:
+        raise ValueError(f"Expected an object with any of {CHANNEL_SETTINGS}")
+    unknown = set(data) - set(CHANNEL_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown channel setting(s) {sorted(unknown)}, expected any of {CHANNEL_SETTINGS}")
+    settings = {}
+    if "period" in data:
+        settings["period"] = parse_channel_period(data["period"], base_period)
+    if "transmission_type" in data:
+        settings["transmission_type"] = parse_transmission_type(data["transmission_type"])
+    if "adaptive" in data:
+        if not isinstance(data["adaptive"], bool):
+            raise ValueError("adaptive must be true or false")
+        settings["adaptive"] = data["adaptive"]
+    return settings
+
+
+def format_list(data):
+    """Format payload bytes as hex, like ``openant.base.commons.format_list``."""
+    return "[" + " ".join("{:02x}".format(b) for b in data) + "]"
+
+
 ##########################################################################
 # Ant+ Bike Speed server implementation
 # (dłuższy opis zastąpiony docstringiem wewnątrz klasy)
@@ -38,9 +151,8 @@ class AntBikeSpeed:
     Key points:
     - start() configures the Node and Channel and starts the transmit thread.
     - stop() stops the Node and closes the Channel; both methods are idempotent.
-    - Speed values are read from an injected ``shared_data`` object
-        (``shared_data.BikeSpeed``) and should be accessed under
-        ``shared_data.lock``.
+    - Speed values are estimated at TX time from the snapshot of an
+        injected ``shared_data`` object without locking.
 
     Public methods:
     - start(): start the ANT+ transmission.
@@ -50,52 +162,64 @@ class AntBikeSpeed:
     Usage example::
             srv = AntBikeSpeed(shared_data, logger)
             srv.start()
-            # update shared_data.BikeSpeed (in km/h) under shared_data.lock
+            # shared_data.update(speed_kmh, time.time())
             srv.stop()
 
     Implementation notes:
-    - Frame content is prepared in ``Create_Next_DataPage_Speed()``.
+    - Frame content is prepared in ``Create_Next_DataPage_Speed()`` by the
+        ``PageEncoder`` of the sensor ``profile`` (see ``ANT_PROFILES``).
     - Rotation counters and event timestamps are stored locally in the
-        object state.
+        encoder state. They advance by the real time between TX callbacks
+        (``time.monotonic_ns()``), not by one channel period per callback,
+        so late or missed callbacks do not make the reported speed drift.
+    - With ``adaptive`` the channel drops to ``ADAPTIVE_IDLE_RATE`` while
+        speed is constant and returns to ``channel_period`` when it changes.
+        Period changes are applied by the TX callback, the only thread
+        talking to an open channel.
     """
 
-    def __init__(self, shared_data, logger):
+    def __init__(self, shared_data, logger, device_number=Device_Number, device_type=None, channel_period=None, backend="usb", transmission_type=Transmission_Type, adaptive=False, profile="speed"):
         """Initialize AntBikeSpeed instance.
 
         Parameters
         ----------
-        shared_data : object
-            Shared data object that must provide ``BikeSpeed`` (km/h) and a
-            ``lock`` for thread-safe access.
+        shared_data : SpeedState
+            Speed state of this sensor (``SharedData`` or ``SpeedState``);
+            speed (km/h) is read from its ``snapshot``, cadence, power and
+            heart rate from its ``metrics``.
         logger : logging.Logger
             Parent logger; a child logger ``AntServer`` will be created.
+        device_number : int
+            ANT+ device number of this sensor.
+        device_type : int or None
+            ANT+ device type of this sensor, the one of ``profile`` if None.
+        channel_period : int or None
+            Channel period in 1/32768 s units, the one of ``profile`` if None.
+        backend : str
+            ANT backend used by ``start()``, see ``ANT_BACKENDS``.
+        transmission_type : int
+            ANT+ transmission type of the channel ID.
+        adaptive : bool
+            Lower the message rate while speed is constant (speed based
+            profiles only).
+        profile : str
+            ANT+ profile broadcast, a key of ``ANT_PROFILES``: ``speed``,
+            ``speed_cadence``, ``power`` or ``heart_rate``.
 
         Attributes
         ----------
-        ANTMessageCount_Speed : int
-            Counter for ANT+ bike speed sensor frames. Used to differentiate frame types
-            according to the protocol (some frames contain technical data).
+        page_encoder : PageEncoder
+            Encoder of ``profile`` keeping page schedule, event counters and
+            event time of this sensor.
         ANTMessagePayload_Speed : list
-            Current ANT+ data frame for bike speed sensor (8 bytes).
-        event_interval : float
-            Time (in seconds) between consecutive speed measurement events. Used to
-            convert speed into wheel rotations since the last frame transmission.
-        LastBikeSpeed : float
-            Last recorded bike speed (in km/h).
-        TotalWheelRotations : float
-            Total number of wheel rotations since ANT+ server start.
-        LasFullTotalWheelRotations : int
-            Last complete wheel rotation count (integer part of TotalWheelRotations).
-            Used to calculate rotations since last frame transmission.
-        LasFullTotalWheelRotationsInterval : int
-            Timestamp of last complete wheel rotation (integer part). Used to
-            calculate rotations since last frame transmission.
-        LastBikeSpeedEventTimeFull : int
-            Timestamp of last bike speed calculation event (in ANT+ time units).
+            Current ANT+ data frame for bike speed sensor (8 bytes), the
+            preallocated payload of ``page_encoder``.
         TotalIntervals : int
-            Total count of speed measurement intervals since ANT+ server start.
+            Total count of transmitted frames since ANT+ server start.
+        MissedIntervals : int
+            Total count of TX events that passed without a callback.
         TimeProgramStart : float
-            Program start time (in seconds since epoch).
+            Program start time (``time.monotonic()`` seconds).
         wheel_circumference : float
             Bike wheel circumference (in meters); used to convert speed into
             wheel rotations.
@@ -108,24 +232,52 @@ class AntBikeSpeed:
         """
         self.logger = logger.getChild("AntServer")
         
+        if profile not in ANT_PROFILES:
+            raise ValueError(f"profile must be one of {tuple(ANT_PROFILES)}, got {profile!r}")
+        self.profile = ANT_PROFILES[profile]
+        if adaptive and not self.profile.adaptive:
+            raise ValueError(f"Adaptive TX needs a speed based profile, not {profile!r}")
         self.shared_data = shared_data
+        self.device_number = device_number
+        self.device_type = self.profile.device_type if device_type is None else device_type
+        self.channel_period = self.profile.channel_period if channel_period is None else channel_period
+        self.idle_period = self.profile.channel_period * CHANNEL_RATES[ADAPTIVE_IDLE_RATE]
+        self.backend = backend
+        self.transmission_type = transmission_type
+        self.adaptive = adaptive
 
-        self.ANTMessageCount_Speed = 0
-        self.ANTMessagePayload_Speed = [0, 0, 0, 0, 0, 0, 0, 0]
-
-        # Init Variables, needed
-        self.event_interval = 1.0 * Channel_Period / 32768
-
-        self.LastBikeSpeed = 0.0
-        
-        self.TotalWheelRotations = 0.0
-        self.LasFullTotalWheelRotations = 0
-        self.LasFullTotalWheelRotationsInterval = 0
-        self.LastBikeSpeedEventTimeFull = 0
-        self.TotalIntervals = 0;
-
-        self.TimeProgramStart = time.time()
         self.wheel_circumference = 2.105    # in meters
+        self.page_encoder = self.profile.encoder(self.channel_period, round(self.wheel_circumference * 1000))
+        self.ANTMessagePayload_Speed = self.page_encoder.payload
+
+        self.TotalIntervals = 0
+        self.MissedIntervals = 0
+
+        self.TimeProgramStart = time.monotonic()
+        # TX timing, all in time.monotonic_ns()
+        self.last_tx_ns = None
+        # period programmed on the channel, differs from channel_period while adaptive idles
+        self._set_tx_period(self.channel_period)
+        self.adaptive_speed = 0
+        self.adaptive_since_ns = 0
+        # metrics bound once, TX callback only updates them
+        self.metric_frames = ANT_TX_FRAMES.labels(device=device_number)
+        self.metric_tx_duration = ANT_TX_DURATION.labels(device=device_number)
+        self.metric_tx_jitter = ANT_TX_JITTER.labels(device=device_number)
+        self.metric_tx_late = ANT_TX_LATE.labels(device=device_number)
+        self.metric_tx_missed = ANT_TX_MISSED.labels(device=device_number)
+        # per frame debug messages
+        self.page_log = LogRateLimit()
+        self.missed_log = LogRateLimit()
+        self.tx_log = LogRateLimit()
+        # set by AntChannelManager, called with a reason when TX fails
+        self.on_failure = None
+        # channel assigned (self.channel) but closed while the Node stands by
+        self.channel_open = False
+        # time-to-first-frame of the last start: start time, kind, result [s]
+        self.start_ns = None
+        self.start_kind = "cold"
+        self.first_frame_seconds = None
         # mark thread as not running
         self.node = None
         self.channel = None
@@ -133,84 +285,52 @@ class AntBikeSpeed:
         self.lock = threading.Lock()
 
 
-    def Create_Next_DataPage_Speed(self):
+    def Create_Next_DataPage_Speed(self, elapsed_ticks=None):
         """Generate the next ANT+ data page for the speed sensor.
 
-        The method reads the current speed from ``shared_data.BikeSpeed`` (under
-        ``shared_data.lock``), computes distance and wheel rotations since the
-        last interval, updates internal counters and returns an 8-byte payload
-        suitable for broadcasting via the ANT+ channel.
+        The method estimates the speed at the current time from the
+        lock-free ``shared_data.snapshot`` (it never waits for HTTP handlers
+        or the main loop) and lets the profile's ``PageEncoder`` update its
+        event counters and event time. Profiles sending cadence, power or
+        heart rate read them from ``shared_data.metrics``, held for
+        ``METRICS_HOLD`` after their POST.
+
+        Parameters
+        ----------
+        elapsed_ticks : int or None
+            Time since the previous frame in 1/32768 s, one channel period
+            when None.
 
         Returns
         -------
         list
-            8-byte list representing the ANT+ message payload.
+            8-byte list representing the ANT+ message payload (reused by
+            the next call).
         """
-        # Define Variables
-        self.ANTMessageCount_Speed += 1
-        self.PageToggleCount = 0
-        self.PageToggleBit = 0x00;  # or #0x80
-
-        # Time Calculations
         self.TotalIntervals += 1
-        
-        BikeSpeedEventTimeFull = 1024.0 * self.TotalIntervals / self.event_interval
-        
-        with self.shared_data.lock:
-            # SPEED calculation
-            avg_speed = 0.5 * (self.shared_data.BikeSpeed + self.LastBikeSpeed) /3.6
-            self.LastBikeSpeed = self.shared_data.BikeSpeed
-        distance_traveled = avg_speed / self.event_interval
-        rotations = distance_traveled / self.wheel_circumference
-        self.TotalWheelRotations += rotations
-        # udate event time and weehl rotations in data frame, only after full rotations. Otherwise send the same event time and number of rotations
-        #if int(self.TotalWheelRotations) != int(self.LasFullTotalWheelRotations):
-        self.LastBikeSpeedEventTimeFull = int (BikeSpeedEventTimeFull)
-        self.LasFullTotalWheelRotations = int(self.TotalWheelRotations)
-        
-        WheelRotations_H = (int(self.LasFullTotalWheelRotations) >> 8) & 0xFF
-        WheelRotations_L = (int(self.LasFullTotalWheelRotations)) & 0xFF
-        BikeSpeedEventTime_H = (int(self.LastBikeSpeedEventTimeFull) >> 8) & 0xFF
-        BikeSpeedEventTime_L = (int(self.LastBikeSpeedEventTimeFull)) & 0xFF
-
-        # prepare ANT+ message
-        if self.ANTMessageCount_Speed <= 2:
-            # technical message
-            self.ANTMessagePayload_Speed[0] = 0x02  # DataPage 02 (Manufacturer ID)
-            self.ANTMessagePayload_Speed[1] = 1  # Manufacturer ID
-            self.ANTMessagePayload_Speed[2] = 0xFF  # Serial Number
-            self.ANTMessagePayload_Speed[3] = 0xFF  # Serial Number
-        elif self.ANTMessageCount_Speed <= 4:
-            # technical message
-            self.ANTMessagePayload_Speed[0] = 0x03  # DataPage 03 (Serial number and version)
-            self.ANTMessagePayload_Speed[3] = 1  # HW Revision
-            self.ANTMessagePayload_Speed[3] = 1  # SW Revision
-            self.ANTMessagePayload_Speed[7] = 1  # Model Number
+        snapshot = self.shared_data.snapshot
+        now = time.time()
+        speed_kmh = speed_at(snapshot, now)
+        if self.profile.metrics:
+            metrics = self.shared_data.metrics
+            if metrics.time is not None and now - metrics.time < METRICS_HOLD:
+                payload = self.page_encoder.encode(int(speed_kmh * KMH_TO_MM_S), elapsed_ticks, int(metrics.cadence or 0),
+                                                   int(metrics.power or 0), int(metrics.heart_rate or 0))
+            else:
+                payload = self.page_encoder.encode(int(speed_kmh * KMH_TO_MM_S), elapsed_ticks)
         else:
-            # no technical data in standard page
-            self.ANTMessagePayload_Speed[0] = 0x00  # Data Page 0 (Standard Data)
-            self.ANTMessagePayload_Speed[1] = 0xFF
-            self.ANTMessagePayload_Speed[2] = 0xFF
-            self.ANTMessagePayload_Speed[3] = 0xFF
-        
-        # for speed sensor speed is always sent
-        self.ANTMessagePayload_Speed[4] = BikeSpeedEventTime_L
-        self.ANTMessagePayload_Speed[5] = BikeSpeedEventTime_H
-        self.ANTMessagePayload_Speed[6] = WheelRotations_L
-        self.ANTMessagePayload_Speed[7] = WheelRotations_H
-            
-        # Page toogle bit
-        if (self.ANTMessageCount_Speed >> 2) & 0x01:
-            self.ANTMessagePayload_Speed[0] ^= 0x80
+            payload = self.page_encoder.encode(int(speed_kmh * KMH_TO_MM_S), elapsed_ticks)
+        if RECORDER.enabled:
+            if elapsed_ticks is None:
+                elapsed_ticks = self.page_encoder.channel_period
+            RECORDER.frame(self.device_number, snapshot.sequence, now, elapsed_ticks, payload)
 
         if self.logger.isEnabledFor(logging.DEBUG):
-            self.logger.debug(f"TotaInt:{self.TotalIntervals} BikeSpeed:{self.shared_data.BikeSpeed:.2f} [m/s] avg_speed: {avg_speed:.2f} [m/s] distance_traveled: {distance_traveled:.2f} Rotations:{self.TotalWheelRotations:.2f}")
+            note = self.page_log.allow()
+            if note is not None:
+                self.logger.debug(f"TotaInt:{self.TotalIntervals} BikeSpeed:{speed_kmh:.2f} [km/h] Rotations:{self.page_encoder.total_revolutions}{note}")
 
-        # ANTMessageCount_Speed reset
-        if self.ANTMessageCount_Speed > 68:
-            self.ANTMessageCount_Speed = 0
-
-        return self.ANTMessagePayload_Speed
+        return payload
 
     def on_event_tx(self, data):
         """Callback invoked for each TX event from the ANT channel.
@@ -222,17 +342,203 @@ class AntBikeSpeed:
             implementation). The method prepares the next data page and
             broadcasts it via the channel.
         """
-        ANTMessagePayload_Speed = self.Create_Next_DataPage_Speed()
-        self.ActualTime = time.time() - self.TimeProgramStart
+        tx_start = time.monotonic_ns()
+        elapsed_ticks = None
+        if self.last_tx_ns is not None:
+            elapsed_ns = tx_start - self.last_tx_ns
+            # channel periods since the previous callback, rounded
+            intervals = (elapsed_ns + (self.period_ns >> 1)) // self.period_ns
+            if intervals > 1:
+                # events in between were sent with the previous payload
+                self.MissedIntervals += intervals - 1
+                self.metric_tx_missed.inc(intervals - 1)
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    note = self.missed_log.allow()
+                    if note is not None:
+                        self.logger.debug(f"TX:{self.device_number} {intervals - 1} event(s) missed, interval {elapsed_ns / 1e6:.1f} ms{note}")
+            else:
+                intervals = 1
+            if elapsed_ns - intervals * self.period_ns > self.late_ns:
+                self.metric_tx_late.inc()
+            self.metric_tx_jitter.observe(abs(elapsed_ns - self.period_ns) / 1e9)
+            # difference of absolute tick counts, so rounding does not accumulate
+            elapsed_ticks = tx_start * ANT_CLOCK // 1000000000 - self.last_tx_ns * ANT_CLOCK // 1000000000
+            if elapsed_ticks > TX_MAX_ELAPSED:
+                elapsed_ticks = TX_MAX_ELAPSED
+        elif self.start_ns is not None:
+            # first frame since the channel was opened
+            self.first_frame_seconds = (tx_start - self.start_ns) / 1e9
+            ANT_FIRST_FRAME.labels(start=self.start_kind).observe(self.first_frame_seconds)
+            self.start_ns = None
+        self.last_tx_ns = tx_start
+
+        ANTMessagePayload_Speed = self.Create_Next_DataPage_Speed(elapsed_ticks)
+        self.ActualTime = time.monotonic() - self.TimeProgramStart
 
         # ANTMessagePayload_Speed = array.array('B', [1, 255, 133, 128, 8, 0, 128, 0])    # just for Debuggung pourpose
 
-        self.channel.send_broadcast_data(
-            self.ANTMessagePayload_Speed
-        )  # Final call for broadcasting data
+        try:
+            self.channel.send_broadcast_data(
+                self.ANTMessagePayload_Speed
+            )  # Final call for broadcasting data
+        except Exception as e:
+            # USB transfer failed; counters stay, the manager reconnects
+            if self.on_failure is None:
+                raise
+            self.on_failure(f"TX of sensor {self.device_number} failed: {e}")
+            return
+
+        period = self._target_period(tx_start)
+        if period != self.tx_period:
+            self.logger.info(f"TX:{self.device_number} channel period {self.tx_period} -> {period}")
+            self._set_tx_period(period)
+            self.channel.set_period(period)
         
         #
-        self.logger.debug("{:05.2f} TX:{}, {}, {} ".format(self.ActualTime, Device_Number, Device_Type, format_list(ANTMessagePayload_Speed)))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            note = self.tx_log.allow()
+            if note is not None:
+                self.logger.debug("{:05.2f} TX:{}, {}, {} {}".format(self.ActualTime, self.device_number, self.device_type, format_list(ANTMessagePayload_Speed), note))
+
+        self.metric_frames.inc()
+        self.metric_tx_duration.observe((time.monotonic_ns() - tx_start) / 1e9)
+
+    def _set_tx_period(self, period):
+        self.tx_period = period
+        self.period_ns = period * 1000000000 // ANT_CLOCK
+        self.late_ns = int(self.period_ns * TX_LATE_FRACTION)
+        self.page_encoder.channel_period = period
+
+    def _target_period(self, now_ns):
+        """Return channel period for the next frames, ``now_ns`` is the TX time."""
+        if not self.adaptive:
+            return self.channel_period
+        speed = self.page_encoder.last_speed
+        if abs(speed - self.adaptive_speed) > ADAPTIVE_SPEED_TOLERANCE:
+            self.adaptive_speed = speed
+            self.adaptive_since_ns = now_ns
+            return self.channel_period
+        if now_ns - self.adaptive_since_ns >= ADAPTIVE_IDLE_AFTER * 1e9:
+            return max(self.channel_period, self.idle_period)
+        return self.tx_period
+
+    def configure(self, period=None, transmission_type=None, adaptive=None):
+        """Change channel settings at runtime.
+
+        A new ``period`` or ``adaptive`` takes effect with the next TX event.
+        A new ``transmission_type`` changes the channel ID, which needs the
+        channel to be reopened.
+
+        Returns
+        -------
+        bool
+            True if the channel has to be reopened.
+
+        Raises
+        ------
+        ValueError
+            If ``adaptive`` is set on a profile not based on speed.
+        """
+        if adaptive and not self.profile.adaptive:
+            raise ValueError(f"Adaptive TX needs a speed based profile, not {self.profile.name!r}")
+        if period is not None:
+            self.channel_period = period
+        if adaptive is not None:
+            self.adaptive = adaptive
+            self.adaptive_since_ns = time.monotonic_ns()
+        if not self.channel_open:
+            # applied when the channel is opened
+            self._set_tx_period(self.channel_period)
+        if transmission_type is not None and transmission_type != self.transmission_type:
+            self.transmission_type = transmission_type
+            return self.channel_open
+        return False
+
+    def status(self):
+        """Channel settings and TX counters, as reported by ``GET /status``.
+
+        Profiles sending more than speed add their last received values.
+        """
+        status = {
+            "profile": self.profile.name,
+            "device_type": self.device_type,
+            "channel_open": self.channel_open,
+            "channel_period": self.channel_period,
+            "tx_period": self.tx_period,
+            "transmission_type": self.transmission_type,
+            "adaptive": self.adaptive,
+            "frames": self.TotalIntervals,
+            "missed_frames": self.MissedIntervals,
+            "total_wheel_rotations": self.page_encoder.total_revolutions,
+            "time_to_first_frame": self.first_frame_seconds,
+        }
+        if self.profile.metrics:
+            metrics = self.shared_data.metrics
+            for name in self.profile.metrics:
+                status[name] = getattr(metrics, name)
+        return status
+
+    def tx_stalled(self, now_ns):
+        """Return True if the open channel had no TX event for ``TX_STALL_AFTER`` (at least 4 periods)."""
+        if not self.channel_open:
+            return False
+        last = self.last_tx_ns if self.last_tx_ns is not None else self.start_ns
+        if last is None:
+            return False
+        return now_ns - last > max(TX_STALL_AFTER * 1e9, 4 * self.period_ns)
+
+    def open_channel(self, node, Channel, start_ns=None):
+        """Assign, configure and open the transmit channel on ``node``.
+
+        The network key must already be set on ``node``; ``Channel`` is the
+        channel class of the same backend (see ``load_backend``). Used by
+        ``start()`` for a standalone sensor and by ``AntChannelManager`` when
+        several sensors share one Node. ``start_ns`` (``time.monotonic_ns()``)
+        is the start the first frame is timed from, now if None.
+        """
+        self.channel = node.new_channel(
+            Channel.Type.BIDIRECTIONAL_TRANSMIT, 0x00, 0x00
+        )  # Set Channel, Master TX
+        self.channel.set_rf_freq(Channel_Frequency)  # set Channel Frequency
+        # Callback function for each TX event
+        self.channel.on_broadcast_tx_data = self.on_event_tx
+        self._open(start_ns, "cold")
+
+    def resume_channel(self, start_ns=None):
+        """Reopen the channel closed by ``suspend_channel()`` on its standby Node."""
+        self._open(start_ns, "warm")
+
+    def _open(self, start_ns, kind):
+        self.channel.set_id(
+            self.device_number, self.device_type, self.transmission_type
+        )  # set channel id as <Device Number, Device Type, Transmission Type>
+        self._set_tx_period(self.channel_period)
+        self.adaptive_since_ns = time.monotonic_ns()
+        self.channel.set_period(self.channel_period)  # set Channel Period
+        self.last_tx_ns = None
+        self.start_ns = time.monotonic_ns() if start_ns is None else start_ns
+        self.start_kind = kind
+        self.channel.open()
+        self.channel_open = True
+
+    def suspend_channel(self):
+        """Close the channel but keep it assigned, ``resume_channel()`` reopens it."""
+        if self.channel_open:
+            self.channel_open = False
+            try:
+                self.channel.close()
+            except Exception:
+                self.logger.exception("Error closing channel during standby")
+
+    def close_channel(self):
+        """Close the transmit channel if open."""
+        self.channel_open = False
+        if self.channel:
+            try:
+                self.channel.close()
+            except Exception:
+                self.logger.exception("Error closing channel during stop")
+            self.channel = None
 
     def start(self):
         """Start the ANT+ server in a thread-safe manner.
@@ -275,25 +581,15 @@ class AntBikeSpeed:
                     self.thread = None
 
                 # Create and configure a new node and channel
+                Node, Channel = load_backend(self.backend)
                 self.node = Node()
                 self.logger.info("ANT+ Server starting ...")
 
                 # CHANNEL CONFIGURATION
                 self.node.set_network_key(0x00, NETWORK_KEY)  # set network key
-                self.channel = self.node.new_channel(
-                    Channel.Type.BIDIRECTIONAL_TRANSMIT, 0x00, 0x00
-                )  # Set Channel, Master TX
-                self.channel.set_id(
-                    Device_Number, Device_Type, 5
-                )  # set channel id as <Device Number, Device Type, Transmission Type>
-                self.channel.set_period(Channel_Period)  # set Channel Period
-                self.channel.set_rf_freq(Channel_Frequency)  # set Channel Frequency
-
-                # Callback function for each TX event
-                self.channel.on_broadcast_tx_data = self.on_event_tx
+                self.open_channel(self.node, Channel)
 
                 #self.thread = threading.Thread(target=self.node.start, daemon=True)
-                self.channel.open()
                 self.thread = threading.Thread(target=self.node.start)
                 self.thread.start()
             except Exception:
@@ -335,12 +631,7 @@ class AntBikeSpeed:
                     self.logger.exception("Error joining thread during stop")
                 self.node = None
                 self.thread = None
-            if self.channel:
-                try:
-                    self.channel.close()
-                except Exception:
-                    self.logger.exception("Error closing channel during stop")
-                self.channel = None
+            self.close_channel()
 
     def isRunning(self):
         """Return True if the node transmit thread is active.
@@ -350,4 +641,266 @@ class AntBikeSpeed:
         bool
             True when the node and thread exist and the thread is alive.
         """
-        return self.node is not None and self.thread is not None and self.thread.is_alive()
\ No newline at end of file
+        return self.node is not None and self.thread is not None and self.thread.is_alive()
+
+
+##########################################################################
+# Ant+ channel manager, many sensors on one Node
+###########################################################################
+class AntChannelManager:
+    """Run several ``AntBikeSpeed`` sensors as channels of one ANT+ Node.
+
+    Every sensor keeps its own speed state and counters; the manager owns the
+    Node (one USB stick), its network key and the thread running the Node.
+    It offers the same ``start()``, ``stop()`` and ``isRunning()`` interface
+    as ``AntBikeSpeed``.
+
+    With ``standby`` ``stop()`` only closes the channels: the Node, its USB
+    handle and the channel assignments stay, and the next ``start()`` just
+    reopens the channels (warm start) instead of resetting the stick.
+    ``close()`` always tears everything down.
+
+    A failed Node (reported by a sensor's TX, an exited Node thread or a TX
+    stall found by ``supervise()``) is torn down and replaced by the next
+    ``start()``; attempts after a failure are spaced by an exponential
+    backoff (``retry_delay()``).
+
+    Usage example::
+            manager = AntChannelManager(logger)
+            manager.add_sensor(AntBikeSpeed(shared_data, logger, 12775))
+            manager.add_sensor(AntBikeSpeed(shared_data.add_sensor(12776), logger, 12776))
+            manager.start()
+    """
+
+    def __init__(self, logger, max_channels=ANT_MAX_CHANNELS, backend="usb", standby=False, wakeup=None):
+        """Initialize manager.
+
+        Parameters
+        ----------
+        logger : logging.Logger
+            Parent logger; a child logger ``AntChannelManager`` will be created.
+        max_channels : int
+            Maximum number of channels opened on the Node. Lowered at start if
+            the stick reports fewer channels.
+        backend : str
+            ANT backend providing the Node, see ``ANT_BACKENDS``.
+        standby : bool
+            Keep the Node open on ``stop()``, see above.
+        wakeup : callable or None
+            Called (from the Node thread) when the Node fails, so the main
+            loop reconnects without waiting for its next timeout.
+        """
+        self.logger = logger.getChild("AntChannelManager")
+        self.max_channels = max_channels
+        self.backend = backend
+        self.standby = standby
+        self.wakeup = wakeup
+        self.sensors = []
+        self.node = None
+        self.thread = None
+        # channels of the Node are open (not standing by)
+        self.channels_open = False
+        # reason of the last failure, None while healthy
+        self.failed = None
+        self.last_failure = None
+        self.failures = 0
+        self.backoff = ANT_RECONNECT_MIN
+        self.retry_at = 0.0
+        # lock to protect start/stop/creation of node and channels
+        self.lock = threading.Lock()
+
+    def add_sensor(self, sensor):
+        """Register ``sensor``; its channel is opened on the next ``start()``."""
+        with self.lock:
+            if len(self.sensors) >= self.max_channels:
+                raise ValueError(f"Cannot add sensor {sensor.device_number}: channel limit {self.max_channels} reached")
+            if any(s.device_number == sensor.device_number for s in self.sensors):
+                raise ValueError(f"Sensor with device number {sensor.device_number} already added")
+            sensor.on_failure = self._failed
+            self.sensors.append(sensor)
+        return sensor
+
+    def configure_sensor(self, device_number, **settings):
+        """Apply ``settings`` (see ``AntBikeSpeed.configure``) to sensor ``device_number``.
+
+        A running Node is restarted if the sensor's channel has to be
+        reopened.
+        """
+        for sensor in self.sensors:
+            if sensor.device_number == device_number:
+                break
+        else:
+            raise ValueError(f"Unknown sensor {device_number}")
+        if sensor.configure(**settings) and self.isRunning():
+            self.logger.info(f"Restarting ANT+ Node to reopen channel of sensor {device_number}")
+            self.stop()
+            self.start()
+
+    def _node_max_channels(self):
+        # openant exposes stick capabilities only on some versions
+        capabilities = getattr(self.node, "capabilities", None)
+        if isinstance(capabilities, dict) and capabilities.get("max_channels"):
+            return min(self.max_channels, capabilities["max_channels"])
+        return self.max_channels
+
+    def _node_alive(self):
+        return self.node is not None and self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        """Open one channel per sensor: on the standby Node if there is a healthy one, else on a new Node.
+
+        Does nothing while the backoff after a failure runs.
+        """
+        with self.lock:
+            if self.channels_open and self.failed is None and self._node_alive():
+                self.logger.info("start() called but transmit thread already running - skipping start")
+                return
+            if time.monotonic() < self.retry_at:
+                return
+            start_ns = time.monotonic_ns()
+            try:
+                if self.failed is None and self._node_alive():
+                    self.logger.info("ANT+ channels reopening on standby Node ...")
+                    for sensor in self.sensors:
+                        if sensor.channel is not None:
+                            sensor.resume_channel(start_ns)
+                else:
+                    self._cleanup()
+                    Node, Channel = load_backend(self.backend)
+                    self.node = Node()
+                    self.logger.info(f"ANT+ Node starting with {len(self.sensors)} channel(s) ...")
+                    self.node.set_network_key(0x00, NETWORK_KEY)  # set network key
+
+                    limit = self._node_max_channels()
+                    for index, sensor in enumerate(self.sensors):
+                        if index >= limit:
+                            self.logger.warning(f"Node supports only {limit} channels, sensor {sensor.device_number} not started")
+                            continue
+                        sensor.open_channel(self.node, Channel, start_ns)
+
+                    self.thread = threading.Thread(target=self._run_node, args=(self.node,))
+                    self.thread.start()
+                self.channels_open = True
+                self.failed = None
+            except Exception:
+                self.logger.exception("Failed to start ANT+ Node")
+                self._cleanup()
+                self._schedule_retry()
+
+    def _run_node(self, node):
+        # Node thread; returning while still the current Node means it failed
+        try:
+            node.start()
+        except Exception:
+            self.logger.exception("ANT+ Node stopped with an error")
+        if node is self.node and self.channels_open:
+            self._failed("ANT+ Node thread exited")
+
+    def _failed(self, reason):
+        # called from the Node thread: flag only, start() replaces the Node
+        if self.failed is not None:
+            return
+        self.failed = reason
+        self.last_failure = reason
+        self.failures += 1
+        ANT_FAILURES.inc()
+        self._schedule_retry()
+        self.logger.warning(f"{reason}; reconnecting in {self.retry_at - time.monotonic():.1f} s")
+        if self.wakeup is not None:
+            self.wakeup()
+
+    def _schedule_retry(self):
+        self.retry_at = time.monotonic() + self.backoff
+        self.backoff = min(self.backoff * 2, ANT_RECONNECT_MAX)
+
+    def retry_delay(self):
+        """Return seconds until ``start()`` will try again (at least ``ANT_RECONNECT_MIN``)."""
+        return max(self.retry_at - time.monotonic(), ANT_RECONNECT_MIN)
+
+    def supervise(self):
+        """Check the running Node for an exited thread or stalled TX.
+
+        Called by the main loop; also resets the backoff once every open
+        channel sent a frame after a reconnect.
+
+        Returns
+        -------
+        float or None
+            Seconds until the next check, None while not running.
+        """
+        if not self.channels_open or self.failed is not None:
+            return None
+        if not self._node_alive():
+            self._failed("ANT+ Node thread exited")
+            return None
+        now_ns = time.monotonic_ns()
+        healthy = True
+        for sensor in self.sensors:
+            if sensor.tx_stalled(now_ns):
+                self._failed(f"No TX event of sensor {sensor.device_number} for {(now_ns - (sensor.last_tx_ns or sensor.start_ns)) / 1e9:.1f} s")
+                return None
+            if sensor.channel_open and sensor.last_tx_ns is None:
+                healthy = False
+        if healthy and self.backoff > ANT_RECONNECT_MIN:
+            self.backoff = ANT_RECONNECT_MIN
+        return ANT_WATCHDOG_INTERVAL
+
+    def _cleanup(self):
+        self.channels_open = False
+        if self.node:
+            try:
+                self.node.stop()
+            except Exception:
+                self.logger.exception("Error stopping node")
+        if self.thread is not None:
+            try:
+                self.thread.join(timeout=2)
+            except Exception:
+                self.logger.exception("Error joining thread during stop")
+        for sensor in self.sensors:
+            sensor.close_channel()
+        self.node = None
+        self.thread = None
+
+    def stop(self):
+        """Close all sensor channels; the Node stays open in standby mode."""
+        with self.lock:
+            self.retry_at = 0.0
+            self.backoff = ANT_RECONNECT_MIN
+            if self.standby and self.failed is None and self._node_alive():
+                self.channels_open = False
+                for sensor in self.sensors:
+                    sensor.suspend_channel()
+                self.logger.info("ANT+ channels closed, Node kept in standby")
+                return
+            self._cleanup()
+            self.failed = None
+
+    def close(self):
+        """Stop the Node and close all sensor channels, also in standby mode."""
+        with self.lock:
+            self._cleanup()
+            self.failed = None
+
+    def isRunning(self):
+        """Return True if the channels are open on a live, healthy Node."""
+        return self.channels_open and self.failed is None and self._node_alive()
+
+    def status(self):
+        """Node state and ``AntBikeSpeed.status()`` of every sensor by device number."""
+        if self.isRunning():
+            state = "running"
+        elif self.failed is not None:
+            state = "failed"
+        elif self._node_alive():
+            state = "standby"
+        else:
+            state = "stopped"
+        return {
+            "running": state == "running",
+            "state": state,
+            "backend": self.backend,
+            "failures": self.failures,
+            "last_failure": self.last_failure,
+            "sensors": {sensor.device_number: sensor.status() for sensor in self.sensors},
+        }
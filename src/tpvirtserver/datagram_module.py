@@ -0,0 +1,212 @@
+import logging
+import math
+import os
+import socket
+import stat
+import struct
+import threading
+
+from .metrics_module import DATAGRAM_SAMPLES, DATAGRAM_DROPPED
+from .ingest_module import apply_speed, wake_for_sample
+from .log_module import LogRateLimit
+
+# ======================================================
+# Datagram ingest
+# ======================================================
+# Bridge processes on the same host or LAN can send speed without HTTP, TLS
+# and JSON: one fixed size binary record per UDP or AF_UNIX datagram, read
+# with ``recv_into`` into a preallocated buffer by one thread per socket and
+# applied to the same speed states as POSTs. One syscall per sample.
+#
+# Record (little endian, DATAGRAM_RECORD.size bytes)::
+#
+#   version u8 (DATAGRAM_VERSION), pad 1, session id u16, time f64 [s], speed f32 [mm/s]
+#
+# The session id selects the sensor: its device number (0 feeds the first
+# sensor), or the session token with ``--session-key token``. ``time`` is
+# read on the sender clock and only orders the records of one sensor:
+# records not newer than the last applied one (reordered or duplicated
+# datagrams) are dropped, 0 skips the check. Records more than
+# DATAGRAM_REORDER_WINDOW older come from a restarted sender or a stepped
+# clock and are applied. Speed takes effect at receive time like a POST.
+#
+# Datagrams are not authenticated, UDP listens on the loopback address unless
+# another host is given.
+
+DATAGRAM_RECORD = struct.Struct("<BxHdf")
+DATAGRAM_VERSION = 1
+DEFAULT_UDP_HOST = "127.0.0.1"
+DATAGRAM_REORDER_WINDOW = 5.0   # older records within this window are dropped [s]
+DATAGRAM_RECEIVE_BUFFER = 1 << 20   # socket receive buffer, absorbs bursts of senders [bytes]
+
+# dropped datagram warnings
+DROP_LOG = LogRateLimit()
+
+
+def parse_udp_address(value):
+    """Parse ``[host:]port`` of the UDP listener, host defaults to ``DEFAULT_UDP_HOST``.
+
+    IPv6 hosts are written in brackets, e.g. ``[::1]:5001``.
+    """
+    host, _, port = value.strip().rpartition(":")
+    host = host.strip("[]") or DEFAULT_UDP_HOST
+    try:
+        port = int(port)
+    except ValueError:
+        raise ValueError(f"UDP address must be [host:]port, got {value!r}") from None
+    if not 0 < port <= 0xFFFF:
+        raise ValueError(f"UDP port {port} out of range 1..65535")
+    return host, port
+
+
+class DatagramListener:
+    """Receive speed records on one datagram socket and apply them.
+
+    Parameters
+    ----------
+    shared_data : SharedData
+        Shared state, its sensors receive the records and its main loop is
+        woken up by applied ones (``wake_for_sample``).
+    logger : logging.Logger
+        Parent logger; a child logger ``DatagramListener`` will be created.
+    address : tuple or str
+        ``(host, port)`` of a UDP socket or the path of an AF_UNIX socket.
+    """
+
+    def __init__(self, shared_data, logger, address):
+        self.logger = logger.getChild("DatagramListener")
+        self.shared_data = shared_data
+        self.address = address
+        self.unix = isinstance(address, str)
+        if self.unix:
+            self.where = address
+        else:
+            host = f"[{address[0]}]" if ":" in address[0] else address[0]
+            self.where = f"udp://{host}:{address[1]}"
+        self.sock = None
+        self.thread = None
+        self.stopping = threading.Event()
+        # one byte more than a record, longer datagrams are truncated to it and dropped
+        self.buffer = bytearray(DATAGRAM_RECORD.size + 1)
+        # speed state -> sender time of its last applied record
+        self.last_time = {}
+
+    def start(self):
+        """Bind the socket and start the receiving thread."""
+        if self.unix:
+            self._remove_stale_socket()
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        else:
+            family = socket.AF_INET6 if ":" in self.address[0] else socket.AF_INET
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            # capped by net.core.rmem_max
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, DATAGRAM_RECEIVE_BUFFER)
+            sock.bind(self.address)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, name="tpv-datagram", daemon=True)
+        self.thread.start()
+        self.logger.info(f"Datagram ingest listening on {self.where}")
+
+    def _remove_stale_socket(self):
+        # socket file left by a previous run, anything else is not ours to delete
+        try:
+            if stat.S_ISSOCK(os.stat(self.address).st_mode):
+                os.unlink(self.address)
+        except FileNotFoundError:
+            pass
+
+    def _run(self):
+        sock = self.sock
+        buffer = self.buffer
+        while True:
+            try:
+                size = sock.recv_into(buffer)
+            except OSError:
+                if self.stopping.is_set():
+                    return
+                self.logger.exception("Receiving datagram failed")
+                continue
+            if self.stopping.is_set():
+                return
+            self.apply(buffer, size)
+
+    def apply(self, buffer, size):
+        """Apply the record in the first ``size`` bytes of ``buffer``.
+
+        Returns
+        -------
+        bool
+            True if the record was applied, False if it was dropped.
+        """
+        if size != DATAGRAM_RECORD.size:
+            return self._drop(f"datagram of {size} bytes, expected {DATAGRAM_RECORD.size}")
+        version, session, sent, speed = DATAGRAM_RECORD.unpack_from(buffer)
+        if version != DATAGRAM_VERSION:
+            return self._drop(f"record version {version}, expected {DATAGRAM_VERSION}")
+        if not math.isfinite(speed):
+            return self._drop(f"speed {speed} of session {session}")
+        state = self._resolve(session)
+        if state is None:
+            return self._drop(f"no sensor for session {session}")
+        if sent:
+            last = self.last_time.get(state)
+            if last is not None and last - DATAGRAM_REORDER_WINDOW < sent <= last:
+                return self._drop(f"record of session {session} older than the last one")
+            self.last_time[state] = sent
+        last_post_time = state.last_post_time
+        apply_speed(state, speed, self.logger)
+        DATAGRAM_SAMPLES.inc()
+        wake_for_sample(self.shared_data, last_post_time)
+        return True
+
+    def _resolve(self, session):
+        sessions = self.shared_data.sessions
+        if sessions is not None and sessions.key == "token":
+            return sessions.resolve(None, str(session))
+        if session == 0:
+            return self.shared_data
+        return self.shared_data.get_sensor(session)
+
+    def _drop(self, reason):
+        DATAGRAM_DROPPED.inc()
+        if self.logger.isEnabledFor(logging.WARNING):
+            note = DROP_LOG.allow()
+            if note is not None:
+                self.logger.warning(f"Dropped {reason}{note}")
+        return False
+
+    def stop(self):
+        """Stop the receiving thread and close the socket."""
+        if self.sock is None:
+            return
+        self.stopping.set()
+        try:
+            # wakes up the blocked recv_into
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.thread.join()
+        self.thread = None
+        self.sock.close()
+        self.sock = None
+        if self.unix:
+            self._remove_stale_socket()
+        self.logger.info(f"Datagram ingest on {self.where} stopped.")
+
+    def isRunning(self):
+        return self.thread is not None and self.thread.is_alive()
+
+
+def create_datagram_listeners(config, shared_data, logger):
+    """Return the ``DatagramListener`` of ``config.udp`` and ``config.unix_socket`` (not started)."""
+    listeners = []
+    if config.udp:
+        listeners.append(DatagramListener(shared_data, logger, config.udp))
+    if config.unix_socket:
+        listeners.append(DatagramListener(shared_data, logger, config.unix_socket))
+    return listeners
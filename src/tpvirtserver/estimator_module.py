@@ -0,0 +1,244 @@
+import math
+
+##########################################################################
+# Speed estimation between TPV samples
+###########################################################################
+# Every speed state keeps the last received samples in a ``SampleBuffer``
+# and runs one estimator over them when a sample arrives (writer side, under
+# the state lock). The estimator publishes a speed and a rate of change at
+# the sample time; the ANT+ TX callback evaluates ``speed_at()`` at its own
+# timestamp from the lock-free snapshot: linear extrapolation for a short
+# horizon, then a time based exponential decay. Decay no longer depends on
+# how often anything polls, so clients can POST at 1 Hz while ANT+ sends at
+# 4 Hz.
+
+SAMPLE_BUFFER_SIZE = 32
+LINEAR_WINDOW = 3.0             # samples fitted by the linear estimator [s]
+LINEAR_MIN_SPAN = 1.0           # fitted samples must span this long for a rate [s]
+EWMA_TIME_CONSTANT = 1.0        # exponential smoothing time constant [s]
+KALMAN_ACCEL_NOISE = 1.0        # process noise, speed change [(km/h)/s]
+KALMAN_MEASUREMENT_NOISE = 1.0  # measurement noise [km/h]
+EXTRAPOLATION_LIMIT = 2.0       # rate is applied at most this long after a sample [s]
+MAX_RATE = 20.0                 # |rate| limit [(km/h)/s]
+EXTRAPOLATION_MAX_CHANGE = 0.1  # extrapolated change limit, fraction of speed
+
+# Thresholds [s] measured from the last sample
+SPEED_DECAY_START = 3           # start of decay
+SPEED_DECAY_HALF_LIFE = 2.0     # speed halves every SPEED_DECAY_HALF_LIFE while decaying
+SPEED_DECAY_FLOOR = 0.05        # speed [km/h] treated as standstill while decaying
+SPEED_ZERO_AFTER = 30           # speed forced to 0
+
+
+class SampleBuffer:
+    """Fixed size ring buffer of ``(time, speed)`` samples, oldest overwritten.
+
+    Storage is preallocated; ``append`` only writes two list slots.
+    """
+
+    __slots__ = ("times", "speeds", "capacity", "count", "head")
+
+    def __init__(self, capacity=SAMPLE_BUFFER_SIZE):
+        self.capacity = capacity
+        self.times = [0.0] * capacity
+        self.speeds = [0.0] * capacity
+        self.count = 0
+        # index of the next write
+        self.head = 0
+
+    def clear(self):
+        self.count = 0
+        self.head = 0
+
+    def append(self, t, speed):
+        head = self.head
+        self.times[head] = t
+        self.speeds[head] = speed
+        head += 1
+        self.head = 0 if head == self.capacity else head
+        if self.count < self.capacity:
+            self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def latest(self, n=None):
+        """Return up to ``n`` newest samples as a list of ``(time, speed)``, oldest first."""
+        n = self.count if n is None else min(n, self.count)
+        capacity = self.capacity
+        start = self.head - n
+        return [(self.times[i % capacity], self.speeds[i % capacity]) for i in range(start, self.head)]
+
+    def since(self, t):
+        """Return samples newer than or at ``t`` as a list of ``(time, speed)``, oldest first."""
+        samples = []
+        capacity = self.capacity
+        for i in range(self.head - 1, self.head - 1 - self.count, -1):
+            sample_time = self.times[i % capacity]
+            if sample_time < t:
+                break
+            samples.append((sample_time, self.speeds[i % capacity]))
+        samples.reverse()
+        return samples
+
+
+class SpeedEstimator:
+    """Base estimator: holds the last sample, no smoothing or trend.
+
+    ``update()`` is called with the sample buffer after a new sample was
+    appended and returns ``(speed, rate)``: estimated speed [km/h] at the
+    newest sample time and its rate of change [(km/h)/s].
+    """
+
+    name = "hold"
+
+    def reset(self):
+        pass
+
+    def update(self, samples):
+        return samples.speeds[samples.head - 1], 0.0
+
+
+class LinearEstimator(SpeedEstimator):
+    """Least squares line through the samples of the last ``window`` seconds.
+
+    Samples spanning less than ``min_span`` seconds give no rate: the slope
+    of two samples a few milliseconds apart is noise.
+    """
+
+    name = "linear"
+
+    def __init__(self, window=LINEAR_WINDOW, min_span=LINEAR_MIN_SPAN):
+        self.window = window
+        self.min_span = min_span
+
+    def update(self, samples):
+        newest = samples.times[samples.head - 1]
+        points = samples.since(newest - self.window)
+        speed = points[-1][1]
+        if len(points) < 2 or newest - points[0][0] < self.min_span:
+            return speed, 0.0
+        n = len(points)
+        # times relative to the newest sample keep the sums well conditioned
+        mean_t = sum(t - newest for t, _ in points) / n
+        mean_v = sum(v for _, v in points) / n
+        var_t = sum((t - newest - mean_t) ** 2 for t, _ in points)
+        if var_t <= 0.0:
+            return speed, 0.0
+        rate = sum((t - newest - mean_t) * (v - mean_v) for t, v in points) / var_t
+        # fitted value at the newest sample
+        return mean_v - rate * mean_t, rate
+
+
+class EwmaEstimator(SpeedEstimator):
+    """Exponential smoothing with a time constant, correct for irregular sample intervals."""
+
+    name = "ewma"
+
+    def __init__(self, time_constant=EWMA_TIME_CONSTANT):
+        self.time_constant = time_constant
+        self.reset()
+
+    def reset(self):
+        self.speed = None
+        self.time = None
+
+    def update(self, samples):
+        t = samples.times[samples.head - 1]
+        value = samples.speeds[samples.head - 1]
+        if self.speed is None:
+            self.speed, self.time = value, t
+        elif t > self.time:
+            alpha = 1.0 - math.exp(-(t - self.time) / self.time_constant)
+            self.speed += alpha * (value - self.speed)
+            self.time = t
+        return self.speed, 0.0
+
+
+class KalmanEstimator(SpeedEstimator):
+    """Kalman filter over state ``(speed, rate)``, rate driven by random acceleration."""
+
+    name = "kalman"
+
+    def __init__(self, accel_noise=KALMAN_ACCEL_NOISE, measurement_noise=KALMAN_MEASUREMENT_NOISE):
+        self.accel_noise = accel_noise
+        self.measurement_noise = measurement_noise
+        self.reset()
+
+    def reset(self):
+        self.time = None
+        self.speed = 0.0
+        self.rate = 0.0
+        # covariance [[p00, p01], [p01, p11]]
+        self.p00 = self.p01 = self.p11 = 0.0
+
+    def update(self, samples):
+        t = samples.times[samples.head - 1]
+        value = samples.speeds[samples.head - 1]
+        r = self.measurement_noise ** 2
+        if self.time is None:
+            self.time = t
+            self.speed, self.rate = value, 0.0
+            self.p00, self.p01, self.p11 = r, 0.0, self.accel_noise ** 2
+            return self.speed, self.rate
+
+        dt = max(t - self.time, 0.0)
+        self.time = max(t, self.time)
+        # predict
+        speed = self.speed + self.rate * dt
+        q = self.accel_noise ** 2
+        p00 = self.p00 + dt * (2 * self.p01 + dt * self.p11) + q * dt ** 3 / 3
+        p01 = self.p01 + dt * self.p11 + q * dt ** 2 / 2
+        p11 = self.p11 + q * dt
+        # correct with measured speed
+        s = p00 + r
+        k0 = p00 / s
+        k1 = p01 / s
+        innovation = value - speed
+        self.speed = speed + k0 * innovation
+        self.rate = self.rate + k1 * innovation
+        self.p00 = (1 - k0) * p00
+        self.p01 = (1 - k0) * p01
+        self.p11 = p11 - k1 * p01
+        return self.speed, self.rate
+
+
+ESTIMATORS = {cls.name: cls for cls in (SpeedEstimator, LinearEstimator, EwmaEstimator, KalmanEstimator)}
+SPEED_ESTIMATORS = tuple(ESTIMATORS)
+
+
+def create_estimator(name):
+    """Return a new estimator instance for ``name`` (see ``SPEED_ESTIMATORS``)."""
+    try:
+        return ESTIMATORS[name]()
+    except KeyError:
+        raise ValueError(f"estimator must be one of {SPEED_ESTIMATORS}, got {name!r}") from None
+
+
+def speed_at(snapshot, now):
+    """Estimated speed [km/h] of ``snapshot`` at time ``now`` (``time.time()``).
+
+    The published rate is applied for at most ``EXTRAPOLATION_LIMIT``
+    seconds and changes speed by at most ``EXTRAPOLATION_MAX_CHANGE`` of
+    it; from ``SPEED_DECAY_START`` seconds after the last sample speed
+    decays exponentially with ``SPEED_DECAY_HALF_LIFE`` and is 0 after
+    ``SPEED_ZERO_AFTER``. Without a sample (none yet, or cleared when ANT+
+    stopped) speed is 0.
+    """
+    last_post_time = snapshot.last_post_time
+    if last_post_time is None:
+        return 0.0
+    elapsed = now - last_post_time
+    if elapsed <= 0.0:
+        return snapshot.speed
+    if elapsed >= SPEED_ZERO_AFTER:
+        return 0.0
+    speed = snapshot.speed
+    if snapshot.rate:
+        change = snapshot.rate * (elapsed if elapsed < EXTRAPOLATION_LIMIT else EXTRAPOLATION_LIMIT)
+        limit = abs(speed) * EXTRAPOLATION_MAX_CHANGE
+        speed += change if -limit <= change <= limit else math.copysign(limit, change)
+    if elapsed > SPEED_DECAY_START:
+        speed *= 0.5 ** ((elapsed - SPEED_DECAY_START) / SPEED_DECAY_HALF_LIFE)
+        if speed < SPEED_DECAY_FLOOR:
+            return 0.0
+    return speed if speed > 0.0 else 0.0
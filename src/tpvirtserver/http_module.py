@@ -1,15 +1,26 @@
-from http.server import BaseHTTPRequestHandler, HTTPServer
-import ssl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import json
 import threading
 import logging
+import sys
 import time
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse
 
 
 from .__init__ import shared_data
+from .metrics_module import POST_REQUESTS, POST_REJECTED, POST_DURATION
+from .ingest_module import handle_get, handle_post, is_stream_path, resolve_sensor, unresolved_response, StreamDecoder, DEFAULT_POST_OPTIONS
+from .ingest_module import PendingCommand, STATUS_STREAM_PATH, STATUS_STREAMS, status_event, status_stream_interval
+from .ingest_module import TOO_MANY_REQUESTS_BODY, rate_limit_headers
+from .session_module import request_token, SESSION_TOKEN_HEADER
+from .log_module import LogRateLimit
 
 # Definition of Variables
+SSL_HANDSHAKE_TIMEOUT = 10.0    # TLS handshake timeout [s]
+
+# per request debug messages
+REQUEST_LOG = LogRateLimit()
+CONNECTION_LOG = LogRateLimit()
 
 #BikeSpeed = 27.0 / 3.6  # m/s => 10km/h
 # BikeSpeed = None
@@ -17,82 +28,224 @@ from .__init__ import shared_data
 
 # Fictive Config of Treadmill
 
+class HttpProtocolError(Exception):
+    """Malformed request; answered with ``status`` and the connection closed."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
 # ======================================================
 # HTTPD
 # ======================================================
 class TPVHttpPRequestHandler(BaseHTTPRequestHandler):
     logger = None
     shared_data = None
+    post_options = DEFAULT_POST_OPTIONS
+
+    def setup(self):
+        # TLS handshake runs here, in the connection thread, not in accept()
+        if hasattr(self.request, "do_handshake"):
+            self.request.settimeout(SSL_HANDSHAKE_TIMEOUT)
+            self.request.do_handshake()
+            self.request.settimeout(None)
+        super().setup()
     
     def do_GET(self):
         parsed_path = urlparse(self.path)
-        query_params = parse_qs(parsed_path.query)
         path = parsed_path.path
-        
-        if path.startswith("/diagnostic/antstart"):
-            response = "Starting ANT diagnostic mode..."
-            shared_data.command_queue.put("ANT_START")
-            self.logger.info("ANT diagnostic mode started.")
-        elif path.startswith("/diagnostic/antstop"):
-            response = "Stopping ANT diagnostic mode..."
-            shared_data.command_queue.put("ANT_STOP")
-            self.logger.info("ANT diagnostic mode stopped.")
-            
+
+        if path == STATUS_STREAM_PATH:
+            self._stream_status(status_stream_interval(parsed_path.query))
+            return
+
         # Obsługa żądania GET
-        self.send_response(200)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
-        response = {"message": "This is a GET response", "status": "success"}
-        self.wfile.write(json.dumps(response).encode("utf-8"))
+        status, response = handle_get(self.shared_data, path, self.logger, parsed_path.query)
+        if isinstance(response, PendingCommand):
+            status, response = response.wait()
+        self._send_json(status, response)
+
+    def _stream_status(self, interval):
+        # server-sent events until the client leaves or the server stops
+        if not STATUS_STREAMS.acquire(blocking=False):
+            self._send_json(503, {"error": "Too many status streams"})
+            return
+        self.close_connection = True
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            stopping = self.server.stopping
+            while not stopping.is_set():
+                self.wfile.write(status_event(self.shared_data))
+                self.wfile.flush()
+                stopping.wait(interval)
+        except OSError:
+            pass  # client gone
+        finally:
+            STATUS_STREAMS.release()
 
     def do_POST(self):
         # Obsługa żądania POST
-        content_length = int(self.headers["Content-Length"])
-        post_data = self.rfile.read(content_length)
+        start = time.perf_counter()
+        POST_REQUESTS.inc()
+        status = self._handle_post()
+        if status >= 400:
+            POST_REJECTED.inc()
+        POST_DURATION.observe(time.perf_counter() - start)
+
+    def _handle_post(self):
+        url = urlparse(self.path)
+        path = url.path
+        client = self.client_address[0]
+        retry_after = self.post_options.retry_after(client)
+        if retry_after is not None:
+            # the body is not read, the connection cannot be reused
+            self.close_connection = True
+            self._send_json(429, TOO_MANY_REQUESTS_BODY, rate_limit_headers(retry_after))
+            return 429
+        token = request_token(self.headers.get(SESSION_TOKEN_HEADER), url.query)
+        if is_stream_path(path):
+            status, response = self._receive_stream(path, client, token)
+            self._send_json(status, response)
+            return status
+
+        if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+            try:
+                post_data = b"".join(self._iter_chunks(self.post_options.max_body_size))
+            except HttpProtocolError as e:
+                self.close_connection = True
+                self._send_json(e.status, {"error": str(e)})
+                return e.status
+        else:
+            try:
+                content_length = self._content_length()
+            except HttpProtocolError as e:
+                self.close_connection = True
+                self._send_json(e.status, {"error": str(e)})
+                return e.status
+            if content_length > self.post_options.max_body_size:
+                self.close_connection = True
+                self._send_json(413, {"error": "Payload too large"})
+                return 413
+            post_data = self.rfile.read(content_length)
+
+        status, response = handle_post(self.shared_data, post_data, TPVHttpPRequestHandler.logger, path, self.post_options, client, token,
+                                       self.headers.get("Content-Type"))
+        self._send_json(status, response)
+        return status
 
+    def _content_length(self):
+        value = self.headers["Content-Length"]
+        if value is None:
+            raise HttpProtocolError(411, "Content-Length required")
         try:
-            data = json.loads(post_data)
-            if isinstance(data, list):
-                data = data[0]  # Pobierz pierwszy element, jeśli to lista
+            content_length = int(value)
+        except ValueError:
+            raise HttpProtocolError(400, "Invalid Content-Length") from None
+        if content_length < 0:
+            raise HttpProtocolError(400, "Invalid Content-Length")
+        return content_length
 
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(
-                json.dumps({"message": "JSON received successfully", "received_data": data}).encode("utf-8")
-            )
-        
-            if TPVHttpPRequestHandler.logger:
-                TPVHttpPRequestHandler.logger.debug(f"Received JSON: {data}")
-        
-            speed_rec = data['speed']
-            speed_kmh = 3.6*speed_rec/1000.0
-            time_recv = time.time()
-            with self.shared_data.lock:
-                self.shared_data.BikeSpeed = speed_kmh
-                # update last_post_time in server
-                self.shared_data.last_post_time = time_recv
-                
-            if TPVHttpPRequestHandler.logger:
-                TPVHttpPRequestHandler.logger.debug(f"Speed [Recv]:{speed_rec} Speed [km/h]: {speed_kmh:.1f}")
-
-        except json.JSONDecodeError:
-            self.send_response(400)
-            self.send_header("Content-Type", "application/json")
+    def _iter_chunks(self, limit=None):
+        # body of "Transfer-Encoding: chunked" request, at most ``limit`` bytes (streams: unlimited)
+        total = 0
+        while True:
+            try:
+                size = int(self.rfile.readline().split(b";", 1)[0].strip(), 16)
+            except ValueError:
+                raise HttpProtocolError(400, "Bad chunk size") from None
+            if size < 0:
+                # int() accepts a sign, read(-1) would read to EOF
+                raise HttpProtocolError(400, "Bad chunk size")
+            if size == 0:
+                while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                    pass
+                return
+            total += size
+            if limit is not None and total > limit:
+                # not read, the connection is closed
+                raise HttpProtocolError(413, "Payload too large")
+            chunk = self.rfile.read(size)
+            self.rfile.read(2)
+            yield chunk
+
+    def _receive_stream(self, path, client=None, token=None):
+        # NDJSON samples applied while the body arrives, nothing is echoed
+        state = resolve_sensor(self.shared_data, path, client, token)
+        if state is None:
+            self.close_connection = True
+            return unresolved_response(self.shared_data, path, token)
+        decoder = StreamDecoder(self.shared_data, state, TPVHttpPRequestHandler.logger)
+        try:
+            if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+                for chunk in self._iter_chunks():
+                    decoder.feed(chunk)
+            else:
+                remaining = self._content_length()
+                while remaining > 0:
+                    chunk = self.rfile.read1(min(remaining, 65536))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    decoder.feed(chunk)
+        except HttpProtocolError as e:
+            self.close_connection = True
+            return e.status, {"error": str(e)}
+        except ValueError as e:
+            self.close_connection = True
+            return 413, {"error": str(e)}
+        decoder.close()
+        return 200, decoder.response()
+
+    def _send_json(self, status, response, headers=None):
+        self.send_response(status)
+        if headers:
+            for name, value in headers.items():
+                self.send_header(name, value)
+        if response is None:
+            # 204, no body
             self.end_headers()
-            self.wfile.write(json.dumps({"error": "Invalid JSON"}).encode("utf-8"))
-    
+            return
+        body = response if isinstance(response, bytes) else json.dumps(response).encode("utf-8")
+        self.send_header("Content-Type", getattr(response, "content_type", "application/json"))
+        self.end_headers()
+        self.wfile.write(body)
+
     def log_message(self, format, *args):
-        if TPVHttpPRequestHandler.logger:
-            TPVHttpPRequestHandler.logger.debug("%s - - [%s] %s" % (
-                self.client_address[0],
-                self.log_date_time_string(),
-                format % args
-            ))
+        logger = TPVHttpPRequestHandler.logger
+        if logger and logger.isEnabledFor(logging.DEBUG):
+            note = REQUEST_LOG.allow()
+            if note is not None:
+                logger.debug("%s - - [%s] %s%s" % (
+                    self.client_address[0],
+                    self.log_date_time_string(),
+                    format % args,
+                    note,
+                ))
+
+
+class TPVThreadingHTTPServer(ThreadingHTTPServer):
+    """``ThreadingHTTPServer`` logging connection errors instead of printing them."""
+
+    logger = None
+
+    def handle_error(self, request, client_address):
+        error = sys.exc_info()[1]
+        if isinstance(error, OSError):
+            # failed TLS handshakes, timeouts and dropped connections
+            if self.logger.isEnabledFor(logging.DEBUG):
+                note = CONNECTION_LOG.allow()
+                if note is not None:
+                    self.logger.debug(f"Connection {client_address[0]} failed: {error}{note}")
+        else:
+            self.logger.exception(f"Error while serving {client_address[0]}")
 
 
 class TPVHttpServer:
-    def __init__(self, ip: str, port: int, use_ssl: bool, certFilePath :str | None, keyFilePath :str | None, shared_data, logger):
+    def __init__(self, ip: str, port: int, use_ssl: bool, certFilePath :str | None, keyFilePath :str | None, shared_data, logger, post_options=DEFAULT_POST_OPTIONS, reuse_port=False, tls_profile="compat"):
         self.logger = logger.getChild("HttpServer")
         TPVHttpPRequestHandler.logger = self.logger.getChild("TPVHttpPRequestHandler")
 
@@ -100,13 +253,37 @@ class TPVHttpServer:
         self.port = port
         self.shared_data = shared_data
         
-        self.httpd = HTTPServer((self.ip, self.port), TPVHttpPRequestHandler)
+        self.httpd = TPVThreadingHTTPServer((self.ip, self.port), TPVHttpPRequestHandler, bind_and_activate=False)
+        self.httpd.logger = self.logger
+        # ends status streams on stop()
+        self.httpd.stopping = threading.Event()
+        # SO_REUSEPORT, lets several ingest worker processes share the port
+        self.httpd.allow_reuse_port = reuse_port
+        try:
+            self.httpd.server_bind()
+            self.httpd.server_activate()
+        except Exception:
+            self.httpd.server_close()
+            raise
         # przekazanie shared_data do handlera poprzez instancję serwera
         TPVHttpPRequestHandler.shared_data = shared_data
+        TPVHttpPRequestHandler.post_options = post_options
         self.httpd.shared_data = shared_data
-   
+
+        # the port is bound above, TLS is set up in start()
+        self.use_ssl = use_ssl
+        self.certFilePath = certFilePath
+        self.keyFilePath = keyFilePath
+        self.tls_profile = tls_profile
+        self.tls = None
+        self.ssl_context = None
+        self.thread = None
+        
+    def start(self):
         # Tworzenie serwera
-        if use_ssl:
+        if self.use_ssl and self.ssl_context is None:
+            from .tls_module import CertificateReloader
+
             # # Certyfikatu SSL generation
             # private_key, cert_pem = generate_self_signed_cert()
 
@@ -117,16 +294,12 @@ class TPVHttpServer:
             #     key_file.write(private_key)
 
             # Konfiguracja SSL
-            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-            #context.load_cert_chain(certfile="config/cert-chain.pem", keyfile="config/key.pem")
-            context.load_cert_chain(certfile = certFilePath, keyfile = keyFilePath)
+            self.tls = CertificateReloader(self.certFilePath, self.keyFilePath, self.tls_profile, self.logger)
+            self.ssl_context = self.tls.context
+
+            # Owijanie serwera w SSL, handshake in the request thread (see setup())
+            self.httpd.socket = self.ssl_context.wrap_socket(self.httpd.socket, server_side=True, do_handshake_on_connect=False)
 
-            # Owijanie serwera w SSL
-            self.httpd.socket = context.wrap_socket(self.httpd.socket, server_side=True)
-            
-        self.thread = None
-        
-    def start(self):
         self.thread = threading.Thread(target=self._serve)
         self.thread.start()
     
@@ -136,8 +309,13 @@ class TPVHttpServer:
             self.logger.info(f"Server running on https://{actual_ip}:{actual_port}/")
         self.httpd.serve_forever()
         
+    def reload_certificates(self, force=False):
+        """Serve new certificate files if they changed (always if ``force``), see ``CertificateReloader``."""
+        return self.tls is not None and self.tls.reload(force)
+
     def stop(self):
         self.logger.info("Stopping HTTP server...")
+        self.httpd.stopping.set()
         self.httpd.shutdown()
         self.thread.join()
         self.logger.info("HTTP server stopped.")
@@ -0,0 +1,787 @@
+import json
+import logging
+import math
+import queue
+import re
+import struct
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs
+
+from .metrics_module import REGISTRY, POST_PARSE, STREAM_SAMPLES, BATCH_SAMPLES, RATE_LIMITED
+from .ant_module import parse_channel_settings
+from .log_module import LogRateLimit
+from .estimator_module import speed_at
+from .store_module import MAX_STORE_RESULTS, STORE_QUERY_WINDOW
+from .page_module import ANT_PROFILES
+
+# ======================================================
+# Transport independent request handling
+# ======================================================
+# Both HTTP engines (threaded ``TPVHttpServer`` and asyncio based
+# ``TPVAsyncHttpServer``) route requests through these helpers, so the JSON
+# contract of ``/diagnostic/*`` and POST endpoints stays identical.
+
+GET_RESPONSE = {"message": "This is a GET response", "status": "success"}
+ACK_BODY = b'{"status": "ok"}'  # pre-encoded, sent as is
+INVALID_JSON_RESPONSE = {"error": "Invalid JSON"}
+UNKNOWN_SENSOR_RESPONSE = {"error": "Unknown sensor"}
+MISSING_TOKEN_RESPONSE = {"error": "Missing session token"}
+NO_FREE_SENSOR_RESPONSE = {"error": "No free sensor"}
+COMMAND_QUEUE_FULL_RESPONSE = {"error": "Command queue full"}
+STORE_DISABLED_RESPONSE = {"error": "Ride store disabled"}
+INVALID_SPEED_RESPONSE = {"error": "'speed' must be a finite number"}
+TOO_MANY_REQUESTS_BODY = b'{"error": "Too many requests"}'  # pre-encoded, sent as is
+
+METRICS_PATH = "/metrics"
+# GET /status: JSON snapshot of sensors, ANT+ channels and queues,
+# GET /status/stream: the same live speed as server-sent events
+STATUS_PATH = "/status"
+STATUS_STREAM_PATH = "/status/stream"
+STATUS_STREAM_INTERVAL = 1.0        # default event interval [s], ?interval= in 0.25 .. 60
+MIN_STATUS_STREAM_INTERVAL = 0.25
+MAX_STATUS_STREAM_INTERVAL = 60.0
+MAX_STATUS_STREAMS = 16
+# open status streams of this process, one slot each
+STATUS_STREAMS = threading.BoundedSemaphore(MAX_STATUS_STREAMS)
+COMMAND_TIMEOUT = 10.0      # wait of /diagnostic/antstart|antstop for the main loop [s]
+PROCESS_START = time.monotonic()
+# GET /rides/<device_number>?start=&end=&limit= reads stored ride data (--store)
+STORE_PATH_PREFIX = "/rides/"
+# POST /admin/channel/<device_number> with a JSON object of channel settings
+ADMIN_CHANNEL_PREFIX = "/admin/channel/"
+
+
+class TextBody(bytes):
+    """Pre-encoded response body with its own content type."""
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# POST /sensor/<device_number> routes speed to one of several virtual sensors,
+# any other path updates the default sensor
+SENSOR_PATH_PREFIX = "/sensor/"
+# [/sensor/<device_number>]/stream carries newline delimited JSON samples
+# (chunked POST or WebSocket), applied as they arrive and never echoed back
+STREAM_PATH_SUFFIX = "/stream"
+MAX_STREAM_LINE = 64 * 1024
+# [/sensor/<device_number>]/batch carries several timestamped samples in one
+# request: JSON list of {"time": s, "speed": mm/s}, CSV lines "time,speed"
+# (text/csv) or packed BATCH_RECORD structs (application/octet-stream)
+BATCH_PATH_SUFFIX = "/batch"
+BATCH_RECORD = struct.Struct("<df")    # time f64 [s], speed f32 [mm/s]
+MAX_BATCH_SAMPLES = 1000
+
+
+MAX_BODY_SIZE = 1024 * 1024
+# samples of a sensor fed more recently wake the main loop only while ANT+ is stopped
+SAMPLE_IDLE_WAKEUP = 1.0        # [s]
+
+# per client token bucket on POST, checked before the body is read
+RATE_LIMIT = 50.0               # default POSTs per second and client address, 0 is unlimited
+RATE_LIMIT_BURST = 2.0          # bucket size in seconds of rate
+MAX_RATE_LIMIT_CLIENTS = 4096   # buckets kept, least recently seen clients are forgotten
+
+# per request debug messages
+RECEIVED_LOG = LogRateLimit()
+SPEED_LOG = LogRateLimit()
+BATCH_LOG = LogRateLimit()
+
+ACK_MODES = ("full", "minimal", "none")
+POST_PARSERS = ("json", "orjson", "fast")
+# first "speed" number in the body, used by the "fast" parser
+SPEED_FIELD = re.compile(rb'"speed"\s*:\s*(-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)')
+# sample field -> SensorMetrics field, read for profiles with metrics
+METRIC_FIELDS = {"cadence": "cadence", "power": "power", "heartrate": "heart_rate"}
+
+_orjson = None
+
+
+def load_orjson():
+    """Return the optional orjson module, None if not installed.
+
+    Imported on first use, so the default ``json`` parser does not pay for it
+    at startup.
+    """
+    global _orjson
+    if _orjson is None:
+        try:
+            import orjson
+        except ImportError:  # optional fast JSON backend
+            orjson = False
+        _orjson = orjson
+    return _orjson or None
+
+
+class ClientRateLimiter:
+    """Token bucket per client address.
+
+    Parameters
+    ----------
+    rate : float
+        Requests per second and client.
+    burst : float or None
+        Bucket size, requests let through at once; None holds
+        ``RATE_LIMIT_BURST`` seconds of ``rate`` (at least one request).
+    max_clients : int
+        Number of buckets kept. The least recently seen client is forgotten
+        first, so memory stays bounded however many addresses show up; a
+        forgotten client starts again with a full bucket.
+    """
+
+    def __init__(self, rate, burst=None, max_clients=MAX_RATE_LIMIT_CLIENTS):
+        if rate <= 0:
+            raise ValueError(f"rate must be positive, got {rate}")
+        self.rate = rate
+        self.burst = max(1.0, rate * RATE_LIMIT_BURST) if burst is None else burst
+        self.max_clients = max_clients
+        # client -> [tokens, monotonic time of the last refill], oldest first
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def check(self, client):
+        """Take one request of ``client`` from its bucket.
+
+        Returns
+        -------
+        float or None
+            None if the request is allowed, else the seconds until the
+            bucket holds a request again.
+        """
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(client)
+            if bucket is None:
+                if len(self.buckets) >= self.max_clients:
+                    self.buckets.popitem(last=False)
+                bucket = self.buckets[client] = [self.burst, now]
+            else:
+                self.buckets.move_to_end(client)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1.0:
+                bucket[0] -= 1.0
+                return None
+            retry_after = (1.0 - bucket[0]) / self.rate
+        RATE_LIMITED.inc()
+        return retry_after
+
+
+def rate_limit_headers(retry_after):
+    """Headers of a 429 answer, ``Retry-After`` in whole seconds (at least 1)."""
+    return {"Retry-After": str(max(1, math.ceil(retry_after)))}
+
+
+class PostOptions:
+    """POST handling options of one server.
+
+    Parameters
+    ----------
+    ack_mode : str
+        ``full`` echoes the received JSON (original contract), ``minimal``
+        answers with a constant small body, ``none`` answers 204 No Content.
+    parser : str
+        ``json`` (stdlib), ``orjson`` (requires the orjson package) or
+        ``fast``: the first ``"speed"`` number is taken straight from the raw
+        body, full parsing is done only if it is missing. ``fast`` needs an
+        ack mode other than ``full``, which has to echo the whole object.
+    max_body_size : int
+        Maximum accepted ``Content-Length`` (bytes), larger bodies get 413.
+    rate_limit : float
+        POST requests per second and client address, more get 429 before
+        their body is read; 0 is unlimited.
+    """
+
+    def __init__(self, ack_mode="full", parser="json", max_body_size=MAX_BODY_SIZE, rate_limit=0.0):
+        if ack_mode not in ACK_MODES:
+            raise ValueError(f"ack_mode must be one of {ACK_MODES}, got {ack_mode!r}")
+        if parser not in POST_PARSERS:
+            raise ValueError(f"parser must be one of {POST_PARSERS}, got {parser!r}")
+        orjson = load_orjson() if parser != "json" else None
+        if parser == "orjson" and orjson is None:
+            raise ValueError("parser 'orjson' requires the orjson package")
+        if rate_limit < 0:
+            raise ValueError(f"rate_limit must not be negative, got {rate_limit}")
+        self.ack_mode = ack_mode
+        self.parser = parser
+        self.max_body_size = max_body_size
+        self.loads = orjson.loads if orjson is not None else json.loads
+        self.extract_speed = parser == "fast" and ack_mode != "full"
+        self.ack = (200, ACK_BODY) if ack_mode == "minimal" else (204, None)
+        self.limiter = ClientRateLimiter(rate_limit) if rate_limit > 0 else None
+
+    def retry_after(self, client):
+        """Return None if ``client`` may POST now, else the seconds it has to wait."""
+        if self.limiter is None:
+            return None
+        return self.limiter.check(client)
+
+DEFAULT_POST_OPTIONS = PostOptions()
+
+
+def is_stream_path(path):
+    """Return True if ``path`` addresses the streaming ingest endpoint."""
+    return path.rstrip("/").endswith(STREAM_PATH_SUFFIX)
+
+
+def is_batch_path(path):
+    """Return True if ``path`` addresses the batch ingest endpoint."""
+    return path.rstrip("/").endswith(BATCH_PATH_SUFFIX)
+
+
+def resolve_sensor(shared_data, path, client=None, token=None):
+    """Return speed state addressed by POST ``path`` or None for unknown sensor.
+
+    ``/sensor/<device number>`` selects the sensor directly; any other path
+    goes to the session of ``client`` (address) or ``token`` if
+    ``shared_data.sessions`` is set, otherwise to the default sensor.
+    """
+    if not path.startswith(SENSOR_PATH_PREFIX):
+        sessions = shared_data.sessions
+        if sessions is None or sessions.key == "path":
+            return shared_data
+        return sessions.resolve(client, token)
+    segment = path[len(SENSOR_PATH_PREFIX):].split("/", 1)[0]
+    try:
+        return shared_data.get_sensor(int(segment))
+    except ValueError:
+        return None
+
+
+def unresolved_response(shared_data, path, token=None):
+    """Return ``(status, response)`` for a request ``resolve_sensor`` found no sensor for."""
+    sessions = shared_data.sessions
+    if path.startswith(SENSOR_PATH_PREFIX) or sessions is None or sessions.key == "path":
+        return 404, UNKNOWN_SENSOR_RESPONSE
+    if sessions.key == "token" and token is None:
+        return 400, MISSING_TOKEN_RESPONSE
+    return 503, NO_FREE_SENSOR_RESPONSE
+
+
+class PendingCommand:
+    """Main loop command a request waits for.
+
+    Queued as ``(command, pending)``; the main loop calls ``complete()``
+    after running it. HTTP engines wait with ``wait()`` (the asyncio engine
+    in an executor thread) and answer with its result.
+    """
+
+    def __init__(self, command, timeout=COMMAND_TIMEOUT):
+        self.command = command
+        self.timeout = timeout
+        self.done = threading.Event()
+        self.running = None
+        # requests of the same command coalesced into this one
+        self.followers = []
+
+    def chain(self, pending):
+        """Complete ``pending`` (same command, queued later) together with this one."""
+        self.followers.append(pending)
+
+    def complete(self, running):
+        """Report ANT+ state after the command, ``running`` as ``isRunning()``."""
+        self.running = running
+        self.done.set()
+        for pending in self.followers:
+            pending.complete(running)
+
+    def wait(self):
+        """Wait for completion, return ``(status, response)``."""
+        if not self.done.wait(self.timeout):
+            return 504, {"error": f"{self.command} not completed within {self.timeout:g} s"}
+        expected = self.command == "ANT_START"
+        if self.running != expected:
+            return 500, {"error": f"{self.command} failed", "ant_running": self.running}
+        return 200, dict(GET_RESPONSE, ant_running=self.running)
+
+
+def handle_get(shared_data, path, logger=None, query=""):
+    """Handle GET request for ``path`` with URL ``query`` string.
+
+    ``/diagnostic/antstart`` and ``antstop`` wait until the main loop ran
+    the command if ANT+ runs in this process (``shared_data.ant_status``
+    set): the response is a ``PendingCommand`` to ``wait()`` for. Ingest
+    workers only queue the command. A full command queue is answered with
+    503 right away.
+
+    Returns
+    -------
+    tuple
+        ``(status, response)`` where ``response`` is a JSON serializable
+        object or a ``PendingCommand``.
+    """
+    if path == METRICS_PATH:
+        return 200, TextBody(REGISTRY.render())
+    if path == STATUS_PATH:
+        return 200, status_response(shared_data)
+    if path.startswith(STORE_PATH_PREFIX):
+        return handle_store_query(shared_data, path, query)
+
+    if path.startswith("/diagnostic/antstart"):
+        command = "ANT_START"
+        if logger:
+            logger.info("ANT diagnostic mode started.")
+    elif path.startswith("/diagnostic/antstop"):
+        command = "ANT_STOP"
+        if logger:
+            logger.info("ANT diagnostic mode stopped.")
+    else:
+        return 200, GET_RESPONSE
+
+    try:
+        if shared_data.ant_status is None:
+            shared_data.put_command(command)
+            return 202, dict(GET_RESPONSE, status="accepted")
+        pending = PendingCommand(command)
+        shared_data.put_command((command, pending))
+    except queue.Full:
+        return 503, COMMAND_QUEUE_FULL_RESPONSE
+    return 200, pending
+
+
+def handle_store_query(shared_data, path, query):
+    """Stored ride data of one sensor in a time range.
+
+    Query parameters ``start`` and ``end`` are ``time.time()`` seconds (the
+    last hour by default), ``limit`` caps the records returned. ``next`` in
+    the answer is the ``start`` of the following page, None if complete.
+    """
+    if shared_data.store is None:
+        return 404, STORE_DISABLED_RESPONSE
+    try:
+        device_number = int(path[len(STORE_PATH_PREFIX):].strip("/"))
+    except ValueError:
+        return 404, UNKNOWN_SENSOR_RESPONSE
+    if shared_data.get_sensor(device_number) is None:
+        return 404, UNKNOWN_SENSOR_RESPONSE
+    params = parse_qs(query)
+    try:
+        end = float(params["end"][0]) if "end" in params else time.time()
+        start = float(params["start"][0]) if "start" in params else end - STORE_QUERY_WINDOW
+        limit = int(params["limit"][0]) if "limit" in params else MAX_STORE_RESULTS
+    except ValueError:
+        return 400, {"error": "start, end and limit must be numbers"}
+    if limit < 1:
+        return 400, {"error": "limit must be positive"}
+    try:
+        result = shared_data.store.query(device_number, start, end, limit)
+    except (OSError, ValueError) as e:
+        # not created yet by the ANT+ process, or not a store file
+        return 503, {"error": f"Ride store not available: {e}"}
+    return 200, dict(result, device_number=device_number, start=start, end=end)
+
+
+def sensor_status(state, now):
+    """Live speed of sensor ``state`` at ``now`` (``time.time()``)."""
+    snapshot = state.snapshot
+    last_post_time = snapshot.last_post_time
+    return {
+        "device_number": state.device_number,
+        "speed": round(speed_at(snapshot, now), 3),
+        "last_post_age": None if last_post_time is None else round(now - last_post_time, 3),
+        "sequence": snapshot.sequence,
+    }
+
+
+def status_response(shared_data):
+    """Full status: sensors with their ANT+ channel counters, ANT+ Node state and command queue.
+
+    Without ANT+ in this process (ingest workers) ``ant`` is None and the
+    sensors carry speed only, as seen by this worker.
+    """
+    now = time.time()
+    ant = shared_data.ant_status() if shared_data.ant_status is not None else None
+    channels = ant["sensors"] if ant is not None else {}
+    sensors = []
+    for state in shared_data.all_sensors():
+        status = sensor_status(state, now)
+        status["rate"] = round(state.snapshot.rate, 3)
+        status.update(channels.get(state.device_number, {}))
+        sensors.append(status)
+    return {
+        "uptime": round(time.monotonic() - PROCESS_START, 3),
+        "ant": None if ant is None else {key: value for key, value in ant.items() if key != "sensors"},
+        "command_queue_depth": shared_data.command_queue.qsize(),
+        "sensors": sensors,
+    }
+
+
+def live_status(shared_data):
+    """Payload of one status stream event: speed of every sensor and ANT+ state."""
+    now = time.time()
+    ant = shared_data.ant_status() if shared_data.ant_status is not None else None
+    return {
+        "time": round(now, 3),
+        "ant_running": None if ant is None else ant["running"],
+        "sensors": [sensor_status(state, now) for state in shared_data.all_sensors()],
+    }
+
+
+def status_stream_interval(query):
+    """Event interval [s] requested by the ``interval`` query parameter, clamped."""
+    for name, _, value in (item.partition("=") for item in query.split("&")):
+        if name == "interval":
+            try:
+                interval = float(value)
+            except ValueError:
+                break
+            if interval != interval:  # NaN
+                break
+            return max(MIN_STATUS_STREAM_INTERVAL, min(MAX_STATUS_STREAM_INTERVAL, interval))
+    return STATUS_STREAM_INTERVAL
+
+
+def status_event(shared_data):
+    """Encode one server-sent event of ``live_status()``."""
+    return b"event: status\ndata: " + json.dumps(live_status(shared_data)).encode("utf-8") + b"\n\n"
+
+
+def handle_post(shared_data, post_data, logger=None, path="/", options=DEFAULT_POST_OPTIONS, client=None, token=None,
+                content_type=None):
+    """Handle TPV POST body, update speed in ``shared_data``.
+
+    Parameters
+    ----------
+    shared_data : SharedData
+        Shared state updated with received speed (km/h).
+    post_data : bytes
+        Raw request body (JSON object or list of objects).
+    logger : logging.Logger or None
+        Logger for debug messages.
+    path : str
+        Request path, selects the sensor (see ``resolve_sensor``).
+    options : PostOptions
+        Parser and acknowledge mode.
+    client : str or None
+        Client address, session key in ``address`` mode.
+    token : str or None
+        Session token, session key in ``token`` mode.
+    content_type : str or None
+        ``Content-Type`` header, selects the body format of batch requests.
+
+    Returns
+    -------
+    tuple
+        ``(status, response)`` where ``response`` is a JSON serializable
+        object, pre-encoded ``bytes`` (JSON unless it is a ``TextBody``) or
+        None for an empty body.
+    """
+    if path.startswith(ADMIN_CHANNEL_PREFIX):
+        return handle_admin_channel(shared_data, post_data, path, options, logger)
+
+    state = resolve_sensor(shared_data, path, client, token)
+    if state is None:
+        return unresolved_response(shared_data, path, token)
+
+    if is_batch_path(path):
+        return handle_batch(shared_data, state, post_data, content_type, options, logger)
+
+    parse_start = time.perf_counter()
+    # profiles sending cadence, power or heart rate need the whole sample
+    if options.extract_speed and not ANT_PROFILES[state.profile].metrics:
+        match = SPEED_FIELD.search(post_data)
+        if match is not None:
+            POST_PARSE.observe(time.perf_counter() - parse_start)
+            speed_rec = float(match.group(1))
+            if not math.isfinite(speed_rec):  # 1e999
+                return 400, INVALID_SPEED_RESPONSE
+            last_post_time = state.last_post_time
+            apply_speed(state, speed_rec, logger)
+            wake_for_sample(shared_data, last_post_time)
+            return options.ack
+
+    try:
+        data = options.loads(post_data)
+    except ValueError:  # JSONDecodeError and UnicodeDecodeError of all backends
+        return 400, INVALID_JSON_RESPONSE
+    POST_PARSE.observe(time.perf_counter() - parse_start)
+
+    if isinstance(data, list):
+        data = data[0] if data else {}  # Pobierz pierwszy element, jeśli to lista
+
+    if logger and logger.isEnabledFor(logging.DEBUG):
+        note = RECEIVED_LOG.allow()
+        if note is not None:
+            logger.debug(f"Received JSON: {data}{note}")
+
+    # NaN, Infinity (json module) and true must not reach the TX callback
+    speed_rec = data.get("speed") if isinstance(data, dict) else None
+    if speed_rec is not None and not is_finite_number(speed_rec):
+        return 400, INVALID_SPEED_RESPONSE
+
+    last_post_time = state.last_post_time
+    if apply_sample(state, data, logger):
+        wake_for_sample(shared_data, last_post_time)
+
+    if options.ack_mode == "full":
+        return 200, {"message": "JSON received successfully", "received_data": data}
+    return options.ack
+
+
+def handle_admin_channel(shared_data, post_data, path, options=DEFAULT_POST_OPTIONS, logger=None):
+    """Queue new settings of one ANT+ channel for the main loop.
+
+    ``post_data`` is a JSON object with any of ``period`` (count or
+    ``4hz``/``2hz``/``1hz``), ``transmission_type`` and ``adaptive``. The
+    settings are validated here and applied by the main loop, 202 means
+    accepted, not applied yet.
+    """
+    segment = path[len(ADMIN_CHANNEL_PREFIX):].strip("/")
+    try:
+        device_number = int(segment)
+    except ValueError:
+        return 404, UNKNOWN_SENSOR_RESPONSE
+    state = shared_data.get_sensor(device_number)
+    if state is None:
+        return 404, UNKNOWN_SENSOR_RESPONSE
+    try:
+        data = options.loads(post_data)
+    except ValueError:
+        return 400, INVALID_JSON_RESPONSE
+    profile = ANT_PROFILES[state.profile]
+    try:
+        # rates are multiples of the period of the sensor profile
+        settings = parse_channel_settings(data, profile.channel_period)
+    except ValueError as e:
+        return 400, {"error": str(e)}
+    if settings.get("adaptive") and not profile.adaptive:
+        return 400, {"error": f"Adaptive TX needs a speed based profile, not {profile.name!r}"}
+    try:
+        shared_data.put_command(("CHANNEL_CONFIG", device_number, settings))
+    except queue.Full:
+        return 503, COMMAND_QUEUE_FULL_RESPONSE
+    if logger:
+        logger.info(f"Channel settings of sensor {device_number} queued: {settings}")
+    return 202, {"status": "accepted", "device_number": device_number, "settings": settings}
+
+
+def parse_batch(post_data, content_type=None, loads=json.loads):
+    """Decode batch body into ``(time, speed)`` pairs (s, mm/s) in body order.
+
+    Raises
+    ------
+    ValueError
+        If the body is malformed or holds more than ``MAX_BATCH_SAMPLES``.
+    """
+    media_type = (content_type or "application/json").split(";", 1)[0].strip().lower()
+    if media_type == "application/octet-stream":
+        if len(post_data) % BATCH_RECORD.size:
+            raise ValueError(f"Binary batch length must be a multiple of {BATCH_RECORD.size}")
+        samples = list(BATCH_RECORD.iter_unpack(post_data))
+    elif media_type == "text/csv":
+        samples = []
+        for line in post_data.decode("ascii").splitlines():
+            line = line.strip()
+            if not line or line[0].isalpha():
+                continue  # blank or header line
+            t, sep, speed = line.partition(",")
+            if not sep:
+                raise ValueError(f"Bad CSV line: {line!r}")
+            samples.append((float(t), float(speed)))
+    else:
+        data = loads(post_data)
+        if not isinstance(data, list):
+            raise ValueError("Batch must be a JSON list")
+        samples = []
+        for sample in data:
+            try:
+                t, speed = sample["time"], sample["speed"]
+            except (KeyError, TypeError):
+                raise ValueError(f"Sample without 'time' and 'speed': {sample}") from None
+            if not isinstance(t, (int, float)) or not isinstance(speed, (int, float)):
+                raise ValueError(f"Sample with non numeric 'time' or 'speed': {sample}")
+            samples.append((t, speed))
+    if len(samples) > MAX_BATCH_SAMPLES:
+        raise ValueError(f"Batch holds more than {MAX_BATCH_SAMPLES} samples")
+    if not all(math.isfinite(t) and math.isfinite(speed) for t, speed in samples):
+        raise ValueError("Batch holds non finite numbers")
+    return samples
+
+
+def handle_batch(shared_data, state, post_data, content_type=None, options=DEFAULT_POST_OPTIONS, logger=None):
+    """Apply a batch of timestamped samples to sensor ``state`` at once.
+
+    Sample times are read on the client clock; ``SpeedState.update_batch``
+    maps them to receive time. Samples already stored (resent after a failed
+    upload) are skipped, so overlapping batches are safe to retry.
+    """
+    parse_start = time.perf_counter()
+    try:
+        samples = parse_batch(post_data, content_type, options.loads)
+    except (ValueError, UnicodeDecodeError) as e:
+        return 400, {"error": str(e)}
+    POST_PARSE.observe(time.perf_counter() - parse_start)
+    if not samples:
+        return 200, {"status": "ok", "samples": 0, "skipped": 0}
+
+    samples.sort()
+    last_post_time = state.last_post_time
+    applied = state.update_batch([(3.6*speed/1000.0, t) for t, speed in samples], time.time())
+    if applied:
+        BATCH_SAMPLES.inc(applied)
+        wake_for_sample(shared_data, last_post_time)
+    if logger and logger.isEnabledFor(logging.DEBUG):
+        note = BATCH_LOG.allow()
+        if note is not None:
+            logger.debug(f"Batch of {len(samples)} samples, {applied} applied{note}")
+    return 200, {"status": "ok", "samples": applied, "skipped": len(samples) - applied}
+
+
+def is_finite_number(value):
+    """Return True if decoded JSON ``value`` is an int or float other than bool, NaN or infinity."""
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def apply_sample(state, data, logger=None):
+    """Apply speed of one decoded TPV sample to sensor ``state``.
+
+    Sensors of a profile sending more than speed also take ``cadence``,
+    ``power`` and ``heartrate`` of the sample (see ``apply_metrics``).
+
+    Returns
+    -------
+    bool
+        True if the sample carried a usable ``speed`` (mm/s).
+    """
+    try:
+        speed_rec = data['speed']
+    except (KeyError, TypeError):
+        speed_rec = None
+    if not is_finite_number(speed_rec):
+        if logger:
+            logger.warning(f"Sample without usable 'speed' field: {data}")
+        return False
+    if ANT_PROFILES[state.profile].metrics:
+        apply_metrics(state, data)
+    apply_speed(state, speed_rec, logger)
+    return True
+
+
+def apply_metrics(state, data):
+    """Store cadence [rpm], power [W] and heart rate [bpm] of sample ``data``.
+
+    Missing, non numeric or non finite fields are stored as None (sent as
+    invalid or 0).
+    Samples without any of them leave the previous values to expire after
+    ``METRICS_HOLD``.
+    """
+    values = {}
+    for field, name in METRIC_FIELDS.items():
+        value = data.get(field)
+        if is_finite_number(value):
+            values[name] = value
+    if values:
+        state.update_metrics(values.get("cadence"), values.get("power"),
+                             values.get("heart_rate"), time.time())
+
+
+def wake_for_sample(shared_data, last_post_time):
+    """Wake the main loop after a sample if it has to act on it.
+
+    The main loop starts ANT+ and re-arms its idle timers when a sensor
+    that had no samples for ``SAMPLE_IDLE_WAKEUP`` (or since ANT+ stopped,
+    ``last_post_time`` None) is fed again. While ANT+ runs, the samples of
+    active sensors are read by the TX callback and need no wakeup.
+
+    Parameters
+    ----------
+    shared_data : SharedData
+        Shared state of the main loop.
+    last_post_time : float or None
+        Time of the previous sample of the sensor, read before applying.
+    """
+    if (not shared_data.runningAnt or last_post_time is None
+            or time.time() - last_post_time > SAMPLE_IDLE_WAKEUP):
+        shared_data.wakeup.set()
+
+
+def apply_speed(state, speed_rec, logger=None):
+    """Store received speed ``speed_rec`` (mm/s) in sensor ``state``."""
+    speed_kmh = 3.6*speed_rec/1000.0
+    time_recv = time.time()
+    # update speed and last_post_time in one snapshot
+    state.update(speed_kmh, time_recv)
+
+    if logger and logger.isEnabledFor(logging.DEBUG):
+        note = SPEED_LOG.allow()
+        if note is not None:
+            logger.debug(f"Speed [Recv]:{speed_rec} Speed [km/h]: {speed_kmh:.1f}{note}")
+
+
+class StreamDecoder:
+    """Apply newline delimited JSON samples of one stream to a sensor.
+
+    Bytes are passed to ``feed()`` in arbitrary pieces (HTTP chunks,
+    WebSocket frames); every complete line is decoded and applied
+    immediately. A line may hold one sample object or a list of them.
+
+    Parameters
+    ----------
+    shared_data : SharedData
+        Shared state, its main loop is woken up by applied samples.
+    state : SpeedState
+        Sensor receiving the samples.
+    logger : logging.Logger or None
+        Logger for debug messages.
+    """
+
+    def __init__(self, shared_data, state, logger=None):
+        self.shared_data = shared_data
+        self.state = state
+        self.logger = logger
+        self.buffer = bytearray()
+        self.samples = 0
+        self.errors = 0
+
+    def feed(self, data):
+        """Add stream bytes, apply every completed line.
+
+        Raises
+        ------
+        ValueError
+            If an unterminated line exceeds ``MAX_STREAM_LINE``.
+        """
+        buffer = self.buffer
+        buffer += data
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end < 0:
+                break
+            self._apply_line(buffer[start:end])
+            start = end + 1
+        if start:
+            del buffer[:start]
+        if len(buffer) > MAX_STREAM_LINE:
+            raise ValueError("Stream line too long")
+
+    def close(self):
+        """Apply last line if the stream did not end with a newline."""
+        if self.buffer:
+            self._apply_line(self.buffer)
+            self.buffer.clear()
+
+    def _apply_line(self, line):
+        line = line.strip()
+        if not line:
+            return
+        try:
+            data = json.loads(line)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            self.errors += 1
+            return
+        samples = data if isinstance(data, list) else (data,)
+        applied = self.samples
+        last_post_time = self.state.last_post_time
+        for sample in samples:
+            if apply_sample(self.state, sample):
+                self.samples += 1
+            else:
+                self.errors += 1
+        if self.samples != applied:
+            STREAM_SAMPLES.inc(self.samples - applied)
+            wake_for_sample(self.shared_data, last_post_time)
+
+    def response(self):
+        """Summary sent when the stream ends."""
+        return {"message": "Stream received", "samples": self.samples, "errors": self.errors}
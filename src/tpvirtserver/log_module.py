@@ -0,0 +1,166 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import time
+
+# ======================================================
+# Logging pipeline
+# ======================================================
+# Threads that log (ANT+ TX callback, HTTP handlers, main loop) only put the
+# record on a ``queue.SimpleQueue``; one ``QueueListener`` thread formats it
+# and writes it out. A slow terminal, pipe or log collector never stalls TX
+# timing or a request. ``SimpleQueue.put`` is reentrant, so signal handlers
+# may log too.
+#
+# Messages logged per frame or per request are additionally limited at their
+# call site with a ``LogRateLimit``, checked after the level and before the
+# message is formatted:
+#
+#     if logger.isEnabledFor(logging.DEBUG):
+#         note = TX_LOG.allow()
+#         if note is not None:
+#             logger.debug(f"... {value}{note}")
+#
+# ``note`` tells how many messages were dropped since the previous one.
+
+LOG_FORMATS = ("text", "json")
+LOG_RATE = 5.0      # per call site [messages/s], 0 is unlimited
+LOG_BURST = 10      # messages let through at once before the rate applies
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+
+class LogRateLimit:
+    """Token bucket of one frequent log message.
+
+    Parameters
+    ----------
+    rate : float or None
+        Messages per second, None follows ``LogRateLimit.rate`` (set by
+        ``setup_logging``), 0 lets all messages through.
+    burst : int
+        Bucket size, messages let through at once.
+
+    Not locked: callers racing on one limiter may let a message more or
+    less through, which is fine for logging.
+    """
+
+    rate = LOG_RATE
+
+    def __init__(self, rate=None, burst=LOG_BURST):
+        self.own_rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.suppressed = 0
+
+    def allow(self):
+        """Take one message from the bucket.
+
+        Returns
+        -------
+        str or None
+            None if the message is to be dropped, else a note to append to
+            it: empty, or the number of messages dropped before it.
+        """
+        rate = LogRateLimit.rate if self.own_rate is None else self.own_rate
+        if rate > 0:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * rate)
+            self.last = now
+            if self.tokens < 1.0:
+                self.suppressed += 1
+                return None
+            self.tokens -= 1.0
+        if not self.suppressed:
+            return ""
+        suppressed, self.suppressed = self.suppressed, 0
+        return f" ({suppressed} similar suppressed)"
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """``QueueHandler`` leaving all formatting to the listener thread.
+
+    The stdlib handler formats the message (and traceback) in the logging
+    thread to make records picklable; the queue here stays in the process,
+    so the record is passed on as is. Arguments of ``%`` style messages must
+    not be modified after the call.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line.
+
+    Parameters
+    ----------
+    fields : dict or None
+        Constant fields added to every line (e.g. the worker process).
+    """
+
+    def __init__(self, fields=None):
+        super().__init__()
+        self.fields = fields or {}
+
+    def format(self, record):
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(self.fields)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level="INFO", log_format="text", rate=LOG_RATE, source=None):
+    """Route all logging of this process through a queue and a listener thread.
+
+    Parameters
+    ----------
+    level : str
+        Root logger level name.
+    log_format : str
+        ``text`` (one line per message) or ``json`` (JSON lines).
+    rate : float
+        Default of ``LogRateLimit`` [messages/s per call site], 0 disables
+        rate limiting.
+    source : str or None
+        Name of the logging process (e.g. ``worker0``), added to every line.
+
+    Returns
+    -------
+    logging.handlers.QueueListener
+        Started listener; stopped (queue flushed) at interpreter exit.
+    """
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"log_format must be one of {LOG_FORMATS}, got {log_format!r}")
+    if rate < 0:
+        raise ValueError(f"rate must not be negative, got {rate}")
+    LogRateLimit.rate = rate
+
+    output = logging.StreamHandler()
+    if log_format == "json":
+        output.setFormatter(JsonFormatter({"source": source} if source else None))
+    else:
+        output.setFormatter(logging.Formatter(
+            TEXT_FORMAT if source is None else f"%(asctime)s - %(levelname)s - {source} - %(message)s"))
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(records))
+    root.setLevel(getattr(logging, level))
+
+    listener = logging.handlers.QueueListener(records, output)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
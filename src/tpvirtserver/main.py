@@ -5,19 +5,137 @@ import signal
 import sys
 import time
 import os
+import queue
 
 from .__init__ import shared_data
-from .ant_module import AntBikeSpeed
-from .http_module import TPVHttpServer
+from .ant_module import AntBikeSpeed, AntChannelManager, Device_Number, ANT_MAX_CHANNELS, ANT_BACKENDS
+from .ant_module import Transmission_Type, parse_channel_period, parse_transmission_type, parse_profile
+from .page_module import ANT_PROFILES
+from .metrics_module import ANT_STARTS, ANT_STOPS, COMMAND_QUEUE_DEPTH
+from .ingest_module import PostOptions, ACK_MODES, POST_PARSERS, MAX_BODY_SIZE, RATE_LIMIT
+from .estimator_module import SPEED_ESTIMATORS
+from .session_module import SessionRegistry, SESSION_KEYS, SESSION_IDLE_TIMEOUT
+from .tls_module import TLS_PROFILES, CERT_WATCH_INTERVAL, CertificateWatch
+from .recorder_module import RECORDER
+from .store_module import RideStore, StoreReader, STORE_INTERVAL
+from .log_module import setup_logging, LogRateLimit, LOG_FORMATS, LOG_RATE
+from .datagram_module import create_datagram_listeners, parse_udp_address, DEFAULT_UDP_HOST
+
+SERVER_MODES = ("asyncio", "threaded")
+
+# Thresholds [s] measured from the last POST
+# (speed decay is computed at TX time, see estimator_module)
+ANT_START_WINDOW = 100      # ANT+ is (re)started only for posts younger than this
+ANT_STOP_AFTER = 300        # ANT+ channel closed (Node kept with --ant-standby)
+
+# main loop wakes up on every POST
+LOOP_LOG = LogRateLimit()
+
+def min_timeout(timeout, value):
+    """Return the sooner of two wait timeouts (``None`` means no timeout)."""
+    return value if timeout is None else min(timeout, value)
+
+def clear_speed(shared_data):
+    """Publish speed 0 without a sample for every sensor, ANT+ is stopped.
+
+    The next sample starts a new estimate; until then status, stored rides
+    and the first frames after a restart report 0.
+    """
+    for state in shared_data.all_sensors():
+        with state.lock:
+            state.BikeSpeed = 0.0
+            state.last_post_time = None
+
+def parse_device_numbers(value):
+    """Parse comma separated list of ANT+ device numbers."""
+    numbers = [int(n) for n in value.split(",") if n.strip()]
+    if not numbers:
+        raise ValueError("At least one device number is required")
+    for n in numbers:
+        if not 0 < n <= 0xFFFF:
+            raise ValueError(f"Device number {n} out of range 1..65535")
+    return numbers
+
+def parse_channel_periods(value):
+    """Parse comma separated list of channel periods (counts or 4hz/2hz/1hz).
+
+    Values are only validated here, rate names are resolved against the
+    profile of their channel by ``resolve_channel_periods``.
+    """
+    periods = [n.strip() for n in value.split(",") if n.strip()]
+    for n in periods:
+        parse_channel_period(n)
+    return periods
+
+def parse_profiles(value):
+    """Parse comma separated list of ANT+ profiles (keys of ``ANT_PROFILES``)."""
+    profiles = [parse_profile(n) for n in value.split(",") if n.strip()]
+    if not profiles:
+        raise ValueError("At least one profile is required")
+    return profiles
+
+def resolve_channel_periods(periods, profiles):
+    """Return channel periods [1/32768 s] of all channels.
+
+    ``periods`` None selects the period of each profile, rate names are
+    multiples of it.
+    """
+    if periods is None:
+        return [ANT_PROFILES[profile].channel_period for profile in profiles]
+    return [parse_channel_period(period, ANT_PROFILES[profile].channel_period)
+            for period, profile in zip(periods, profiles)]
+
+def parse_transmission_types(value):
+    """Parse comma separated list of ANT+ transmission types."""
+    return [parse_transmission_type(n) for n in value.split(",") if n.strip()]
+
+def per_channel(values, device_numbers, name):
+    """Expand ``values`` to one value per device number.
+
+    A single value applies to every channel, otherwise one value per device
+    number is required.
+    """
+    if len(values) == 1:
+        return values * len(device_numbers)
+    if len(values) != len(device_numbers):
+        raise ValueError(f"{name} needs one value or one per device number ({len(device_numbers)}), got {len(values)}")
+    return values
 
 def parse_args():
     # Konfiguracja parsera argumentów
     parser = argparse.ArgumentParser(description="TPVirt ANT+ Server")
     parser.add_argument("--log-level", type=str, choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], default="INFO", help="Log level (default: INFO)")
+    parser.add_argument("--log-format", type=str, choices=LOG_FORMATS, default="text", help="Log output: text lines or json (one JSON object per line) (default: text)")
+    parser.add_argument("--log-rate", type=float, default=LOG_RATE, help=f"Per frame and per request log messages let through per second and message, 0 logs all (default: {LOG_RATE:g})")
     parser.add_argument("--ip", type=str, default="0.0.0.0", help="https server listening address")
     parser.add_argument("--port", type=int, default=5000, help="https server listening port")
     parser.add_argument("--cert-file", type=str, default="cert.pem", help="Path to certyficate file")
     parser.add_argument("--key-file", type=str, default="key.pem",help="Path to key file associated with certyficate")
+    parser.add_argument("--use-ssl", action="store_true", help="Serve https using --cert-file and --key-file")
+    parser.add_argument("--tls-profile", type=str, choices=TLS_PROFILES, default="compat", help="TLS versions offered: compat (TLS 1.2 and 1.3) or modern (TLS 1.3 only) (default: compat)")
+    parser.add_argument("--cert-watch-interval", type=float, default=CERT_WATCH_INTERVAL, help=f"Seconds between checks of --cert-file/--key-file for changes, reloaded without restart; 0 reloads on SIGHUP only (default: {CERT_WATCH_INTERVAL:g})")
+    parser.add_argument("--server-mode", type=str, choices=SERVER_MODES, default="asyncio", help="HTTP ingest engine: asyncio (keep-alive, non-blocking TLS) or threaded (stdlib HTTPServer) (default: asyncio)")
+    parser.add_argument("--ack-mode", type=str, choices=ACK_MODES, default="full", help="POST response: full (echo received JSON), minimal (constant small body) or none (204) (default: full)")
+    parser.add_argument("--post-parser", type=str, choices=POST_PARSERS, default="json", help="POST body parser: json, orjson or fast (extract speed without full parse, needs --ack-mode minimal/none) (default: json)")
+    parser.add_argument("--max-body-size", type=int, default=MAX_BODY_SIZE, help=f"Maximum POST body size in bytes (default: {MAX_BODY_SIZE})")
+    parser.add_argument("--rate-limit", type=float, default=RATE_LIMIT, help=f"POST requests per second and client address, more are answered 429; 0 disables the limit (default: {RATE_LIMIT:g})")
+    parser.add_argument("--device-numbers", type=parse_device_numbers, default=[Device_Number], help=f"Comma separated ANT+ device numbers, one channel per number; POST /sensor/<number> selects a sensor, other paths feed the first one (default: {Device_Number})")
+    parser.add_argument("--max-channels", type=int, default=ANT_MAX_CHANNELS, help=f"Maximum number of channels opened on the ANT+ stick (default: {ANT_MAX_CHANNELS})")
+    parser.add_argument("--profiles", type=parse_profiles, default=["speed"], help=f"Comma separated ANT+ sensor profiles {', '.join(ANT_PROFILES)}, one for all channels or one per device number (default: speed)")
+    parser.add_argument("--channel-periods", type=parse_channel_periods, default=None, help="Comma separated channel periods in 1/32768 s or 4hz/2hz/1hz (rates of the profile period), one for all channels or one per device number (default: period of the profile)")
+    parser.add_argument("--transmission-types", type=parse_transmission_types, default=[Transmission_Type], help=f"Comma separated ANT+ transmission types, one for all channels or one per device number (default: {Transmission_Type})")
+    parser.add_argument("--adaptive-tx", action="store_true", help="Drop to 1 message/s while speed is constant or zero, back to the channel period when it changes")
+    parser.add_argument("--ant-standby", action="store_true", help="Keep the ANT+ Node and USB stick open while idle, only the channels are closed and reopened (fast resume)")
+    parser.add_argument("--ant-backend", type=str, choices=ANT_BACKENDS, default="usb", help="ANT+ backend: usb (openant and ANT USB stick) or sim (emulated node, no hardware) (default: usb)")
+    parser.add_argument("--speed-estimator", type=str, choices=SPEED_ESTIMATORS, default="linear", help="Speed estimate between POSTs: hold (last value), linear (trend of the last 3 s), ewma (smoothed) or kalman (default: linear)")
+    parser.add_argument("--session-key", type=str, choices=SESSION_KEYS, default="path", help="Client to sensor mapping: path (/sensor/<number>), address (one sensor per client IP) or token (one sensor per X-Session-Token header or ?session= parameter) (default: path)")
+    parser.add_argument("--session-idle-timeout", type=float, default=SESSION_IDLE_TIMEOUT, help=f"Seconds after which an idle address/token session releases its sensor (default: {SESSION_IDLE_TIMEOUT:g})")
+    parser.add_argument("--workers", type=int, default=0, help="Run HTTP ingest in this many worker processes (SO_REUSEPORT when more than one) sharing speed with the ANT+ process through shared memory; 0 runs everything in one process (default: 0)")
+    parser.add_argument("--record", type=str, default=None, help="Append received speed samples and ANT+ frames to this recording file (replay with python -m tpvirtserver.replay_module)")
+    parser.add_argument("--store", type=str, default=None, help="Keep per sensor speed, distance and wheel rotations in this memory-mapped time series file, queried with GET /rides/<device number>")
+    parser.add_argument("--store-interval", type=float, default=STORE_INTERVAL, help=f"Seconds between stored samples of a sensor (default: {STORE_INTERVAL:g})")
+    parser.add_argument("--udp", type=parse_udp_address, default=None, help=f"Also receive binary speed records on this UDP [host:]port (host default: {DEFAULT_UDP_HOST})")
+    parser.add_argument("--unix-socket", type=str, default=None, help="Also receive binary speed records on this AF_UNIX datagram socket path")
     parser.add_argument("--use-env", action="store_true", help="Force using environment variables instead of CLI arguments")
     
     args = parser.parse_args()
@@ -30,98 +148,281 @@ def get_config():
     use_env = getattr(args, "use_env", False) or len(os.sys.argv) == 1
     
     if use_env:
-        app_ip = os.getenv("APP_IP", "0.0.0.0")
-        app_port = int(os.getenv("APP_PORT", "5000"))
-        use_ssl = os.getenv("USE_SSL", "false").lower() in ("1", "true", "yes")
-        cert_file = os.getenv("CERT_FILE", "cert.pem")
-        key_file = os.getenv("KEY_FILE", "key.pem")
-        log_level = os.getenv("LOG_LEVEL", "INFO")
+        config = argparse.Namespace(
+            ip=os.getenv("APP_IP", "0.0.0.0"),
+            port=int(os.getenv("APP_PORT", "5000")),
+            use_ssl=os.getenv("USE_SSL", "false").lower() in ("1", "true", "yes"),
+            cert_file=os.getenv("CERT_FILE", "cert.pem"),
+            key_file=os.getenv("KEY_FILE", "key.pem"),
+            log_level=os.getenv("LOG_LEVEL", "INFO"),
+            log_format=os.getenv("LOG_FORMAT", "text").lower(),
+            log_rate=float(os.getenv("LOG_RATE", str(LOG_RATE))),
+            tls_profile=os.getenv("TLS_PROFILE", "compat").lower(),
+            cert_watch_interval=float(os.getenv("CERT_WATCH_INTERVAL", str(CERT_WATCH_INTERVAL))),
+            server_mode=os.getenv("SERVER_MODE", "asyncio").lower(),
+            ack_mode=os.getenv("ACK_MODE", "full").lower(),
+            post_parser=os.getenv("POST_PARSER", "json").lower(),
+            max_body_size=int(os.getenv("MAX_BODY_SIZE", str(MAX_BODY_SIZE))),
+            rate_limit=float(os.getenv("RATE_LIMIT", str(RATE_LIMIT))),
+            device_numbers=parse_device_numbers(os.getenv("DEVICE_NUMBERS", str(Device_Number))),
+            max_channels=int(os.getenv("MAX_CHANNELS", str(ANT_MAX_CHANNELS))),
+            profiles=parse_profiles(os.getenv("PROFILES", "speed")),
+            channel_periods=parse_channel_periods(os.environ["CHANNEL_PERIODS"]) if os.getenv("CHANNEL_PERIODS") else None,
+            transmission_types=parse_transmission_types(os.getenv("TRANSMISSION_TYPES", str(Transmission_Type))),
+            adaptive_tx=os.getenv("ADAPTIVE_TX", "false").lower() in ("1", "true", "yes"),
+            ant_backend=os.getenv("ANT_BACKEND", "usb").lower(),
+            ant_standby=os.getenv("ANT_STANDBY", "false").lower() in ("1", "true", "yes"),
+            speed_estimator=os.getenv("SPEED_ESTIMATOR", "linear").lower(),
+            session_key=os.getenv("SESSION_KEY", "path").lower(),
+            session_idle_timeout=float(os.getenv("SESSION_IDLE_TIMEOUT", str(SESSION_IDLE_TIMEOUT))),
+            workers=int(os.getenv("WORKERS", "0")),
+            record=os.getenv("RECORD") or None,
+            store=os.getenv("STORE") or None,
+            store_interval=float(os.getenv("STORE_INTERVAL", str(STORE_INTERVAL))),
+            udp=parse_udp_address(os.environ["UDP"]) if os.getenv("UDP") else None,
+            unix_socket=os.getenv("UNIX_SOCKET") or None,
+        )
+        if config.log_format not in LOG_FORMATS:
+            raise ValueError(f"LOG_FORMAT must be one of {LOG_FORMATS}, got {config.log_format!r}")
+        if config.server_mode not in SERVER_MODES:
+            raise ValueError(f"SERVER_MODE must be one of {SERVER_MODES}, got {config.server_mode!r}")
+        if config.tls_profile not in TLS_PROFILES:
+            raise ValueError(f"TLS_PROFILE must be one of {TLS_PROFILES}, got {config.tls_profile!r}")
+        if config.ant_backend not in ANT_BACKENDS:
+            raise ValueError(f"ANT_BACKEND must be one of {ANT_BACKENDS}, got {config.ant_backend!r}")
+        if config.speed_estimator not in SPEED_ESTIMATORS:
+            raise ValueError(f"SPEED_ESTIMATOR must be one of {SPEED_ESTIMATORS}, got {config.speed_estimator!r}")
+        if config.session_key not in SESSION_KEYS:
+            raise ValueError(f"SESSION_KEY must be one of {SESSION_KEYS}, got {config.session_key!r}")
+    else:
+        config = args
+
+    config.profiles = per_channel(config.profiles, config.device_numbers, "Profiles")
+    if config.channel_periods is not None:
+        config.channel_periods = per_channel(config.channel_periods, config.device_numbers, "Channel periods")
+    config.channel_periods = resolve_channel_periods(config.channel_periods, config.profiles)
+    config.transmission_types = per_channel(config.transmission_types, config.device_numbers, "Transmission types")
+    if config.workers > 1 and config.session_key != "path":
+        # every worker would hand out the same free sensors
+        raise ValueError("Session keys address/token need a single ingest process (workers <= 1)")
+    if config.workers > 0 and config.record:
+        # samples arrive in the worker processes
+        raise ValueError("Recording needs the single process mode (workers 0)")
+    return config
+
+def create_http_server(config, shared_data, logger, reuse_port=False):
+    """Create HTTP ingest server selected by ``config.server_mode``.
+
+    Only the selected engine is imported.
+    """
+    if config.server_mode == "threaded":
+        from .http_module import TPVHttpServer as server_class
     else:
-        app_ip = args.ip
-        app_port = args.port
-        use_ssl = args.use_ssl
-        cert_file = args.cert_file
-        key_file = args.key_file
-        log_level = args.log_level
+        from .aio_http_module import TPVAsyncHttpServer as server_class
+    post_options = PostOptions(config.ack_mode, config.post_parser, config.max_body_size, config.rate_limit)
+    return server_class(config.ip, config.port, config.use_ssl, config.cert_file, config.key_file, shared_data, logger, post_options, reuse_port, config.tls_profile)
 
-    return app_ip, app_port, use_ssl, cert_file, key_file, log_level
+def add_sensors(config, shared_data, table=None):
+    """Register the speed state of every configured device number in ``shared_data``.
+
+    With a shared memory ``table`` (multiprocess mode) sensors read their
+    speed from its slots, in device number order.
+    """
+    if table is not None:
+        from .shm_module import TableSpeedState
+    for slot, device_number in enumerate(config.device_numbers):
+        state = shared_data.add_sensor(device_number, TableSpeedState(table, slot, device_number) if table else None)
+        state.profile = config.profiles[slot]
+
+def create_ant_server(config, shared_data, logger):
+    """Create channel manager with one ``AntBikeSpeed`` per sensor registered by ``add_sensors``."""
+    # failures wake the main loop to reconnect
+    antServer = AntChannelManager(logger, config.max_channels, config.ant_backend, config.ant_standby,
+                                  lambda: shared_data.wakeup.set())
+    for slot, device_number in enumerate(config.device_numbers):
+        profile = config.profiles[slot]
+        state = shared_data.get_sensor(device_number)
+        antServer.add_sensor(AntBikeSpeed(
+            state, logger, device_number,
+            channel_period=config.channel_periods[slot],
+            backend=config.ant_backend,
+            transmission_type=config.transmission_types[slot],
+            # adaptive TX follows speed, not cadence, power or heart rate
+            adaptive=config.adaptive_tx and ANT_PROFILES[profile].adaptive,
+            profile=profile,
+        ))
+    return antServer
 
 def main():
-    app_ip, app_port, use_ssl, app_cert_file, app_key_file, app_log_level = get_config()
+    config = get_config()
 
-    # Konfiguracja logowania
-    logging.basicConfig(
-        level=getattr(logging, app_log_level),
-        format="%(asctime)s - %(levelname)s - %(message)s",
-    )
+    # Konfiguracja logowania, written by a listener thread
+    setup_logging(config.log_level, config.log_format, config.log_rate)
 
     logging.debug("Sturting up server ....")
     
     shared_data.BikeSpeed = 0 / 3.6  # m/s => 10km/h
+    shared_data.set_estimator(config.speed_estimator)
     
-    httpServer = TPVHttpServer(app_ip, app_port, use_ssl, app_cert_file, app_key_file, shared_data, logging.getLogger())
-    antServer = AntBikeSpeed(shared_data, logging.getLogger())
+    # bind the HTTP port first; ANT+ (openant, USB) is only set up on the first POST
+    table = None
+    store = None
+    # with --workers the first worker receives datagrams, it owns writable speed states
+    datagram_listeners = create_datagram_listeners(config, shared_data, logging.getLogger()) if config.workers == 0 else []
+    shared_data.store = StoreReader(config.store) if config.store else None
+    if config.workers > 0:
+        from .worker_module import IngestWorkers
+        httpServer = IngestWorkers(config, shared_data, logging.getLogger())
+        table = httpServer.table
+    else:
+        httpServer = create_http_server(config, shared_data, logging.getLogger())
+    # sensors and sessions are in place before the first request arrives
+    add_sensors(config, shared_data, table)
+    shared_data.sessions = SessionRegistry(shared_data, config.session_key, config.session_idle_timeout)
+    httpServer.start()
+    try:
+        antServer = create_ant_server(config, shared_data, logging.getLogger())
+        # GET /status, synchronous /diagnostic commands
+        shared_data.ant_status = antServer.status
+        if config.record:
+            RECORDER.open(config.record, {
+                "estimator": shared_data.estimator_name,
+                "sensors": {sensor.device_number: sensor.page_encoder.wheel_circumference_mm for sensor in antServer.sensors},
+                "profiles": {sensor.device_number: sensor.profile.name for sensor in antServer.sensors},
+            })
+            logging.info(f"Recording to {config.record}")
+        if config.store:
+            store = RideStore(config.store, antServer.sensors, logging.getLogger(), config.store_interval)
+            store.open()
+        for listener in datagram_listeners:
+            listener.start()
+    except Exception:
+        for listener in datagram_listeners:
+            listener.stop()
+        httpServer.stop()
+        RECORDER.close()
+        if table is not None:
+            table.close()
+        raise
+
+    COMMAND_QUEUE_DEPTH.set_function(shared_data.command_queue.qsize)
 
     shared_data.runningAnt = False
     shared_data.running = True
-    httpServer.start()
+    cert_watch = CertificateWatch(httpServer, config.cert_watch_interval) if config.use_ssl else None
 
     def shutdown(signum, frame):
         #nonlocal shared_data
         logging.info(f"Signal recieved {signum}, closing app...")
         shared_data.running = False
+        shared_data.wakeup.set()
+
+    def reload_certificates(signum, frame):
+        if cert_watch is not None:
+            cert_watch.request()
+            shared_data.wakeup.set()
 
     # Rejestracja obsługi sygnałów
     signal.signal(signal.SIGTERM, shutdown)
     signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGHUP, reload_certificates)
     
+    def run_command(command):
+        if isinstance(command, tuple) and command[0] == "CHANNEL_CONFIG":
+            _, device_number, settings = command
+            logging.info(f"Configuring channel of sensor {device_number}: {settings}")
+            try:
+                antServer.configure_sensor(device_number, **settings)
+            except ValueError as e:
+                logging.warning(f"Channel configuration rejected: {e}")
+            return
+        # (command, PendingCommand) from a request waiting for completion
+        command, pending = command if isinstance(command, tuple) else (command, None)
+        if command == "ANT_START":
+            if not antServer.isRunning():
+                logging.info("Starting ANT+ server...")
+                ANT_STARTS.inc()
+                antServer.start()
+        elif command == "ANT_STOP":
+            clear_speed(shared_data)
+            if antServer.isRunning():
+                logging.info("Stopping ANT+ server...")
+                ANT_STOPS.inc()
+                antServer.stop()
+        if pending is not None:
+            pending.complete(antServer.isRunning())
+
     try:
         while shared_data.running:
-            # conditions to reduce speed and stop channel if no data received from client, optionally release ant device while no data arriver for long time
-            if hasattr(shared_data, "last_post_time") and shared_data.last_post_time is not None:
-                now = time.time()
-                elapsed = now - shared_data.last_post_time
+            # clear before reading state, so wakeups arriving while we work are not lost
+            shared_data.wakeup.clear()
 
-                # if last data post was within 100s and ant channel is not running, start it
-                if elapsed < 100:
-                    with shared_data.lock:
-                        if not antServer.isRunning():
-                            shared_data.command_queue.put("ANT_START")
-
-                # every 10s halve speed until 30s
-                if elapsed > 3 and elapsed <= 30:
-                    with shared_data.lock:
-                        shared_data.BikeSpeed *= 0.5
-                # after 30s set speed to 0
-                elif elapsed > 30 and elapsed <= 300:
-                    with shared_data.lock:
-                        shared_data.BikeSpeed = 0.0
-                # after 5 min (300s) set channel closed flag
-                elif elapsed > 300:
-                    with shared_data.lock:
-                        shared_data.command_queue.put("ANT_STOP")
-                
             # conditions controling ant start / stop on commands from queue
-            if shared_data.command_queue.qsize() > 0:
-                command = shared_data.command_queue.get()
-                if command == "ANT_START":
+            while True:
+                try:
+                    command = shared_data.command_queue.get_nowait()
+                except queue.Empty:
+                    break
+                run_command(command)
+
+            # release sensors of idle client sessions
+            timeout = shared_data.sessions.expire()
+
+            # certificate rotation, on SIGHUP or when the files change
+            if cert_watch is not None:
+                next_check = cert_watch.poll()
+                if next_check is not None:
+                    timeout = min_timeout(timeout, next_check)
+
+            # failed Node (USB error, thread exit, TX stall) is reconnected by ANT_START below
+            next_check = antServer.supervise()
+            if next_check is not None:
+                timeout = min_timeout(timeout, next_check)
+
+            # conditions to stop channel if no data received from client, optionally release ant device while no data arriver for long time
+            newest = None
+            now = time.time()
+            for state in shared_data.all_sensors():
+                if state.last_post_time is None:
+                    continue
+                elapsed = now - state.last_post_time
+                newest = elapsed if newest is None else min(newest, elapsed)
+
+            if newest is not None:
+                # if last data post was within 100s and ant channel is not running, start it
+                if newest < ANT_START_WINDOW and not antServer.isRunning():
+                    run_command("ANT_START")
                     if not antServer.isRunning():
-                        logging.info("Starting ANT+ server...")
-                        antServer.start()
-                elif command == "ANT_STOP":
-                    if antServer.isRunning():
-                        logging.info("Stopping ANT+ server...")
-                        shared_data.last_post_time = None
-                        antServer.stop()
-            
-            logging.debug(f"Main loop running... BikeSpeed: {shared_data.BikeSpeed:.2f} [m/s]")
-            time.sleep(0.25)
+                        # failed start or reconnect backoff
+                        timeout = min_timeout(timeout, antServer.retry_delay())
+
+                # after 5 min (300s) without any post close channels
+                if newest > ANT_STOP_AFTER:
+                    run_command("ANT_STOP")
+                else:
+                    timeout = min_timeout(timeout, ANT_STOP_AFTER - newest)
+
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                note = LOOP_LOG.allow()
+                if note is not None:
+                    logging.debug(f"Main loop running... BikeSpeed: {shared_data.speed_at(now):.2f} [km/h] next wakeup: {timeout}{note}")
+            # POSTs of active sensors do not wake the loop while ANT+ runs
+            shared_data.runningAnt = antServer.isRunning()
+            # sleep until a command or POST arrives or the next threshold passes
+            shared_data.wakeup.wait(timeout)
     except KeyboardInterrupt:
         shared_data.running = False
         logging.info("Keyboard interrupt received, closing app...")
     finally:
+        for listener in datagram_listeners:
+            listener.stop()
         httpServer.stop()
-        antServer.stop()
+        antServer.close()
+        RECORDER.close()
+        if store is not None:
+            store.close()
+        if table is not None:
+            table.close()
 
 if __name__ == "__main__":
     main()
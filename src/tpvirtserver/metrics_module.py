@@ -0,0 +1,200 @@
+import bisect
+import threading
+
+# ======================================================
+# Prometheus style metrics
+# ======================================================
+# Minimal, dependency free instruments rendered in the Prometheus text
+# exposition format on ``GET /metrics``. Hot paths keep a reference to an
+# instrument (or to a labelled child returned by ``labels()`` once at setup)
+# and only do attribute arithmetic per event, no dict lookups.
+#
+# Updates are not locked: under the GIL a concurrent increment can rarely be
+# lost, which is acceptable for monitoring and keeps the cost per event low.
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+JITTER_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25)
+STARTUP_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name, documentation, labelnames=(), labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.label_values = labels
+        self.children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels):
+        """Return child instrument bound to ``labels``; call once at setup, keep the result."""
+        key = tuple((name, str(labels[name])) for name in self.labelnames)
+        with self._lock:
+            child = self.children.get(key)
+            if child is None:
+                child = self._make_child(key)
+                self.children[key] = child
+        return child
+
+    def _instances(self):
+        if self.labelnames:
+            return list(self.children.values())
+        return [self]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for instance in self._instances():
+            lines.extend(instance._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic counter."""
+
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=(), labels=()):
+        super().__init__(name, documentation, labelnames, labels)
+        self.value = 0
+
+    def _make_child(self, key):
+        return Counter(self.name, self.documentation, (), key)
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(self.label_values)} {_format_value(self.value)}"]
+
+
+class Gauge(_Metric):
+    """Current value, either set explicitly or read from ``function`` at scrape time."""
+
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), labels=(), function=None):
+        super().__init__(name, documentation, labelnames, labels)
+        self.value = 0
+        self.function = function
+
+    def _make_child(self, key):
+        return Gauge(self.name, self.documentation, (), key)
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def _samples(self):
+        value = self.function() if self.function is not None else self.value
+        return [f"{self.name}{_format_labels(self.label_values)} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    """Histogram with fixed upper bounds ``buckets`` (seconds for latencies)."""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames, labels)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def _make_child(self, key):
+        return Histogram(self.name, self.documentation, (), key, self.buckets)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def _samples(self):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            labels = self.label_values + (("le", _format_value(float(bound))),)
+            lines.append(f"{self.name}_bucket{_format_labels(labels)} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(self.label_values)} {_format_value(self.sum)}")
+        lines.append(f"{self.name}_count{_format_labels(self.label_values)} {self.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of instruments rendered together."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self.register(Gauge(name, documentation, labelnames, function=function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets=buckets))
+
+    def render(self):
+        """Return all metrics in Prometheus text format (bytes)."""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+REGISTRY = MetricsRegistry()
+
+# HTTP ingest
+POST_REQUESTS = REGISTRY.counter("tpv_post_requests_total", "Speed POST requests received")
+POST_REJECTED = REGISTRY.counter("tpv_post_rejected_total", "Speed POST requests answered with an error status")
+POST_DURATION = REGISTRY.histogram("tpv_post_duration_seconds", "Time from POST request line to response written")
+RATE_LIMITED = REGISTRY.counter("tpv_rate_limited_total", "POST requests rejected with 429 by the per client rate limit")
+POST_PARSE = REGISTRY.histogram("tpv_post_parse_seconds", "Time spent parsing POST body")
+STREAM_SAMPLES = REGISTRY.counter("tpv_stream_samples_total", "Samples applied from streaming ingest")
+BATCH_SAMPLES = REGISTRY.counter("tpv_batch_samples_total", "Samples applied from batch ingest")
+DATAGRAM_SAMPLES = REGISTRY.counter("tpv_datagram_samples_total", "Samples applied from UDP and Unix datagram ingest")
+DATAGRAM_DROPPED = REGISTRY.counter("tpv_datagram_dropped_total", "Datagrams dropped: wrong size or version, unknown sensor or out of order")
+TLS_HANDSHAKES = REGISTRY.gauge("tpv_tls_handshakes", "Completed TLS server handshakes")
+TLS_RESUMED = REGISTRY.gauge("tpv_tls_resumed_handshakes", "TLS handshakes resumed from a session (cache or ticket)")
+TLS_CERT_RELOADS = REGISTRY.counter("tpv_tls_cert_reloads_total", "Certificates reloaded without restart")
+
+# shared state
+STATE_LOCK_WAIT = REGISTRY.histogram("tpv_state_lock_wait_seconds", "Wait time of contended speed state lock acquisitions")
+COMMAND_QUEUE_DEPTH = REGISTRY.gauge("tpv_command_queue_depth", "Commands waiting for the main loop")
+COMMANDS_COALESCED = REGISTRY.counter("tpv_commands_coalesced_total", "Commands merged into an equal command still waiting")
+COMMANDS_REJECTED = REGISTRY.counter("tpv_commands_rejected_total", "Commands rejected because the command queue was full")
+SESSIONS_ACTIVE = REGISTRY.gauge("tpv_sessions_active", "Client sessions bound to a sensor")
+SESSIONS_EVICTED = REGISTRY.counter("tpv_sessions_evicted_total", "Idle client sessions evicted")
+
+# ANT+
+ANT_TX_FRAMES = REGISTRY.counter("tpv_ant_tx_frames_total", "ANT+ frames broadcast", ("device",))
+ANT_TX_DURATION = REGISTRY.histogram("tpv_ant_tx_duration_seconds", "Duration of ANT+ TX callback", ("device",))
+ANT_TX_JITTER = REGISTRY.histogram("tpv_ant_tx_jitter_seconds", "Deviation of TX callback interval from channel period", ("device",), JITTER_BUCKETS)
+ANT_TX_LATE = REGISTRY.counter("tpv_ant_tx_late_total", "ANT+ TX callbacks late by more than a quarter channel period", ("device",))
+ANT_TX_MISSED = REGISTRY.counter("tpv_ant_tx_missed_total", "ANT+ TX events without a callback (payload sent again unchanged)", ("device",))
+ANT_STARTS = REGISTRY.counter("tpv_ant_starts_total", "ANT+ starts issued by the main loop")
+ANT_STOPS = REGISTRY.counter("tpv_ant_stops_total", "ANT+ stops issued by the main loop")
+ANT_FAILURES = REGISTRY.counter("tpv_ant_failures_total", "ANT+ Node failures (USB transfer error, Node thread exit, TX stall), each followed by a reconnect")
+ANT_FIRST_FRAME = REGISTRY.histogram("tpv_ant_first_frame_seconds", "Time from ANT+ start to the first TX frame of a channel; cold: new Node, warm: channel reopened on a standby Node", ("start",), STARTUP_BUCKETS)
@@ -0,0 +1,385 @@
+from abc import ABC, abstractmethod
+from collections import namedtuple
+
+##########################################################################
+# Ant+ data page encoders
+###########################################################################
+# Integer only encoders of the ANT+ sensor profiles. All of them share one
+# table driven ``PageEncoder``: everything that does not depend on the live
+# values (page numbers, toggle bit, background and common pages) is
+# precomputed once per sensor as a schedule of fixed leading bytes per frame,
+# and the profile only writes its data bytes into one preallocated payload.
+# Wheel revolutions, crank revolutions and heart beats are all "events with
+# an event time", counted by the same ``EventAccumulator``.
+
+KMH_TO_MM_S = 1000000.0 / 3600.0   # km/h -> mm/s
+ANT_CLOCK = 32768                   # channel period unit [1/s]
+EVENT_TIME_SHIFT = 5                # 1/32768 s -> 1/1024 s (event time unit)
+SPEED_PAGE_CYCLE = 69               # frames in one page schedule cycle
+POWER_PAGE_CYCLE = 121              # common pages 80 and 81 once per cycle each
+DEFAULT_WHEEL_CIRCUMFERENCE_MM = 2105
+PER_MINUTE = 60 * ANT_CLOCK         # one event of a per minute rate (rpm, bpm) in rate * 1/32768 s
+
+
+def build_speed_page_schedule(manufacturer_id=1, serial_number=0xFFFF, hw_revision=1, sw_revision=1, model_number=1,
+                              cycle=SPEED_PAGE_CYCLE):
+    """Precompute bytes 0..3 of every frame in one page cycle.
+
+    Frames 1-2 of the cycle carry background page 2 (manufacturer ID), frames
+    3-4 background page 3 (product information), the rest page 0. The page
+    toggle bit (0x80) flips every 4 frames. Bike speed and heart rate share
+    this layout.
+
+    Returns
+    -------
+    tuple
+        ``cycle`` tuples of 4 ints.
+    """
+    schedule = []
+    for count in range(1, cycle + 1):
+        if count <= 2:
+            # DataPage 02 (Manufacturer ID, upper 16 bits of serial number)
+            header = [0x02, manufacturer_id, serial_number & 0xFF, (serial_number >> 8) & 0xFF]
+        elif count <= 4:
+            # DataPage 03 (HW revision, SW revision, model number)
+            header = [0x03, hw_revision, sw_revision, model_number]
+        else:
+            # Data Page 0 (Standard Data), no technical data
+            header = [0x00, 0xFF, 0xFF, 0xFF]
+        # Page toogle bit
+        if (count >> 2) & 0x01:
+            header[0] |= 0x80
+        schedule.append(tuple(header))
+    return tuple(schedule)
+
+
+def build_power_page_schedule(manufacturer_id=1, serial_number=0xFFFFFFFF, hw_revision=1, sw_revision=1, model_number=1):
+    """Precompute the fixed bytes of every frame in one bike power page cycle.
+
+    Frame 61 of the cycle is common page 80 (manufacturer information),
+    frame 121 common page 81 (product information), both complete 8-byte
+    frames. All other frames carry power-only page 0x10, of which only the
+    page number is fixed.
+
+    Returns
+    -------
+    tuple
+        ``POWER_PAGE_CYCLE`` tuples of 1 or 8 ints.
+    """
+    schedule = []
+    for count in range(1, POWER_PAGE_CYCLE + 1):
+        if count == 61:
+            schedule.append((0x50, 0xFF, 0xFF, hw_revision, manufacturer_id & 0xFF, (manufacturer_id >> 8) & 0xFF,
+                             model_number & 0xFF, (model_number >> 8) & 0xFF))
+        elif count == POWER_PAGE_CYCLE:
+            schedule.append((0x51, 0xFF, 0xFF, sw_revision, serial_number & 0xFF, (serial_number >> 8) & 0xFF,
+                             (serial_number >> 16) & 0xFF, (serial_number >> 24) & 0xFF))
+        else:
+            schedule.append((0x10,))
+    return tuple(schedule)
+
+
+class EventAccumulator:
+    """Integer fixed-point counter of periodic events and their event time.
+
+    A rate (mm/s of wheel distance, rpm, bpm) is integrated over time in
+    1/32768 s; every ``unit`` of it is one event. The event time is the time
+    of the last full event, as the ANT+ profiles require, so a receiver
+    computes the exact rate from two frames.
+
+    Parameters
+    ----------
+    unit : int
+        One event in rate * 1/32768 s (``ANT_CLOCK * wheel_circumference_mm``
+        for wheel revolutions, ``PER_MINUTE`` for rpm and bpm).
+    offset : int
+        Payload byte of the event time; the event count follows it, 2
+        bytes (``mask`` 0xFFFF) or 1 byte (0xFF, heart beats).
+    mask : int
+        Wrap of the event count sent.
+    """
+
+    __slots__ = ("unit", "offset", "mask", "progress", "last_rate", "event_time", "count", "total")
+
+    def __init__(self, unit, offset, mask=0xFFFF):
+        self.unit = unit
+        self.offset = offset
+        self.mask = mask
+        self.reset()
+
+    def reset(self):
+        # progress into the current event, always < unit
+        self.progress = 0
+        self.last_rate = 0
+        self.event_time = 0
+        self.count = 0
+        # not wrapped, for statistics only
+        self.total = 0
+
+    def advance(self, payload, rate, elapsed_ticks, time_ticks):
+        """Integrate ``rate`` over ``elapsed_ticks`` ending at ``time_ticks``.
+
+        Event time and count in ``payload`` are rewritten only when at least
+        one event completed, between events they repeat the last one.
+        """
+        avg_rate = (rate + self.last_rate) >> 1
+        self.last_rate = rate
+        # all values stay below 2**30, so CPython keeps them single digit ints
+        progress = self.progress + avg_rate * elapsed_ticks
+        unit = self.unit
+        if progress < unit:
+            self.progress = progress
+            return
+        full = progress // unit
+        progress -= full * unit
+        self.progress = progress
+        # time of last full event = now - remaining progress / rate
+        since = progress // avg_rate
+        if since > elapsed_ticks:
+            since = elapsed_ticks
+        event_time = ((time_ticks - since) >> EVENT_TIME_SHIFT) & 0xFFFF
+        count = (self.count + full) & self.mask
+        self.event_time = event_time
+        self.count = count
+        self.total += full
+        offset = self.offset
+        payload[offset] = event_time & 0xFF
+        payload[offset + 1] = event_time >> 8
+        payload[offset + 2] = count & 0xFF
+        if self.mask == 0xFFFF:
+            payload[offset + 3] = count >> 8
+
+
+class PageEncoder(ABC):
+    """Table driven, allocation free ANT+ page generator.
+
+    ``encode()`` advances the event time clock, copies the fixed bytes of
+    the next ``schedule`` entry to the start of ``payload`` and lets the
+    profile (``_encode_data()``) write its data bytes. Entries of 8 bytes
+    are complete frames (common pages), no data is written into them.
+
+    Parameters
+    ----------
+    channel_period : int
+        Channel period in 1/32768 s units.
+    schedule : tuple
+        Fixed leading bytes of every frame in one page cycle.
+
+    Attributes
+    ----------
+    total_revolutions : int
+        Wheel revolutions since start, 0 for profiles without a wheel.
+    last_speed : int
+        Speed [mm/s] of the last frame, 0 for profiles without speed.
+    """
+
+    __slots__ = ("channel_period", "schedule", "cycle", "payload", "slot", "time_ticks", "_time_wrap")
+
+    total_revolutions = 0
+    last_speed = 0
+    wheel_circumference_mm = DEFAULT_WHEEL_CIRCUMFERENCE_MM
+
+    def __init__(self, channel_period, schedule):
+        self.channel_period = channel_period
+        self.schedule = schedule
+        self.cycle = len(schedule)
+        # payload is a list, openant prepends the channel number with ``[channel] + data``
+        self.payload = [0, 0, 0, 0, 0, 0, 0, 0]
+        # event time accumulator wraps here, only its low 16 bits are sent
+        self._time_wrap = 0x10000 << EVENT_TIME_SHIFT
+        self.reset()
+
+    def reset(self):
+        """Reset counters, next frame starts a new page cycle."""
+        self.slot = 0
+        self.time_ticks = 0
+        self.payload[0:8] = (0, 0, 0, 0, 0, 0, 0, 0)
+
+    def encode(self, speed_mm_s, elapsed_ticks=None, cadence=0, power=0, heart_rate=0):
+        """Encode next frame.
+
+        Parameters
+        ----------
+        speed_mm_s : int
+            Current speed in mm/s.
+        elapsed_ticks : int or None
+            Time since the previous frame in 1/32768 s, one channel period
+            when None.
+        cadence, power, heart_rate : int
+            Current cadence [rpm], power [W] and heart rate [bpm], used by
+            the profiles sending them.
+
+        Returns
+        -------
+        list
+            The preallocated 8-byte payload, overwritten on the next call.
+        """
+        if elapsed_ticks is None:
+            elapsed_ticks = self.channel_period
+        time_ticks = self.time_ticks + elapsed_ticks
+        if time_ticks >= self._time_wrap:
+            time_ticks -= self._time_wrap
+        self.time_ticks = time_ticks
+
+        payload = self.payload
+        slot = self.slot
+        fixed = self.schedule[slot]
+        slot += 1
+        self.slot = 0 if slot == self.cycle else slot
+        self._encode_data(payload, fixed, speed_mm_s, elapsed_ticks, time_ticks, cadence, power, heart_rate)
+        payload[0:len(fixed)] = fixed
+        return payload
+
+    @abstractmethod
+    def _encode_data(self, payload, fixed, speed_mm_s, elapsed_ticks, time_ticks, cadence, power, heart_rate):
+        """Write the profile data bytes of the frame starting with ``fixed`` into ``payload``."""
+
+
+class SpeedPageEncoder(PageEncoder):
+    """ANT+ bike speed pages (device type 123).
+
+    Rotations and event time are kept as integer fixed-point accumulators:
+
+    - event time is counted in channel period units (1/32768 s) and sent in
+      1/1024 s units,
+    - distance is counted in mm * 1/32768 s, one wheel revolution is
+      ``32768 * wheel_circumference_mm`` of it.
+
+    Parameters
+    ----------
+    channel_period : int
+        Channel period in 1/32768 s units.
+    wheel_circumference_mm : int
+        Wheel circumference in millimeters.
+    schedule : tuple or None
+        Page schedule, ``build_speed_page_schedule()`` when None.
+    """
+
+    __slots__ = ("wheel_circumference_mm", "wheel")
+
+    def __init__(self, channel_period, wheel_circumference_mm=DEFAULT_WHEEL_CIRCUMFERENCE_MM, schedule=None):
+        self.wheel_circumference_mm = wheel_circumference_mm
+        self.wheel = EventAccumulator(ANT_CLOCK * wheel_circumference_mm, 4)
+        super().__init__(channel_period, build_speed_page_schedule() if schedule is None else schedule)
+
+    def reset(self):
+        super().reset()
+        self.wheel.reset()
+
+    @property
+    def total_revolutions(self):
+        return self.wheel.total
+
+    @property
+    def last_speed(self):
+        return self.wheel.last_rate
+
+    def _encode_data(self, payload, fixed, speed_mm_s, elapsed_ticks, time_ticks, cadence, power, heart_rate):
+        # bytes 4..7 change only on a new revolution
+        self.wheel.advance(payload, speed_mm_s if speed_mm_s > 0 else 0, elapsed_ticks, time_ticks)
+
+
+class SpeedCadencePageEncoder(SpeedPageEncoder):
+    """ANT+ combined bike speed and cadence page (device type 121).
+
+    The profile has a single data page without page number: crank event
+    time and revolutions in bytes 0..3, wheel event time and revolutions in
+    bytes 4..7.
+    """
+
+    __slots__ = ("crank",)
+
+    def __init__(self, channel_period, wheel_circumference_mm=DEFAULT_WHEEL_CIRCUMFERENCE_MM):
+        self.crank = EventAccumulator(PER_MINUTE, 0)
+        # no page numbers, no background pages
+        super().__init__(channel_period, wheel_circumference_mm, ((),))
+
+    def reset(self):
+        super().reset()
+        self.crank.reset()
+
+    def _encode_data(self, payload, fixed, speed_mm_s, elapsed_ticks, time_ticks, cadence, power, heart_rate):
+        super()._encode_data(payload, fixed, speed_mm_s, elapsed_ticks, time_ticks, cadence, power, heart_rate)
+        self.crank.advance(payload, cadence if cadence > 0 else 0, elapsed_ticks, time_ticks)
+
+
+class PowerPageEncoder(PageEncoder):
+    """ANT+ bike power pages (device type 11), power-only page 0x10.
+
+    Every data frame is a new power event: the update event count and the
+    accumulated power advance, instantaneous power and cadence are sent as
+    received. Common pages 80 and 81 are interleaved once per cycle.
+    """
+
+    __slots__ = ("events", "accumulated_power")
+
+    def __init__(self, channel_period, wheel_circumference_mm=DEFAULT_WHEEL_CIRCUMFERENCE_MM):
+        super().__init__(channel_period, build_power_page_schedule())
+
+    def reset(self):
+        super().reset()
+        self.events = 0
+        self.accumulated_power = 0
+
+    def _encode_data(self, payload, fixed, speed_mm_s, elapsed_ticks, time_ticks, cadence, power, heart_rate):
+        if len(fixed) == 8:
+            return
+        if power < 0:
+            power = 0
+        elif power > 0xFFFF:
+            power = 0xFFFF
+        events = (self.events + 1) & 0xFF
+        accumulated_power = (self.accumulated_power + power) & 0xFFFF
+        self.events = events
+        self.accumulated_power = accumulated_power
+        payload[1] = events
+        # pedal power balance not used
+        payload[2] = 0xFF
+        # 0xFF: cadence invalid
+        payload[3] = cadence if 0 <= cadence < 0xFF else 0xFF
+        payload[4] = accumulated_power & 0xFF
+        payload[5] = accumulated_power >> 8
+        payload[6] = power & 0xFF
+        payload[7] = power >> 8
+
+
+class HeartRatePageEncoder(PageEncoder):
+    """ANT+ heart rate pages (device type 120).
+
+    Same page schedule as bike speed; bytes 4..7 carry heart beat event
+    time, heart beat count and the computed heart rate.
+    """
+
+    __slots__ = ("beats",)
+
+    def __init__(self, channel_period, wheel_circumference_mm=DEFAULT_WHEEL_CIRCUMFERENCE_MM):
+        self.beats = EventAccumulator(PER_MINUTE, 4, 0xFF)
+        super().__init__(channel_period, build_speed_page_schedule())
+
+    def reset(self):
+        super().reset()
+        self.beats.reset()
+
+    def _encode_data(self, payload, fixed, speed_mm_s, elapsed_ticks, time_ticks, cadence, power, heart_rate):
+        if heart_rate < 0:
+            heart_rate = 0
+        elif heart_rate > 0xFF:
+            heart_rate = 0xFF
+        self.beats.advance(payload, heart_rate, elapsed_ticks, time_ticks)
+        # 0: heart rate invalid
+        payload[7] = heart_rate
+
+
+# ANT+ device profiles a sensor can broadcast
+#   device_type     ANT+ device type of the channel ID
+#   channel_period  profile message period [1/32768 s] (about 4 Hz)
+#   encoder         PageEncoder class, called as encoder(channel_period, wheel_circumference_mm)
+#   metrics         POST fields besides speed the profile sends
+#   adaptive        speed based, supports the adaptive TX rate
+AntProfile = namedtuple("AntProfile", "name device_type channel_period encoder metrics adaptive")
+ANT_PROFILES = {
+    "speed": AntProfile("speed", 123, 8118, SpeedPageEncoder, (), True),
+    "speed_cadence": AntProfile("speed_cadence", 121, 8086, SpeedCadencePageEncoder, ("cadence",), True),
+    "power": AntProfile("power", 11, 8182, PowerPageEncoder, ("power", "cadence"), False),
+    "heart_rate": AntProfile("heart_rate", 120, 8070, HeartRatePageEncoder, ("heart_rate",), False),
+}
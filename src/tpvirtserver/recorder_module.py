@@ -0,0 +1,173 @@
+import json
+import math
+import struct
+import threading
+import time
+
+# ======================================================
+# Session recording
+# ======================================================
+# Append-only binary log of everything that determines the ANT+ output:
+# speed samples as stored by ``SpeedState.update()``, direct state changes
+# (stop, session eviction) and every TX frame with the inputs it was
+# computed from. ``replay_module`` reads it back to check frames bit for
+# bit and to replay real rides against a running server.
+#
+# File layout (little endian)::
+#
+#   MAGIC
+#   SEGMENT  kind u8, JSON length u32, JSON metadata   (one per process start)
+#   SAMPLE   kind u8, t i64, device u16, sequence u64, speed f64 [km/h], time f64
+#   STATE    kind u8, t i64, device u16, sequence u64, speed f64, rate f64, last POST time f64 (NaN = None)
+#   FRAME    kind u8, t i64, device u16, sequence u64, TX time f64, elapsed ticks u32, payload 8 bytes
+#
+# ``t`` is ``time.monotonic_ns()`` since the start of the segment,
+# ``sequence`` the snapshot sequence published (SAMPLE, STATE) or read by
+# the TX callback (FRAME), times are ``time.time()`` as seen by the server.
+
+MAGIC = b"TPVREC1\n"
+KIND_SEGMENT = 0
+KIND_SAMPLE = 1
+KIND_STATE = 2
+KIND_FRAME = 3
+SEGMENT = struct.Struct("<BI")
+SAMPLE = struct.Struct("<BqHQdd")
+STATE = struct.Struct("<BqHQddd")
+FRAME = struct.Struct("<BqHQdI8s")
+RECORDS = {KIND_SAMPLE: SAMPLE, KIND_STATE: STATE, KIND_FRAME: FRAME}
+RECORD_BUFFER_SIZE = 64 * 1024
+
+
+class Recorder:
+    """Writer of a recording; disabled until ``open()``.
+
+    Hot paths check ``enabled`` before calling a record method, so a
+    disabled recorder costs one attribute lookup. Records are packed and
+    appended to a buffered file under one lock (HTTP threads and the TX
+    thread write concurrently).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.file = None
+        self.path = None
+        self.start_ns = 0
+        self.records = 0
+        self.lock = threading.Lock()
+
+    def open(self, path, metadata):
+        """Start recording to ``path``; an existing recording gets a new segment appended.
+
+        Parameters
+        ----------
+        path : str
+            Recording file.
+        metadata : dict
+            JSON serializable description of the recorded server (estimator,
+            sensors), stored in the segment header.
+        """
+        with self.lock:
+            if self.file is not None:
+                raise RuntimeError(f"Already recording to {self.path}")
+            file = open(path, "ab", buffering=RECORD_BUFFER_SIZE)
+            if file.tell() == 0:
+                file.write(MAGIC)
+            else:
+                # drop a record cut off by a killed recorder before appending
+                with open(path, "rb") as existing:
+                    data = existing.read()
+                end = len(MAGIC)
+                for _, end in _scan(data, path):
+                    pass
+                if end < len(data):
+                    file.truncate(end)
+            header = json.dumps(dict(metadata, start_time=time.time())).encode("utf-8")
+            file.write(SEGMENT.pack(KIND_SEGMENT, len(header)))
+            file.write(header)
+            self.file = file
+            self.path = path
+            self.start_ns = time.monotonic_ns()
+            self.records = 0
+            self.enabled = True
+
+    def sample(self, device_number, sequence, speed, last_post_time):
+        """Record speed sample (km/h) received at ``last_post_time``, published as ``sequence``."""
+        record = SAMPLE.pack(KIND_SAMPLE, time.monotonic_ns() - self.start_ns, device_number or 0,
+                             sequence, speed, last_post_time)
+        self._write(record)
+
+    def state(self, device_number, snapshot):
+        """Record ``snapshot`` published without a sample (speed reset, stop)."""
+        last_post_time = snapshot.last_post_time
+        record = STATE.pack(KIND_STATE, time.monotonic_ns() - self.start_ns, device_number or 0,
+                            snapshot.sequence, snapshot.speed, snapshot.rate,
+                            math.nan if last_post_time is None else last_post_time)
+        self._write(record)
+
+    def frame(self, device_number, sequence, now, elapsed_ticks, payload):
+        """Record TX ``payload`` computed from snapshot ``sequence`` at ``now`` after ``elapsed_ticks``."""
+        record = FRAME.pack(KIND_FRAME, time.monotonic_ns() - self.start_ns, device_number or 0,
+                            sequence, now, elapsed_ticks, bytes(payload))
+        self._write(record)
+
+    def _write(self, record):
+        with self.lock:
+            if self.file is not None:
+                self.file.write(record)
+                self.records += 1
+
+    def close(self):
+        """Flush and stop recording."""
+        with self.lock:
+            self.enabled = False
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+# process wide recorder, opened by main with --record
+RECORDER = Recorder()
+
+
+def read_recording(path):
+    """Yield records of recording ``path`` in order.
+
+    Yields
+    ------
+    tuple
+        ``(KIND_SEGMENT, metadata)`` at the start of every segment, else the
+        unpacked record (kind first, see the layout above). A truncated last
+        record (recorder killed) is skipped.
+    """
+    with open(path, "rb") as file:
+        data = file.read()
+    for record, _ in _scan(data, path):
+        yield record
+
+
+def _scan(data, path):
+    # yields (record, offset after it), stops at a truncated record
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a recording")
+    view = memoryview(data)
+    offset = len(MAGIC)
+    end = len(data)
+    while offset < end:
+        kind = data[offset]
+        if kind == KIND_SEGMENT:
+            if offset + SEGMENT.size > end:
+                return
+            _, length = SEGMENT.unpack_from(view, offset)
+            offset += SEGMENT.size
+            if offset + length > end:
+                return
+            offset += length
+            yield (KIND_SEGMENT, json.loads(bytes(view[offset - length:offset]))), offset
+            continue
+        record = RECORDS.get(kind)
+        if record is None:
+            raise ValueError(f"{path}: unknown record kind {kind} at offset {offset}")
+        if offset + record.size > end:
+            return
+        offset += record.size
+        yield record.unpack_from(view, offset - record.size), offset
@@ -0,0 +1,198 @@
+import argparse
+import http.client
+import json
+import math
+import sys
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+from . import SpeedState, SpeedSnapshot
+from .estimator_module import speed_at
+from .page_module import SpeedPageEncoder, KMH_TO_MM_S, ANT_PROFILES
+from .ant_module import Channel_Period
+from .recorder_module import read_recording, KIND_SEGMENT, KIND_SAMPLE, KIND_STATE, KIND_FRAME
+
+# ======================================================
+# Replay of recordings (see recorder_module)
+# ======================================================
+# ``verify``: runs the recorded samples through the speed estimator and page
+# encoder in virtual time - the recorded receive and TX timestamps - and
+# compares every frame with the recorded payload. Deterministic and as fast
+# as the CPU allows, no server or hardware involved. Cadence, power and heart
+# rate are not recorded, frames of profiles sending them are skipped.
+#
+# ``http``: POSTs the recorded samples to a running server at the recorded
+# pace, or N times faster, for load and regression tests with real rides.
+# Its frames depend on real TX timing, so they are checked with ``verify``
+# on a recording made by the server under test.
+#
+# Usage::
+#
+#     python -m tpvirtserver.replay_module verify ride.rec
+#     python -m tpvirtserver.replay_module http ride.rec --url http://127.0.0.1:5000 --speed 10
+
+SNAPSHOT_HISTORY = 64     # recent snapshots per sensor a frame may refer to
+
+
+class ReplaySensor:
+    """Speed state and page encoder of one recorded sensor."""
+
+    def __init__(self, device_number, estimator, wheel_circumference_mm):
+        self.state = SpeedState(device_number, estimator)
+        self.encoder = SpeedPageEncoder(Channel_Period, wheel_circumference_mm)
+        # recorded sequence -> replayed snapshot, frames may lag behind samples
+        self.snapshots = {}
+        self.order = deque()
+
+    def keep(self, sequence):
+        self.snapshots[sequence] = self.state.snapshot
+        self.order.append(sequence)
+        if len(self.order) > SNAPSHOT_HISTORY:
+            del self.snapshots[self.order.popleft()]
+
+    def snapshot(self, sequence):
+        # sequences published before the recording started read the initial state
+        return self.snapshots.get(sequence, self.state.snapshot if not self.order else None)
+
+
+def verify(path, max_reports=10):
+    """Replay recording ``path`` in virtual time and compare frames.
+
+    Returns
+    -------
+    dict
+        Counts of ``samples``, ``frames``, ``mismatches``, ``unknown``
+        (frames referring to a snapshot no longer kept) and ``skipped``
+        (frames of profiles with unrecorded values) and replay ``seconds``.
+    """
+    sensors = {}
+    skipped = set()
+    result = {"samples": 0, "frames": 0, "mismatches": 0, "unknown": 0, "skipped": 0}
+    start = time.perf_counter()
+    for record in read_recording(path):
+        kind = record[0]
+        if kind == KIND_SEGMENT:
+            # new server process, fresh states and encoders
+            metadata = record[1]
+            sensors = {
+                int(device): ReplaySensor(int(device), metadata["estimator"], wheel)
+                for device, wheel in metadata["sensors"].items()
+            }
+            # recordings made before profiles existed are speed only
+            skipped = {
+                int(device) for device, profile in metadata.get("profiles", {}).items()
+                if ANT_PROFILES[profile].metrics
+            }
+        elif kind == KIND_SAMPLE:
+            _, _, device, sequence, speed, last_post_time = record
+            sensor = sensors[device]
+            sensor.state.update(speed, last_post_time)
+            sensor.keep(sequence)
+            result["samples"] += 1
+        elif kind == KIND_STATE:
+            _, _, device, sequence, speed, rate, last_post_time = record
+            sensor = sensors[device]
+            if math.isnan(last_post_time):
+                last_post_time = None
+            with sensor.state.lock:
+                sensor.state._publish(SpeedSnapshot(speed, last_post_time, sensor.state.snapshot.sequence + 1, rate))
+            sensor.keep(sequence)
+        elif kind == KIND_FRAME:
+            _, t, device, sequence, now, elapsed_ticks, payload = record
+            sensor = sensors[device]
+            if device in skipped:
+                result["skipped"] += 1
+                continue
+            result["frames"] += 1
+            snapshot = sensor.snapshot(sequence)
+            if snapshot is None:
+                result["unknown"] += 1
+                continue
+            frame = bytes(sensor.encoder.encode(int(speed_at(snapshot, now) * KMH_TO_MM_S), elapsed_ticks))
+            if frame != payload:
+                result["mismatches"] += 1
+                if result["mismatches"] <= max_reports:
+                    print(f"frame mismatch device {device} at {t / 1e9:.3f} s: recorded {payload.hex(' ')} replayed {frame.hex(' ')}")
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def replay_http(path, url, speed=1.0):
+    """POST recorded samples to the server at ``url``.
+
+    Samples are sent to ``/sensor/<device number>`` at their recorded
+    offsets divided by ``speed``; ``speed`` 0 sends as fast as possible.
+    Segments are replayed back to back.
+
+    Returns
+    -------
+    dict
+        ``samples`` sent, ``errors`` (non 2xx answers), wall ``seconds`` and
+        the largest ``lag`` behind schedule [s].
+    """
+    target = urlparse(url)
+    if target.scheme == "https":
+        import ssl
+        connection = http.client.HTTPSConnection(target.hostname, target.port, context=ssl._create_unverified_context())
+    else:
+        connection = http.client.HTTPConnection(target.hostname, target.port)
+    result = {"samples": 0, "errors": 0, "lag": 0.0}
+    start = time.perf_counter()
+    # schedule offset of the current segment [s]
+    base = 0.0
+    segment_end = 0.0
+    for record in read_recording(path):
+        if record[0] == KIND_SEGMENT:
+            base = segment_end
+            continue
+        if record[0] != KIND_SAMPLE:
+            continue
+        _, t, device, _, speed_kmh, _ = record
+        offset = base + t / 1e9
+        segment_end = max(segment_end, offset)
+        if speed > 0:
+            delay = offset / speed - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                result["lag"] = max(result["lag"], -delay)
+        body = json.dumps({"speed": speed_kmh * KMH_TO_MM_S}).encode("utf-8")
+        connection.request("POST", f"/sensor/{device}", body, {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        response.read()
+        if not 200 <= response.status < 300:
+            result["errors"] += 1
+        result["samples"] += 1
+    connection.close()
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay TPVirt server recordings (--record)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    verify_parser = commands.add_parser("verify", help="recompute frames in virtual time and compare them with the recording")
+    verify_parser.add_argument("recording")
+    http_parser = commands.add_parser("http", help="POST recorded samples to a running server")
+    http_parser.add_argument("recording")
+    http_parser.add_argument("--url", default="http://127.0.0.1:5000", help="server base URL (default: http://127.0.0.1:5000)")
+    http_parser.add_argument("--speed", type=float, default=1.0, help="replay speed factor, 0 sends as fast as possible (default: 1)")
+    args = parser.parse_args(argv)
+
+    if args.command == "verify":
+        result = verify(args.recording)
+        rate = (result["samples"] + result["frames"]) / result["seconds"] if result["seconds"] else 0.0
+        print(f"{result['samples']} samples, {result['frames']} frames, {result['mismatches']} mismatches, "
+              f"{result['unknown']} unknown snapshots, {result['skipped']} skipped frames, {rate:.0f} records/s")
+        return 1 if result["mismatches"] or result["unknown"] else 0
+
+    result = replay_http(args.recording, args.url, args.speed)
+    print(f"{result['samples']} samples in {result['seconds']:.2f} s "
+          f"({result['samples'] / result['seconds'] if result['seconds'] else 0:.0f}/s), "
+          f"{result['errors']} errors, max lag {result['lag'] * 1000:.1f} ms")
+    return 1 if result["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
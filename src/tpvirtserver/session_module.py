@@ -0,0 +1,142 @@
+import heapq
+import threading
+import time
+from collections import deque
+from urllib.parse import parse_qs
+
+from .metrics_module import SESSIONS_ACTIVE, SESSIONS_EVICTED
+
+##########################################################################
+# Client sessions
+###########################################################################
+# Maps TPV clients to virtual sensors, so one server can serve a room of
+# trainers without one client overwriting another's speed.
+#
+# - ``path``: the client picks the sensor with ``/sensor/<device number>``,
+#   other paths feed the default sensor (no sessions are created).
+# - ``address``: every client IP address gets its own sensor.
+# - ``token``: every session token (``X-Session-Token`` header or
+#   ``?session=`` query parameter) gets its own sensor.
+#
+# In ``address`` and ``token`` mode a new session takes a free sensor from
+# the pool; a session idle for ``idle_timeout`` is evicted, its sensor reset
+# and returned to the pool. An explicit ``/sensor/<device number>`` path is
+# honoured in every mode.
+
+SESSION_KEYS = ("path", "address", "token")
+SESSION_IDLE_TIMEOUT = 60.0     # idle session evicted after [s]
+SESSION_TOKEN_HEADER = "X-Session-Token"
+SESSION_TOKEN_PARAM = "session"
+
+
+def request_token(header_value, query):
+    """Return session token of a request from its header value or query string."""
+    if header_value:
+        return header_value
+    if query:
+        values = parse_qs(query).get(SESSION_TOKEN_PARAM)
+        if values:
+            return values[0]
+    return None
+
+
+class Session:
+    """One client bound to one sensor state."""
+
+    __slots__ = ("key", "state", "last_seen", "created")
+
+    def __init__(self, key, state, now):
+        self.key = key
+        self.state = state
+        self.last_seen = now
+        self.created = now
+
+
+class SessionRegistry:
+    """Client session -> sensor mapping with idle eviction.
+
+    Lookup of a known session is one dict access. Idle timers are kept in a
+    heap of ``(deadline, key)``; an entry whose session was seen again since
+    is re-armed when it comes due, so ``expire()`` only touches sessions that
+    may have timed out.
+
+    Parameters
+    ----------
+    shared_data : SharedData
+        Shared state; its registered sensors form the pool of free sensors.
+    key : str
+        Session key, one of ``SESSION_KEYS``.
+    idle_timeout : float
+        Seconds without requests after which a session is evicted.
+    """
+
+    def __init__(self, shared_data, key="path", idle_timeout=SESSION_IDLE_TIMEOUT):
+        if key not in SESSION_KEYS:
+            raise ValueError(f"key must be one of {SESSION_KEYS}, got {key!r}")
+        self.shared_data = shared_data
+        self.key = key
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self.free = deque(shared_data.all_sensors())
+        self.timers = []
+        # only session creation and eviction lock, lookups do not
+        self.lock = threading.Lock()
+        SESSIONS_ACTIVE.set_function(lambda: len(self.sessions))
+
+    def resolve(self, client=None, token=None, now=None):
+        """Return sensor state of the session of ``client`` / ``token``.
+
+        Creates the session on first contact. Returns None if the request
+        has no session key or no sensor is free.
+        """
+        session_key = client if self.key == "address" else token
+        if session_key is None:
+            return None
+        if now is None:
+            now = time.time()
+        session = self.sessions.get(session_key)
+        if session is None:
+            with self.lock:
+                session = self.sessions.get(session_key)
+                if session is None:
+                    if not self.free:
+                        return None
+                    session = Session(session_key, self.free.popleft(), now)
+                    self.sessions[session_key] = session
+                    heapq.heappush(self.timers, (now + self.idle_timeout, session_key))
+        session.last_seen = now
+        return session.state
+
+    def expire(self, now=None):
+        """Evict idle sessions.
+
+        Returns
+        -------
+        float or None
+            Seconds until the next session may time out, None if there are
+            no sessions.
+        """
+        if now is None:
+            now = time.time()
+        timers = self.timers
+        with self.lock:
+            while timers and timers[0][0] <= now:
+                _, session_key = heapq.heappop(timers)
+                session = self.sessions.get(session_key)
+                if session is None:
+                    continue
+                deadline = session.last_seen + self.idle_timeout
+                if deadline > now:
+                    heapq.heappush(timers, (deadline, session_key))
+                    continue
+                self._evict(session)
+            return timers[0][0] - now if timers else None
+
+    def _evict(self, session):
+        del self.sessions[session.key]
+        state = session.state
+        with state.lock:
+            state.BikeSpeed = 0.0
+            state.last_post_time = None
+        self.free.append(state)
+        SESSIONS_EVICTED.inc()
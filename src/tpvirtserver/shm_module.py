@@ -0,0 +1,177 @@
+import math
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+from . import SpeedSnapshot, SensorMetrics, NO_METRICS
+from .estimator_module import speed_at
+
+##########################################################################
+# Shared memory speed table
+###########################################################################
+# Fixed layout table of sensor speed snapshots shared between the HTTP
+# ingest worker processes (writers) and the ANT+ transmitter process
+# (reader). One slot per sensor:
+#
+#   offset  type     field
+#   0       uint64   sequence, odd while a write is in progress
+#   8       float64  speed [km/h]
+#   16      float64  rate [(km/h)/s]
+#   24      float64  last POST time, NaN for None
+#   32      uint64   metrics sequence, odd while a write is in progress
+#   40      float32  cadence [rpm], NaN for None
+#   44      float32  power [W], NaN for None
+#   48      float32  heart rate [bpm], NaN for None
+#   52      float64  metrics receive time, NaN for None
+#
+# Readers use the sequence as a seqlock: a slot read is retried while the
+# sequence is odd or changed during the read, so the TX callback never
+# blocks and never makes an IPC round trip. Writers of different processes
+# serialize on one ``multiprocessing.Lock``. A reader that keeps meeting a
+# write in progress (writer preempted mid-write) yields and finally returns
+# the last consistent snapshot it read from that slot.
+
+SLOT = struct.Struct("<Qddd")
+SEQUENCE = struct.Struct("<Q")
+METRICS = struct.Struct("<Qfffd")
+METRICS_OFFSET = 32
+SLOT_SIZE = 64
+SEQLOCK_RETRIES = 100
+
+
+class SpeedTable:
+    """Speed snapshots of ``slots`` sensors in shared memory.
+
+    Parameters
+    ----------
+    slots : int
+        Number of sensors.
+    write_lock : multiprocessing.Lock
+        Lock shared by all writing processes.
+    name : str or None
+        Name of an existing table to attach to; a new table is created
+        when None.
+    """
+
+    def __init__(self, slots, write_lock, name=None):
+        self.slots = slots
+        self.write_lock = write_lock
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=slots * SLOT_SIZE)
+            self.owner = True
+            for slot in range(slots):
+                SLOT.pack_into(self.shm.buf, slot * SLOT_SIZE, 0, 0.0, 0.0, math.nan)
+                METRICS.pack_into(self.shm.buf, slot * SLOT_SIZE + METRICS_OFFSET, 0, math.nan, math.nan, math.nan, math.nan)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name = self.shm.name
+        self.buf = self.shm.buf
+        # last consistent snapshot read per slot, fallback of a busy slot
+        self.last_read = [SpeedSnapshot(0.0, None, 0, 0.0)] * slots
+        self.last_metrics = [NO_METRICS] * slots
+
+    def write(self, slot, speed, rate, last_post_time):
+        """Publish one snapshot into ``slot``."""
+        offset = slot * SLOT_SIZE
+        buf = self.buf
+        with self.write_lock:
+            sequence = SEQUENCE.unpack_from(buf, offset)[0]
+            SEQUENCE.pack_into(buf, offset, sequence + 1)
+            SLOT.pack_into(buf, offset, sequence + 1, speed, rate,
+                           math.nan if last_post_time is None else last_post_time)
+            SEQUENCE.pack_into(buf, offset, sequence + 2)
+
+    def read(self, slot):
+        """Return consistent ``SpeedSnapshot`` of ``slot`` without locking."""
+        offset = slot * SLOT_SIZE
+        buf = self.buf
+        for _ in range(SEQLOCK_RETRIES):
+            sequence, speed, rate, last_post_time = SLOT.unpack_from(buf, offset)
+            if not sequence & 1 and SEQUENCE.unpack_from(buf, offset)[0] == sequence:
+                if last_post_time != last_post_time:  # NaN
+                    last_post_time = None
+                snapshot = SpeedSnapshot(speed, last_post_time, sequence >> 1, rate)
+                self.last_read[slot] = snapshot
+                return snapshot
+            # let the writer finish
+            time.sleep(0)
+        return self.last_read[slot]
+
+    def write_metrics(self, slot, metrics):
+        """Publish ``SensorMetrics`` into ``slot``."""
+        offset = slot * SLOT_SIZE + METRICS_OFFSET
+        buf = self.buf
+        with self.write_lock:
+            sequence = SEQUENCE.unpack_from(buf, offset)[0]
+            SEQUENCE.pack_into(buf, offset, sequence + 1)
+            METRICS.pack_into(buf, offset, sequence + 1, *(math.nan if value is None else value for value in metrics))
+            SEQUENCE.pack_into(buf, offset, sequence + 2)
+
+    def read_metrics(self, slot):
+        """Return consistent ``SensorMetrics`` of ``slot`` without locking."""
+        offset = slot * SLOT_SIZE + METRICS_OFFSET
+        buf = self.buf
+        for _ in range(SEQLOCK_RETRIES):
+            sequence, cadence, power, heart_rate, received = METRICS.unpack_from(buf, offset)
+            if not sequence & 1 and SEQUENCE.unpack_from(buf, offset)[0] == sequence:
+                if not sequence:
+                    return NO_METRICS
+                metrics = SensorMetrics(*(None if value != value else value for value in (cadence, power, heart_rate, received)))
+                self.last_metrics[slot] = metrics
+                return metrics
+            time.sleep(0)
+        return self.last_metrics[slot]
+
+    def close(self):
+        """Detach; the creating process also removes the table."""
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class TableSpeedState:
+    """Read side of one table slot, used like a ``SpeedState`` by the transmitter.
+
+    ``snapshot`` is read from the table on every access; the setters (used
+    by the main loop on ANT+ stop) write through the table.
+    """
+
+    def __init__(self, table, slot, device_number=None):
+        self.table = table
+        self.slot = slot
+        self.device_number = device_number
+        self.lock = threading.RLock()
+
+    @property
+    def snapshot(self):
+        return self.table.read(self.slot)
+
+    @property
+    def metrics(self):
+        return self.table.read_metrics(self.slot)
+
+    def speed_at(self, now):
+        return speed_at(self.table.read(self.slot), now)
+
+    @property
+    def BikeSpeed(self):
+        return self.snapshot.speed
+
+    @BikeSpeed.setter
+    def BikeSpeed(self, speed):
+        with self.lock:
+            snapshot = self.snapshot
+            self.table.write(self.slot, speed, 0.0, snapshot.last_post_time)
+
+    @property
+    def last_post_time(self):
+        return self.snapshot.last_post_time
+
+    @last_post_time.setter
+    def last_post_time(self, last_post_time):
+        with self.lock:
+            snapshot = self.snapshot
+            self.table.write(self.slot, snapshot.speed, snapshot.rate, last_post_time)
@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import deque
+
+##########################################################################
+# Simulated ANT+ Node / Channel
+###########################################################################
+# Drop-in replacement of the parts of ``openant.easy.node.Node`` and
+# ``openant.easy.channel.Channel`` used by ``AntBikeSpeed`` and
+# ``AntChannelManager``. No USB stick is needed: ``SimNode.start()`` fires
+# ``on_broadcast_tx_data`` of every open channel at its channel period and
+# every broadcast frame is recorded with a monotonic timestamp.
+
+SIM_MAX_CHANNELS = 8
+SIM_FRAME_HISTORY = 100000   # frames kept per channel
+
+
+class SimChannel:
+    """Simulated ANT+ channel recording broadcast frames."""
+
+    class Type:
+        BIDIRECTIONAL_RECEIVE = 0x00
+        BIDIRECTIONAL_TRANSMIT = 0x10
+
+    def __init__(self, id, node):
+        self.id = id
+        self.node = node
+        self.device_number = None
+        self.device_type = None
+        self.transmission_type = None
+        self.period = 8192
+        self.rf_freq = 57
+        self.is_open = False
+        self.on_broadcast_tx_data = None
+        # (time.monotonic_ns(), bytes) of every broadcast frame
+        self.frames = deque(maxlen=SIM_FRAME_HISTORY)
+        self.tx_count = 0
+
+    def set_id(self, device_number, device_type, transmission_type):
+        self.device_number = device_number
+        self.device_type = device_type
+        self.transmission_type = transmission_type
+
+    def set_period(self, period):
+        self.period = period
+        self.node._wakeup.set()
+
+    def set_rf_freq(self, rf_freq):
+        self.rf_freq = rf_freq
+
+    def open(self):
+        self.is_open = True
+        self.node._wakeup.set()
+
+    def close(self):
+        self.is_open = False
+
+    def send_broadcast_data(self, data):
+        self.frames.append((time.monotonic_ns(), bytes(data)))
+        self.tx_count += 1
+
+
+class SimNode:
+    """Simulated ANT+ Node driving TX events of its channels.
+
+    Parameters
+    ----------
+    max_channels : int
+        Number of channels the simulated stick offers.
+    """
+
+    def __init__(self, max_channels=SIM_MAX_CHANNELS):
+        self.capabilities = {"max_channels": max_channels}
+        self.channels = {}
+        self.network_keys = {}
+        # created before the TX thread runs: a stop() before start() is not lost
+        self._stopped = threading.Event()
+        self._wakeup = threading.Event()
+
+    def set_network_key(self, network, key):
+        self.network_keys[network] = key
+
+    def new_channel(self, ctype, network_number=0x00, ext_assign=None):
+        if len(self.channels) >= self.capabilities["max_channels"]:
+            raise RuntimeError("No free channel on simulated node")
+        channel = SimChannel(len(self.channels), self)
+        self.channels[channel.id] = channel
+        return channel
+
+    def start(self):
+        """Run TX event loop until ``stop()``; blocks like ``openant`` ``Node.start``.
+
+        Returns at once if ``stop()`` was already called; a stopped Node is
+        not started again.
+        """
+        next_tx = {}
+        while not self._stopped.is_set():
+            now = time.monotonic_ns()
+            timeout = None
+            for channel in list(self.channels.values()):
+                if not channel.is_open:
+                    next_tx.pop(channel.id, None)
+                    continue
+                period_ns = channel.period * 1000000000 // 32768
+                due = next_tx.get(channel.id)
+                if due is None:
+                    due = now + period_ns
+                elif due <= now:
+                    callback = channel.on_broadcast_tx_data
+                    if callback is not None:
+                        callback(None)
+                    # fixed schedule, late events do not shift the following ones
+                    due += period_ns
+                    if due <= now:
+                        due = now + period_ns
+                next_tx[channel.id] = due
+                wait = (due - now) / 1e9
+                timeout = wait if timeout is None else min(timeout, wait)
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
@@ -0,0 +1,257 @@
+import mmap
+import os
+import struct
+import threading
+import time
+
+from .estimator_module import speed_at
+
+# ======================================================
+# Ride data store
+# ======================================================
+# Optional time series of per rider speed, distance and total wheel
+# rotations (--store). A background thread samples every sensor once per
+# interval - the lock-free speed snapshot and the page encoder counters - and
+# appends fixed size records to a memory-mapped file, so neither POST
+# handlers nor the TX callback ever wait for the disk. Sensors without a new
+# sample or wheel rotation since their last record are skipped, an idle
+# server writes nothing. Dirty pages are synced in batches every
+# STORE_SYNC_INTERVAL, a crash loses at most that much.
+#
+# File layout (little endian)::
+#
+#   HEADER  magic 8s, record size u32, reserved u32, record count u64
+#   RECORD  time f64, device u16, pad 2, total wheel rotations u32, speed f32 [km/h], distance f64 [m]
+#
+# The file is grown in STORE_GROW_RECORDS steps ahead of the records and cut
+# back on close; only the first ``record count`` records are valid. Records
+# are appended in ``time.time()`` order, ranges are found by binary search.
+#
+# Readers (``StoreReader``, also in ingest worker processes) map the file
+# read-only and follow the record count in the header.
+
+STORE_MAGIC = b"TPVRIDE1"
+STORE_HEADER = struct.Struct("<8sIIQ")
+STORE_COUNT = struct.Struct("<Q")
+STORE_COUNT_OFFSET = 16
+STORE_RECORD = struct.Struct("<dHxxIfd")
+STORE_FIELDS = ("time", "speed", "distance", "total_wheel_rotations")
+STORE_INTERVAL = 1.0            # default sampling interval [s]
+STORE_SYNC_INTERVAL = 10.0      # msync of written records [s]
+STORE_GROW_RECORDS = 64 * 1024  # file growth step [records]
+MAX_STORE_RESULTS = 10000       # records returned by one query
+MAX_STORE_SCAN = 100000         # records scanned by one query
+STORE_QUERY_WINDOW = 3600.0     # default query range [s]
+
+
+def _check_header(data, path):
+    magic, record_size, _, count = STORE_HEADER.unpack_from(data, 0)
+    if magic != STORE_MAGIC:
+        raise ValueError(f"{path} is not a ride store")
+    if record_size != STORE_RECORD.size:
+        raise ValueError(f"{path}: record size {record_size}, expected {STORE_RECORD.size}")
+    return count
+
+
+class RideStore:
+    """Writer of the ride store, sampling ``sensors`` from a background thread.
+
+    Parameters
+    ----------
+    path : str
+        Store file, created if missing, appended to otherwise.
+    sensors : list of AntBikeSpeed
+        Sensors to sample: speed from their ``SpeedState``, rotations and
+        wheel circumference from their ``page_encoder``.
+    logger : logging.Logger
+        Parent logger; a child logger ``RideStore`` will be created.
+    interval : float
+        Sampling interval [s].
+    """
+
+    def __init__(self, path, sensors, logger, interval=STORE_INTERVAL):
+        if interval <= 0:
+            raise ValueError(f"interval must be positive, got {interval}")
+        self.logger = logger.getChild("RideStore")
+        self.path = path
+        self.sensors = list(sensors)
+        self.interval = interval
+        self.file = None
+        self.map = None
+        self.count = 0
+        self.capacity = 0
+        self.synced = 0
+        # device number -> (snapshot sequence, total rotations) of its last record
+        self.last = {}
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def open(self):
+        """Map the store file and start the sampling thread."""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.file = os.fdopen(fd, "r+b")
+        size = os.fstat(fd).st_size
+        if size == 0:
+            self.file.write(STORE_HEADER.pack(STORE_MAGIC, STORE_RECORD.size, 0, 0))
+            self.file.flush()
+            self.count = 0
+        else:
+            self.count = _check_header(self.file.read(STORE_HEADER.size), self.path)
+            # do not trust a count beyond the file end (file cut by hand)
+            self.count = min(self.count, (size - STORE_HEADER.size) // STORE_RECORD.size)
+        self._map(self.count + STORE_GROW_RECORDS)
+        self.synced = self.count
+        self.logger.info(f"Storing ride data to {self.path} every {self.interval:g} s ({self.count} records)")
+        self.thread = threading.Thread(target=self._run, name="tpv-store", daemon=True)
+        self.thread.start()
+
+    def _map(self, capacity):
+        if self.map is not None:
+            self.map.close()
+        self.file.truncate(STORE_HEADER.size + capacity * STORE_RECORD.size)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.capacity = capacity
+
+    def _run(self):
+        next_sync = time.monotonic() + STORE_SYNC_INTERVAL
+        while not self.stopping.wait(self.interval):
+            try:
+                self.sample()
+                if time.monotonic() >= next_sync:
+                    self.sync()
+                    next_sync = time.monotonic() + STORE_SYNC_INTERVAL
+            except Exception:
+                # a full disk must not take the server down, retry next interval
+                self.logger.exception(f"Writing {self.path} failed")
+
+    def sample(self, now=None):
+        """Append one record per sensor with a new sample or rotation since its last record."""
+        now = time.time() if now is None else now
+        for sensor in self.sensors:
+            snapshot = sensor.shared_data.snapshot
+            encoder = sensor.page_encoder
+            rotations = encoder.total_revolutions
+            key = (snapshot.sequence, rotations)
+            if self.last.get(sensor.device_number) == key:
+                continue
+            self.last[sensor.device_number] = key
+            if self.count >= self.capacity:
+                self._map(self.capacity + STORE_GROW_RECORDS)
+            STORE_RECORD.pack_into(
+                self.map, STORE_HEADER.size + self.count * STORE_RECORD.size,
+                now, sensor.device_number or 0, rotations, speed_at(snapshot, now),
+                rotations * encoder.wheel_circumference_mm / 1000.0)
+            self.count += 1
+        # records first, readers never see a count beyond them
+        STORE_COUNT.pack_into(self.map, STORE_COUNT_OFFSET, self.count)
+
+    def sync(self):
+        """Write records appended since the last sync to disk."""
+        if self.count == self.synced:
+            return
+        self.map.flush()
+        self.synced = self.count
+
+    def close(self):
+        """Stop sampling, sync and cut the file back to its records."""
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+        if self.map is not None:
+            self.sync()
+            self.map.close()
+            self.map = None
+            self.file.truncate(STORE_HEADER.size + self.count * STORE_RECORD.size)
+            self.file.close()
+            self.file = None
+            self.logger.info(f"Ride store {self.path} closed ({self.count} records)")
+
+
+class StoreReader:
+    """Read-only view of the ride store for range queries.
+
+    The file is mapped on the first query (it may be created after the
+    HTTP server starts) and remapped when the writer has grown it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.map = None
+        self.lock = threading.Lock()
+
+    def _records(self):
+        # valid record count, mapping (again) if the writer appended beyond the map
+        if self.map is not None:
+            count = STORE_COUNT.unpack_from(self.map, STORE_COUNT_OFFSET)[0]
+            if STORE_HEADER.size + count * STORE_RECORD.size <= len(self.map):
+                return count
+            self.map.close()
+            self.map = None
+        with open(self.path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        count = _check_header(self.map, self.path)
+        return min(count, (len(self.map) - STORE_HEADER.size) // STORE_RECORD.size)
+
+    def _time(self, index):
+        return STORE_RECORD.unpack_from(self.map, STORE_HEADER.size + index * STORE_RECORD.size)[0]
+
+    def _search(self, count, t):
+        # first record at or after t
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if self._time(middle) < t:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def query(self, device_number, start, end, limit=MAX_STORE_RESULTS):
+        """Records of ``device_number`` with ``start <= time < end``.
+
+        At most ``limit`` records are returned and ``MAX_STORE_SCAN`` records
+        of all sensors scanned; a cut off result tells where to continue.
+
+        Returns
+        -------
+        dict
+            ``samples`` as ``[time, speed, distance, total_wheel_rotations]``
+            lists (``fields``), ``distance`` ridden in the range [m] and
+            ``next``, the start of the following query, None if complete.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the store file does not exist (yet).
+        """
+        limit = min(limit, MAX_STORE_RESULTS)
+        with self.lock:
+            count = self._records()
+            first = self._search(count, start)
+            last = min(count, first + MAX_STORE_SCAN)
+            view = memoryview(self.map)[STORE_HEADER.size + first * STORE_RECORD.size:
+                                        STORE_HEADER.size + last * STORE_RECORD.size]
+            samples = []
+            next_start = None
+            try:
+                for t, device, rotations, speed, distance in STORE_RECORD.iter_unpack(view):
+                    if t >= end:
+                        break
+                    if device != device_number:
+                        continue
+                    if len(samples) >= limit:
+                        next_start = t
+                        break
+                    samples.append([t, speed, distance, rotations])
+                else:
+                    if last < count:
+                        next_start = self._time(last)
+            finally:
+                view.release()
+        return {
+            "fields": STORE_FIELDS,
+            "samples": samples,
+            "distance": samples[-1][2] - samples[0][2] if samples else 0.0,
+            "next": next_start,
+        }
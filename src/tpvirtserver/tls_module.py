@@ -0,0 +1,192 @@
+import os
+import time
+
+from .metrics_module import TLS_HANDSHAKES, TLS_RESUMED, TLS_CERT_RELOADS
+
+# ======================================================
+# TLS
+# ======================================================
+# ``ssl`` is imported on first use, so plain http startup does not load the
+# ssl stack and certificates.
+#
+# TPV reconnects often, so the server context keeps session resumption on:
+# a session cache for TLS 1.2 and session tickets for both versions. Only
+# forward secret AEAD suites are offered for TLS 1.2, ECDSA certificates
+# first (an ECDSA P-256 key makes full handshakes much cheaper than RSA).
+#
+# Certificates are reloaded without restarting: the base context created at
+# startup keeps the session cache and ticket keys, every handshake is
+# switched to the newest certificate context from its SNI callback (called
+# for every ClientHello, also without SNI). Sessions stay resumable across a
+# certificate rotation.
+
+TLS_PROFILES = ("compat", "modern")    # compat: TLS 1.2 + 1.3, modern: TLS 1.3 only
+TLS12_CIPHERS = "ECDHE+aECDSA+AESGCM:ECDHE+aECDSA+CHACHA20:ECDHE+aRSA+AESGCM:ECDHE+aRSA+CHACHA20"
+TLS13_TICKETS = 2                      # session tickets sent after a TLS 1.3 handshake
+CERT_WATCH_INTERVAL = 60.0             # certificate file check interval [s]
+
+
+def create_ssl_context(certFilePath, keyFilePath, profile="compat"):
+    """Create server side SSL context with given certificate chain and key.
+
+    Parameters
+    ----------
+    certFilePath, keyFilePath : str
+        Certificate chain and key (PEM).
+    profile : str
+        One of ``TLS_PROFILES``.
+    """
+    import ssl
+
+    if profile not in TLS_PROFILES:
+        raise ValueError(f"profile must be one of {TLS_PROFILES}, got {profile!r}")
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_3 if profile == "modern" else ssl.TLSVersion.TLSv1_2
+    context.set_ciphers(TLS12_CIPHERS)
+    context.options |= ssl.OP_CIPHER_SERVER_PREFERENCE | ssl.OP_NO_COMPRESSION
+    # session tickets, stateless resumption
+    context.options &= ~ssl.OP_NO_TICKET
+    context.num_tickets = TLS13_TICKETS
+    #context.load_cert_chain(certfile="config/cert-chain.pem", keyfile="config/key.pem")
+    context.load_cert_chain(certfile = certFilePath, keyfile = keyFilePath)
+    return context
+
+
+class CertificateReloader:
+    """Server SSL context whose certificate can be replaced at runtime.
+
+    Parameters
+    ----------
+    certFilePath, keyFilePath : str
+        Certificate chain and key (PEM), reread by ``reload()``.
+    profile : str
+        TLS profile, see ``TLS_PROFILES``.
+    logger : logging.Logger
+        Parent logger; a child logger ``CertificateReloader`` will be created.
+
+    Attributes
+    ----------
+    context : ssl.SSLContext
+        Base context to serve with; keeps the session cache and ticket keys
+        for the lifetime of the server.
+    current : ssl.SSLContext
+        Context holding the newest certificate, used for new handshakes.
+    """
+
+    def __init__(self, certFilePath, keyFilePath, profile="compat", logger=None):
+        self.certFilePath = certFilePath
+        self.keyFilePath = keyFilePath
+        self.profile = profile
+        self.logger = logger.getChild("CertificateReloader") if logger else None
+        self.stamp = self._stamp()
+        self.context = create_ssl_context(certFilePath, keyFilePath, profile)
+        self.current = self.context
+        self.context.sni_callback = self._select_context
+        # handshakes of certificate contexts replaced by reload()
+        self.retired_handshakes = 0
+        TLS_HANDSHAKES.set_function(self.handshakes)
+        TLS_RESUMED.set_function(lambda: self.context.session_stats()["hits"])
+
+    def _select_context(self, sslobj, server_name, context):
+        current = self.current
+        if current is not context:
+            sslobj.context = current
+        return None
+
+    def handshakes(self):
+        """Return count of completed handshakes since start.
+
+        A handshake is counted by the context it finished on, resumption
+        (cache and tickets) always by the base context.
+        """
+        count = self.retired_handshakes + self.context.session_stats()["accept_good"]
+        if self.current is not self.context:
+            count += self.current.session_stats()["accept_good"]
+        return count
+
+    def _stamp(self):
+        stamp = []
+        for path in (self.certFilePath, self.keyFilePath):
+            try:
+                st = os.stat(path)
+            except OSError:
+                stamp.append(None)
+            else:
+                stamp.append((st.st_mtime_ns, st.st_size, st.st_ino))
+        return tuple(stamp)
+
+    def reload(self, force=False):
+        """Load the certificate files again if they changed (always if ``force``).
+
+        A failed load (e.g. a half written file) keeps the current
+        certificate and is retried on the next call.
+
+        Returns
+        -------
+        bool
+            True if a new certificate is in use.
+        """
+        import ssl
+
+        stamp = self._stamp()
+        if not force and stamp == self.stamp:
+            return False
+        try:
+            context = create_ssl_context(self.certFilePath, self.keyFilePath, self.profile)
+        except (OSError, ssl.SSLError) as e:
+            if self.logger:
+                self.logger.error(f"Certificate reload failed, keeping current certificate: {e}")
+            return False
+        self.stamp = stamp
+        if self.current is not self.context:
+            self.retired_handshakes += self.current.session_stats()["accept_good"]
+        self.current = context
+        TLS_CERT_RELOADS.inc()
+        if self.logger:
+            self.logger.info(f"Certificate reloaded from {self.certFilePath}")
+        return True
+
+
+class CertificateWatch:
+    """Certificate reload schedule of one HTTP server, driven by a main loop.
+
+    ``request()`` is safe to call from a signal handler (SIGHUP), the loop
+    then calls ``poll()`` whenever it wakes up.
+
+    Parameters
+    ----------
+    server : TPVHttpServer or TPVAsyncHttpServer or IngestWorkers
+        Server with a ``reload_certificates(force)`` method.
+    interval : float
+        Seconds between checks of the certificate files, 0 disables
+        checking (reload on ``request()`` only).
+    """
+
+    def __init__(self, server, interval=CERT_WATCH_INTERVAL):
+        self.server = server
+        self.interval = interval
+        self.requested = False
+        self.next_check = time.monotonic() + interval
+
+    def request(self):
+        """Reload on the next ``poll()`` even if the files look unchanged."""
+        self.requested = True
+
+    def poll(self):
+        """Reload if requested or the check interval passed.
+
+        Returns
+        -------
+        float or None
+            Seconds until the next check, None if files are not watched.
+        """
+        if self.requested:
+            self.requested = False
+            self.server.reload_certificates(force=True)
+        if self.interval <= 0:
+            return None
+        now = time.monotonic()
+        if now >= self.next_check:
+            self.server.reload_certificates()
+            self.next_check = now + self.interval
+        return self.next_check - now
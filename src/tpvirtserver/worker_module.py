@@ -0,0 +1,269 @@
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+
+from . import SharedData, CommandQueue, COMMAND_QUEUE_SIZE
+from .shm_module import SpeedTable
+from .session_module import SessionRegistry
+from .tls_module import CertificateWatch
+from .log_module import setup_logging
+from .store_module import StoreReader
+from .datagram_module import create_datagram_listeners
+
+# ======================================================
+# Multiprocess ingest
+# ======================================================
+# HTTP parsing and TLS run in worker processes, the ANT+ transmitter and the
+# main loop stay in the parent. Workers publish sensor speed into the shared
+# ``SpeedTable``; commands and wakeups go through one multiprocessing queue.
+# Repeated commands are coalesced in a ``CommandQueue`` on both ends of it.
+# With more than one worker all of them bind the port with SO_REUSEPORT and
+# the kernel spreads connections over them.
+
+WORKER_START_TIMEOUT = 30.0
+WORKER_STOP_TIMEOUT = 5.0
+WAKEUP_COMMAND = "WAKEUP"
+WORKER_WAKEUP_INTERVAL = 0.5    # at most one wakeup per worker and interval [s]
+
+
+class CommandChannel:
+    """Command queue and wakeup event of a worker over one ``multiprocessing.Queue``.
+
+    Replaces both ``SharedData.command_queue`` and ``SharedData.wakeup`` in
+    the worker. ``put()`` queues into a coalescing ``CommandQueue`` that a
+    thread sends on, so a burst of one command waits once instead of
+    filling the shared queue. ``set()`` queues a ``WAKEUP_COMMAND``; the
+    parent forwards commands into its own ``CommandQueue`` and wakes its
+    main loop.
+
+    Parameters
+    ----------
+    command_queue : multiprocessing.Queue
+        Bounded queue shared by all workers; wakeups are dropped when it is
+        full (the main loop has commands to read anyway).
+    wakeup_interval : float
+        Minimum interval between queued wakeups. Workers call ``set()`` on
+        every POST; the main loop reads fresh speed from the table whenever
+        it wakes, so one wakeup per interval is enough.
+    """
+
+    def __init__(self, command_queue, wakeup_interval=0.0):
+        self.queue = command_queue
+        self.wakeup_interval = wakeup_interval
+        self.last_wakeup = 0.0
+        # set() also runs in signal handlers, which must not re-enter Queue.put
+        self.putting = False
+        # commands not sent yet, put() raises queue.Full like SharedData.command_queue
+        self.pending = CommandQueue()
+        self.ready = threading.Event()
+        threading.Thread(target=self._send, name="tpv-commands", daemon=True).start()
+
+    def _send(self):
+        while True:
+            self.ready.wait()
+            self.ready.clear()
+            while True:
+                try:
+                    command = self.pending.get_nowait()
+                except queue.Empty:
+                    break
+                # blocks while the parent drains the queue
+                self.queue.put(command)
+
+    def put(self, command):
+        self.pending.put(command)
+        self.ready.set()
+
+    def qsize(self):
+        return self.pending.qsize() + self.queue.qsize()
+
+    def set(self):
+        now = time.monotonic()
+        if now - self.last_wakeup >= self.wakeup_interval and not self.putting:
+            # a wakeup being queued right now is enough
+            self.putting = True
+            try:
+                self.last_wakeup = now
+                self.queue.put_nowait(WAKEUP_COMMAND)
+            except queue.Full:
+                pass
+            finally:
+                self.putting = False
+
+
+def run_ingest_worker(index, config, table_name, write_lock, command_queue, status_queue):
+    """Entry point of ingest worker process ``index``."""
+    setup_logging(config.log_level, config.log_format, config.log_rate, f"worker{index}")
+    logger = logging.getLogger()
+    # imported here, main imports this module
+    from .main import create_http_server
+
+    shared_data = SharedData()
+    shared_data.set_estimator(config.speed_estimator)
+    channel = CommandChannel(command_queue, WORKER_WAKEUP_INTERVAL)
+    shared_data.wakeup = channel
+    shared_data.command_queue = channel
+    table = SpeedTable(len(config.device_numbers), write_lock, table_name)
+    for slot, device_number in enumerate(config.device_numbers):
+        state = shared_data.add_sensor(device_number)
+        state.attach_table(table, slot)
+        # POST fields read for the sensor
+        state.profile = config.profiles[slot]
+    shared_data.sessions = SessionRegistry(shared_data, config.session_key, config.session_idle_timeout)
+    # the ANT+ process writes the store, workers only read it
+    shared_data.store = StoreReader(config.store) if config.store else None
+
+    stop = threading.Event()
+    wakeup = threading.Event()
+    cert_watch = None
+
+    def shutdown(signum, frame):
+        stop.set()
+        wakeup.set()
+
+    def reload_certificates(signum, frame):
+        if cert_watch is not None:
+            cert_watch.request()
+            wakeup.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGHUP, reload_certificates)
+
+    # the Unix socket path can be bound once, the first worker receives all datagrams
+    datagram_listeners = create_datagram_listeners(config, shared_data, logger) if index == 0 else []
+    try:
+        for listener in datagram_listeners:
+            listener.start()
+        httpServer = create_http_server(config, shared_data, logger, reuse_port=config.workers > 1)
+        httpServer.start()
+    except Exception as e:
+        status_queue.put((index, f"{type(e).__name__}: {e}"))
+        for listener in datagram_listeners:
+            listener.stop()
+        table.close()
+        return
+    status_queue.put((index, None))
+    if config.use_ssl:
+        # every worker watches the certificate files itself, SIGHUP is forwarded by the parent
+        cert_watch = CertificateWatch(httpServer, config.cert_watch_interval)
+    try:
+        # idle sessions of this worker; new sessions are picked up within one idle timeout
+        while not stop.is_set():
+            wakeup.clear()
+            timeout = shared_data.sessions.expire()
+            if cert_watch is not None:
+                next_check = cert_watch.poll()
+                if next_check is not None:
+                    timeout = next_check if timeout is None else min(timeout, next_check)
+            wakeup.wait(config.session_idle_timeout if timeout is None else timeout)
+    finally:
+        for listener in datagram_listeners:
+            listener.stop()
+        httpServer.stop()
+        table.close()
+
+
+class IngestWorkers:
+    """Pool of ingest worker processes with the ``start()`` / ``stop()`` interface of an HTTP server.
+
+    Parameters
+    ----------
+    config : argparse.Namespace
+        Server configuration, ``config.workers`` processes are started.
+    shared_data : SharedData
+        State of the transmitter process; commands of the workers are
+        forwarded into its ``command_queue`` and wake up its main loop.
+    logger : logging.Logger
+        Parent logger; a child logger ``IngestWorkers`` will be created.
+    """
+
+    def __init__(self, config, shared_data, logger):
+        self.logger = logger.getChild("IngestWorkers")
+        self.config = config
+        # spawn: workers must not inherit threads or the ANT+ stick
+        self.context = multiprocessing.get_context("spawn")
+        self.write_lock = self.context.Lock()
+        self.table = SpeedTable(len(config.device_numbers), self.write_lock)
+        self.command_queue = self.context.Queue(COMMAND_QUEUE_SIZE)
+        # (worker index, error or None) once a worker is listening
+        self.status_queue = self.context.Queue()
+        self.shared_data = shared_data
+        self.processes = []
+        self.forwarder = None
+
+    def _forward_commands(self):
+        # drains the worker queue as fast as commands arrive, so a burst of one
+        # command is coalesced here instead of filling the bounded queue
+        while True:
+            command = self.command_queue.get()
+            if command is None:
+                return
+            if command != WAKEUP_COMMAND:
+                try:
+                    self.shared_data.command_queue.put(command)
+                except queue.Full:
+                    self.logger.warning(f"Command queue full, dropped {command[0] if isinstance(command, tuple) else command}")
+            self.shared_data.wakeup.set()
+
+    def start(self):
+        """Start worker processes and wait until all of them listen."""
+        self.forwarder = threading.Thread(target=self._forward_commands, name="tpv-commands", daemon=True)
+        self.forwarder.start()
+        for index in range(self.config.workers):
+            process = self.context.Process(
+                target=run_ingest_worker,
+                args=(index, self.config, self.table.name, self.write_lock, self.command_queue, self.status_queue),
+                name=f"tpv-ingest-{index}",
+            )
+            process.start()
+            self.processes.append(process)
+        errors = []
+        try:
+            for _ in self.processes:
+                index, error = self.status_queue.get(timeout=WORKER_START_TIMEOUT)
+                if error is not None:
+                    errors.append(f"worker{index}: {error}")
+        except queue.Empty:
+            errors.append("timeout waiting for workers")
+        if errors:
+            self.stop()
+            raise RuntimeError("Ingest workers failed to start: " + "; ".join(errors))
+        self.logger.info(f"Started {len(self.processes)} ingest worker(s) on port {self.config.port}")
+
+    def stop(self):
+        self.logger.info("Stopping ingest workers...")
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            process.join(WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                self.logger.warning(f"Worker {process.name} did not stop, killing it")
+                process.kill()
+                process.join()
+        self.processes = []
+        if self.forwarder is not None:
+            try:
+                self.command_queue.put(None, timeout=WORKER_STOP_TIMEOUT)
+                self.forwarder.join(WORKER_STOP_TIMEOUT)
+            except queue.Full:
+                pass
+            self.forwarder = None
+        self.logger.info("Ingest workers stopped.")
+
+    def reload_certificates(self, force=False):
+        """Forward a forced reload (SIGHUP) to the workers; they watch the files themselves."""
+        if not force:
+            return False
+        for process in self.processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGHUP)
+        return True
+
+    def isRunning(self):
+        return any(process.is_alive() for process in self.processes)
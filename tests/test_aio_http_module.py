@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+
+from tpvirtserver.aio_http_module import TPVAsyncHttpServer, HttpProtocolError
+
+
+def read_chunks(body, limit=None):
+    """Return the chunks of ``body`` and the number of bytes left unread."""
+    server = TPVAsyncHttpServer.__new__(TPVAsyncHttpServer)
+
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(body)
+        reader.feed_eof()
+        chunks = [chunk async for chunk in server._iter_chunks(reader, limit)]
+        return chunks, len(await reader.read())
+    return asyncio.run(run())
+
+
+def test_chunked_body_over_limit_is_not_read():
+    with pytest.raises(HttpProtocolError) as e:
+        read_chunks(b"400\r\n" + b"x" * 1024 + b"\r\n0\r\n\r\n", limit=100)
+    assert e.value.status == 413
+
+
+def test_chunked_body_within_limit():
+    assert read_chunks(b"5\r\nhello\r\n0\r\n\r\n", limit=100) == ([b"hello"], 0)
+
+
+@pytest.mark.parametrize("limit", [None, 100])
+def test_negative_chunk_size_is_rejected(limit):
+    with pytest.raises(HttpProtocolError) as e:
+        read_chunks(b"-1\r\nxx\r\n0\r\n\r\n", limit)
+    assert e.value.status == 400
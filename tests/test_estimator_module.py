@@ -0,0 +1,50 @@
+import pytest
+
+from tpvirtserver import SharedData, SpeedSnapshot
+from tpvirtserver.estimator_module import speed_at
+from tpvirtserver.main import clear_speed, ANT_STOP_AFTER
+
+
+def test_speed_without_sample_is_zero():
+    assert speed_at(SpeedSnapshot(30.0, None, 3, 0.5), 1000.0) == 0.0
+
+
+def test_ant_stop_and_restart():
+    shared_data = SharedData()
+    state = shared_data.add_sensor(5)
+    state.update(30.0, 1000.0)
+    assert speed_at(state.snapshot, 1000.0) == pytest.approx(30.0)
+
+    # idle stop after ANT_STOP_AFTER without samples
+    stop = 1000.0 + ANT_STOP_AFTER + 1
+    clear_speed(shared_data)
+    assert state.snapshot.speed == 0.0
+    assert state.last_post_time is None
+    assert speed_at(state.snapshot, stop) == 0.0
+    assert speed_at(state.snapshot, stop + 3600) == 0.0
+
+    # the next sample restarts ANT+ and starts a new estimate
+    state.update(20.0, stop + 10)
+    assert speed_at(state.snapshot, stop + 10) == pytest.approx(20.0)
+    assert state.snapshot.rate == 0.0
+
+
+def test_close_samples_give_no_trend():
+    state = SharedData()
+    state.set_estimator("linear")
+    state.update(30.0, 1000.0)
+    state.update(31.0, 1000.05)
+    assert state.snapshot.rate == 0.0
+    assert speed_at(state.snapshot, 1002.0) == pytest.approx(31.0)
+
+
+@pytest.mark.parametrize("step", [10.0, -10.0])
+def test_extrapolation_is_limited(step):
+    state = SharedData()
+    state.set_estimator("linear")
+    state.update(30.0, 1000.0)
+    state.update(30.0 + step, 1001.0)
+    assert state.snapshot.rate != 0.0
+    for elapsed in (0.25, 0.5, 1.0, 2.0):
+        speed = speed_at(state.snapshot, 1001.0 + elapsed)
+        assert speed == pytest.approx(state.snapshot.speed, rel=0.1 + 1e-9)
@@ -0,0 +1,27 @@
+import io
+
+import pytest
+
+from tpvirtserver.http_module import TPVHttpPRequestHandler, HttpProtocolError
+
+
+def chunked_handler(body):
+    handler = TPVHttpPRequestHandler.__new__(TPVHttpPRequestHandler)
+    handler.rfile = io.BytesIO(body)
+    return handler
+
+
+def test_negative_chunk_size_is_rejected_before_reading():
+    handler = chunked_handler(b"5\r\nhello\r\n-1\r\n" + b"x" * 4096)
+    with pytest.raises(HttpProtocolError) as e:
+        list(handler._iter_chunks(limit=1024))
+    assert e.value.status == 400
+    assert handler.rfile.tell() == len(b"5\r\nhello\r\n-1\r\n")
+
+
+def test_chunked_body_over_limit_is_not_read():
+    handler = chunked_handler(b"400\r\n" + b"x" * 1024 + b"\r\n0\r\n\r\n")
+    with pytest.raises(HttpProtocolError) as e:
+        list(handler._iter_chunks(limit=100))
+    assert e.value.status == 413
+    assert handler.rfile.tell() == len(b"400\r\n")
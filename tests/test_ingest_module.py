@@ -0,0 +1,72 @@
+import pytest
+
+from tpvirtserver import SharedData, NO_METRICS
+from tpvirtserver.ingest_module import handle_post, StreamDecoder, PostOptions, INVALID_SPEED_RESPONSE, INVALID_JSON_RESPONSE
+
+FAST = PostOptions("minimal", "fast")
+JSON = PostOptions("minimal", "json")
+
+
+def sensor_data():
+    shared_data = SharedData()
+    shared_data.add_sensor(5)
+    return shared_data
+
+
+@pytest.mark.parametrize("body", [b'{"speed": NaN}', b'{"speed": Infinity}', b'{"speed": -Infinity}',
+                                  b'{"speed": 1e999}', b'{"speed": true}', b'[{"speed": NaN}]'])
+@pytest.mark.parametrize("options", [JSON, FAST], ids=["json", "fast"])
+def test_non_finite_or_bool_speed_is_rejected(body, options):
+    shared_data = sensor_data()
+    status, response = handle_post(shared_data, body, path="/sensor/5", options=options)
+    # orjson already refuses NaN and Infinity as invalid JSON
+    assert status == 400
+    assert response in (INVALID_SPEED_RESPONSE, INVALID_JSON_RESPONSE)
+    state = shared_data.get_sensor(5)
+    assert state.snapshot.sequence == 0
+    assert state.last_post_time is None
+
+
+@pytest.mark.parametrize("options", [JSON, FAST], ids=["json", "fast"])
+def test_finite_speed_is_applied(options):
+    shared_data = sensor_data()
+    status, _ = handle_post(shared_data, b'{"speed": 8333}', path="/sensor/5", options=options)
+    assert status == 200
+    assert shared_data.get_sensor(5).snapshot.speed == pytest.approx(30.0, abs=0.01)
+
+
+def test_stream_skips_non_finite_speed():
+    shared_data = sensor_data()
+    decoder = StreamDecoder(shared_data, shared_data.get_sensor(5))
+    decoder.feed(b'{"speed": NaN}\n{"speed": true}\n{"speed": 8333}\n')
+    assert (decoder.samples, decoder.errors) == (1, 2)
+
+
+@pytest.mark.parametrize("body", [b'{"speed": 8333, "power": Infinity, "cadence": NaN, "heartrate": true}',
+                                  b'{"speed": 8333, "power": 1e999}'])
+def test_non_finite_metrics_are_ignored(body):
+    shared_data = sensor_data()
+    state = shared_data.get_sensor(5)
+    state.profile = "power"
+    status, _ = handle_post(shared_data, body, path="/sensor/5", options=JSON)
+    assert status == 200
+    assert state.metrics == NO_METRICS
+
+
+@pytest.mark.parametrize("options", [JSON, FAST], ids=["json", "fast"])
+def test_samples_wake_main_loop_only_when_needed(options):
+    shared_data = sensor_data()
+    # ANT+ stopped: every sample wakes the main loop to start it
+    handle_post(shared_data, b'{"speed": 8333}', path="/sensor/5", options=options)
+    assert shared_data.wakeup.is_set()
+
+    shared_data.runningAnt = True
+    shared_data.wakeup.clear()
+    handle_post(shared_data, b'{"speed": 8333}', path="/sensor/5", options=options)
+    assert not shared_data.wakeup.is_set()
+
+    # a sensor fed again after being idle re-arms the main loop timers
+    state = shared_data.get_sensor(5)
+    state.update(state.snapshot.speed, state.last_post_time - 10.0)
+    handle_post(shared_data, b'{"speed": 8333}', path="/sensor/5", options=options)
+    assert shared_data.wakeup.is_set()
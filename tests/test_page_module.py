@@ -0,0 +1,16 @@
+import pytest
+
+from tpvirtserver.page_module import PageEncoder, SpeedPageEncoder
+
+
+def test_encoder_without_profile_data_cannot_be_created():
+    class Incomplete(PageEncoder):
+        __slots__ = ()
+
+    with pytest.raises(TypeError):
+        Incomplete(8118, ((0x01,),))
+
+
+def test_speed_encoder_encodes():
+    encoder = SpeedPageEncoder(8118)
+    assert len(encoder.encode(8333)) == 8
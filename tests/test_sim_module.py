@@ -0,0 +1,27 @@
+import threading
+
+from tpvirtserver.sim_module import SimNode, SimChannel
+
+
+def test_stop_before_start_is_not_lost():
+    node = SimNode()
+    channel = node.new_channel(SimChannel.Type.BIDIRECTIONAL_TRANSMIT)
+    channel.set_period(328)
+    channel.on_broadcast_tx_data = lambda data: channel.send_broadcast_data([0] * 8)
+    channel.open()
+    # main loop stops the Node before its thread reached the TX loop
+    node.stop()
+    thread = threading.Thread(target=node.start)
+    thread.start()
+    thread.join(1.0)
+    assert not thread.is_alive()
+    assert channel.tx_count == 0
+
+
+def test_stop_ends_running_node():
+    node = SimNode()
+    thread = threading.Thread(target=node.start)
+    thread.start()
+    node.stop()
+    thread.join(1.0)
+    assert not thread.is_alive()
@@ -0,0 +1,33 @@
+import argparse
+import logging
+import threading
+import time
+
+from tpvirtserver import SharedData, COMMAND_QUEUE_SIZE
+from tpvirtserver.worker_module import IngestWorkers, CommandChannel
+
+
+def test_burst_of_worker_commands_is_coalesced():
+    config = argparse.Namespace(device_numbers=[1], workers=1, port=0)
+    shared_data = SharedData()
+    workers = IngestWorkers(config, shared_data, logging.getLogger())
+    forwarder = threading.Thread(target=workers._forward_commands)
+    forwarder.start()
+    try:
+        channel = CommandChannel(workers.command_queue)
+        # more than the queue holds, from a worker faster than the parent drains
+        for _ in range(4 * COMMAND_QUEUE_SIZE):
+            channel.put("ANT_START")
+        channel.put(("CHANNEL_CONFIG", 1, {"period": 8192}))
+        deadline = time.monotonic() + 5.0
+        while shared_data.command_queue.qsize() < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        workers.command_queue.put(None)
+        forwarder.join(5.0)
+        workers.table.close()
+    assert not forwarder.is_alive()
+    assert shared_data.wakeup.is_set()
+    assert shared_data.command_queue.get_nowait() == "ANT_START"
+    assert shared_data.command_queue.get_nowait()[0] == "CHANNEL_CONFIG"
+    assert shared_data.command_queue.qsize() == 0